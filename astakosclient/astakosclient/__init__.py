@@ -21,8 +21,10 @@ import logging
 import urlparse
 import urllib
 import hashlib
+import time
 from base64 import b64encode
-from copy import copy
+from threading import Lock, Thread
+from Queue import Queue, Empty
 
 try:
     import simplejson as json
@@ -31,7 +33,7 @@ except ImportError:
 
 from astakosclient.utils import \
     retry_dec, scheme_to_class, parse_request, check_input, join_urls, \
-    render_overlimit_exception
+    render_overlimit_exception, endpoint_path
 from astakosclient.errors import \
     AstakosClientException, Unauthorized, BadRequest, NotFound, Forbidden, \
     NoUserName, NoUUID, BadValue, QuotaLimit, InvalidResponse, NoEndpoints, \
@@ -75,9 +77,14 @@ class AstakosClient(object):
         auth_url    -- i.e https://accounts.example.com/identity/v2.0
         retry       -- how many time to retry (integer)
         use_pool    -- use objpool for http requests (boolean)
-        pool_size   -- if using pool, define the pool size
+        pool_size   -- if using pool, define the pool size; this is also
+                       the number of concurrent requests of chunked
+                       catalog lookups
         logger      -- pass a different logger
 
+        When using a pool, connections are kept alive and reused by all
+        clients of the process talking to the same host.
+
         """
 
         # Get logger
@@ -107,6 +114,11 @@ class AstakosClient(object):
         self.astakos_base_url = parsed_auth_url.netloc
         self.scheme = parsed_auth_url.scheme
         self.conn_class = conn_class
+        self.pool_size = pool_size
+
+        # Per endpoint request metrics (see get_stats)
+        self.stats = {}
+        self._stats_lock = Lock()
 
         # Initialize astakos api prefixes
         # API urls under auth_url
@@ -237,39 +249,78 @@ class AstakosClient(object):
     def api_oauth2_token(self):
         return join_urls(self.oauth2_prefix, "token")
 
+    # ----------------------------------
+    # Request metrics
+    def _get_endpoint_stats(self, method, request_path):
+        """Return the metrics of an endpoint. Call with _stats_lock held"""
+        endpoint = "%s %s" % (method, endpoint_path(request_path))
+        try:
+            return self.stats[endpoint]
+        except KeyError:
+            stats = self.stats[endpoint] = {
+                "requests": 0, "errors": 0, "retries": 0,
+                "time": 0.0, "max_time": 0.0}
+            return stats
+
+    def _record_request(self, method, request_path, elapsed, failed):
+        with self._stats_lock:
+            stats = self._get_endpoint_stats(method, request_path)
+            stats["requests"] += 1
+            stats["time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+            if failed:
+                stats["errors"] += 1
+
+    def _record_retry(self, request_path, headers=None,
+                      body=None, method="GET", log_body=True):
+        with self._stats_lock:
+            self._get_endpoint_stats(method, request_path)["retries"] += 1
+
+    def get_stats(self):
+        """Return request metrics per endpoint
+
+        The returned dictionary has the endpoints as keys, that is the
+        method and the path of the requests without their query and with
+        their ids replaced, e.g. 'GET /account/v1.0/commissions/[serial]'.
+        Each value is a dictionary with the number of `requests', failed
+        requests (`errors') and `retries', and the total and maximum latency
+        of the requests in seconds (`time', `max_time').
+
+        """
+        with self._stats_lock:
+            return dict((endpoint, dict(stats))
+                        for endpoint, stats in self.stats.iteritems())
+
     # ----------------------------------
     @retry_dec
     def _call_astakos(self, request_path, headers=None,
                       body=None, method="GET", log_body=True):
         """Make the actual call to Astakos Service"""
-        hashed_token = hashlib.sha1()
-        hashed_token.update(self.token)
-        self.logger.debug(
-            "Make a %s request to %s, using token with hash %s, "
-            "with headers %r and body %r",
-            method, request_path, hashed_token.hexdigest(), headers,
-            body if log_body else "(not logged)")
-
-        # Check Input
-        if headers is None:
-            headers = {}
-        if body is None:
-            body = {}
+        if self.logger.isEnabledFor(logging.DEBUG):
+            hashed_token = hashlib.sha1()
+            hashed_token.update(self.token)
+            self.logger.debug(
+                "Make a %s request to %s, using token with hash %s, "
+                "with headers %r and body %r",
+                method, request_path, hashed_token.hexdigest(), headers,
+                body if log_body else "(not logged)")
+
         # Initialize log_request and log_response attributes
         self.log_request = None
         self.log_response = None
 
         # Build request's header and body
         kwargs = {}
-        kwargs['headers'] = copy(headers)
+        kwargs['headers'] = dict(headers) if headers else {}
         kwargs['headers']['X-Auth-Token'] = self.token
         if body:
-            kwargs['body'] = copy(body)
+            kwargs['body'] = body
             kwargs['headers'].setdefault(
                 'content-type', 'application/octet-stream')
         kwargs['headers'].setdefault('content-length',
                                      len(body) if body else 0)
 
+        start = time.time()
         try:
             # Get the connection object
             with self.conn_class(self.astakos_base_url) as conn:
@@ -288,8 +339,12 @@ class AstakosClient(object):
                 self.log_response = dict(
                     status=status, message=message, data=data)
         except Exception as err:
+            self._record_request(method, request_path,
+                                 time.time() - start, True)
             self.logger.error("Failed to send request: %r", err)
             raise ConnectionError(err)
+        self._record_request(method, request_path, time.time() - start,
+                             status < 200 or status >= 300)
 
         # Return
         self.logger.debug("Request returned with status %s", status)
@@ -315,6 +370,64 @@ class AstakosClient(object):
             self.logger.error(msg % (data, str(err)))
             raise InvalidResponse(message=str(err), response=data)
 
+    # ----------------------------------
+    # Split a catalog lookup in chunks and send them concurrently
+    def _chunked_catalog(self, catalog_func, items, req_path, chunk_size,
+                         errors=None):
+        """Merge the catalogs of `items' looked up in chunks
+
+        At most `pool_size' chunks are requested concurrently. If any of
+        the requests fails, the first error is raised once all of them
+        have finished. If an `errors' list is given, the errors are
+        appended to it instead and the catalog of the chunks that were
+        looked up is returned.
+
+        The requests of the chunks run in separate threads, so the
+        `log_request' and `log_response' attributes are reset after a
+        chunked lookup.
+
+        """
+        if not chunk_size or len(items) <= chunk_size:
+            if errors is None:
+                return catalog_func(items, req_path)
+            try:
+                return catalog_func(items, req_path)
+            except Exception as err:
+                errors.append(err)
+                return {}
+
+        chunks = Queue()
+        for start in xrange(0, len(items), chunk_size):
+            chunks.put(items[start:start + chunk_size])
+        catalog = {}
+        failed = []
+
+        def worker():
+            while True:
+                try:
+                    chunk = chunks.get_nowait()
+                except Empty:
+                    return
+                try:
+                    catalog.update(catalog_func(chunk, req_path))
+                except Exception as err:
+                    failed.append(err)
+
+        workers = [Thread(target=worker)
+                   for i in xrange(min(self.pool_size, chunks.qsize()))]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.log_request = None
+        self.log_response = None
+
+        if failed:
+            if errors is None:
+                raise failed[0]
+            errors.extend(failed)
+        return catalog
+
     # ----------------------------------
     # do a POST to ``API_USERCATALOGS`` (or ``API_SERVICE_USERCATALOGS``)
     #   with {'uuids': uuids}
@@ -332,17 +445,23 @@ class AstakosClient(object):
             self.logger.error(msg)
             raise AstakosClientException(message=msg, response=data)
 
-    def get_usernames(self, uuids):
+    def get_usernames(self, uuids, chunk_size=None, errors=None):
         """Return a uuid_catalog dictionary for the given uuids
 
         Keyword arguments:
-        uuids   -- list of user ids (list of strings)
+        uuids       -- list of user ids (list of strings)
+        chunk_size  -- look up at most that many uuids per request
+                       and send the requests concurrently (integer)
+        errors      -- if given, a list where the errors of the failed
+                       requests are appended, instead of being raised
 
         The returned uuid_catalog is a dictionary with uuids as
         keys and the corresponding user names as values
 
         """
-        return self._uuid_catalog(uuids, self.api_usercatalogs)
+        return self._chunked_catalog(self._uuid_catalog, uuids,
+                                     self.api_usercatalogs, chunk_size,
+                                     errors)
 
     def get_username(self, uuid):
         """Return the user name of a uuid (see get_usernames)"""
@@ -353,9 +472,11 @@ class AstakosClient(object):
         else:
             raise NoUserName(uuid)
 
-    def service_get_usernames(self, uuids):
+    def service_get_usernames(self, uuids, chunk_size=None, errors=None):
         """Return a uuid_catalog dict using a service's token"""
-        return self._uuid_catalog(uuids, self.api_service_usercatalogs)
+        return self._chunked_catalog(self._uuid_catalog, uuids,
+                                     self.api_service_usercatalogs,
+                                     chunk_size, errors)
 
     def service_get_username(self, uuid):
         """Return the displayName of a uuid using a service's token"""
@@ -383,18 +504,23 @@ class AstakosClient(object):
             self.logger.error(msg)
             raise AstakosClientException(message=msg, response=data)
 
-    def get_uuids(self, display_names):
+    def get_uuids(self, display_names, chunk_size=None, errors=None):
         """Return a displayname_catalog for the given names
 
         Keyword arguments:
         display_names   -- list of user names (list of strings)
+        chunk_size      -- look up at most that many names per request
+                           and send the requests concurrently (integer)
+        errors          -- if given, a list where the errors of the failed
+                           requests are appended, instead of being raised
 
         The returned displayname_catalog is a dictionary with
         the names as keys and the corresponding uuids as values
 
         """
-        return self._displayname_catalog(
-            display_names, self.api_usercatalogs)
+        return self._chunked_catalog(self._displayname_catalog,
+                                     display_names, self.api_usercatalogs,
+                                     chunk_size, errors)
 
     def get_uuid(self, display_name):
         """Return the uuid of a name (see getUUIDs)"""
@@ -405,10 +531,13 @@ class AstakosClient(object):
         else:
             raise NoUUID(display_name)
 
-    def service_get_uuids(self, display_names):
+    def service_get_uuids(self, display_names, chunk_size=None,
+                          errors=None):
         """Return a display_name catalog using a service's token"""
-        return self._displayname_catalog(
-            display_names, self.api_service_usercatalogs)
+        return self._chunked_catalog(self._displayname_catalog,
+                                     display_names,
+                                     self.api_service_usercatalogs,
+                                     chunk_size, errors)
 
     def service_get_uuid(self, display_name):
         """Return the uuid of a name using a service's token"""
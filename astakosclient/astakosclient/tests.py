@@ -548,6 +548,24 @@ class TestCallAstakos(unittest.TestCase):
         """Test _get_user_catalogs using pool"""
         self._get_user_catalogs(True)
 
+    # ----------------------------------
+    # Test the request metrics
+    def test_stats(self):
+        """Test the request metrics of failed and retried requests"""
+        global token, auth_url
+        client = AstakosClient(token['id'], auth_url, retry=2)
+        self.assertRaises(BadRequest, client._call_astakos, api_usercatalogs)
+        self.assertRaises(NotFound, client._call_astakos,
+                          "/astakos/api/misspelled")
+        stats = client.get_stats()
+        catalogs = stats["POST " + api_usercatalogs]
+        self.assertEqual(catalogs['requests'], 3)
+        self.assertEqual(catalogs['errors'], 3)
+        self.assertEqual(catalogs['retries'], 2)
+        misspelled = stats["GET /astakos/api/misspelled"]
+        self.assertEqual(misspelled['requests'], 1)
+        self.assertEqual(misspelled['retries'], 0)
+
 
 class TestAuthenticate(unittest.TestCase):
     """Test cases for function getUserInfo"""
@@ -635,6 +653,58 @@ class TestDisplayNames(unittest.TestCase):
             self.fail("Shouldn't raise an Exception: %s" % e)
         self.assertEqual(info, user['name'])
 
+    # ----------------------------------
+    # Get usernames in chunks
+    def test_usernames_chunked(self):
+        """Test get_usernames with chunked requests"""
+        global token, user, auth_url
+        uuids = [str(i) for i in range(250)] + [user['id']]
+        client = AstakosClient(token['id'], auth_url, pool_size=2)
+        catalog = client.get_usernames(uuids, chunk_size=100)
+        self.assertEqual(catalog, {user['id']: user['name']})
+        stats = client.get_stats()["POST " + api_usercatalogs]
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['errors'], 0)
+        self.assertEqual(stats['retries'], 0)
+
+    # ----------------------------------
+    # Get usernames in chunks with invalid token
+    def test_usernames_chunked_invalid_token(self):
+        """Test get_usernames with chunked requests and invalid token"""
+        global token, auth_url
+        client = AstakosClient(token['id'], auth_url)
+        client.get_endpoints()
+        client.token = "skaksaFlBl+fasFdaf24sx"
+        self.assertRaises(Unauthorized, client.get_usernames,
+                          [str(i) for i in range(250)], chunk_size=100)
+        stats = client.get_stats()["POST " + api_usercatalogs]
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['errors'], 3)
+
+    # ----------------------------------
+    # Get usernames in chunks, keeping the names of the successful chunks
+    def test_usernames_chunked_errors(self):
+        """Test get_usernames with chunked requests that partly fail"""
+        global token, user, auth_url
+        client = AstakosClient(token['id'], auth_url)
+        uuid_catalog = client._uuid_catalog
+
+        def failing_catalog(uuids, req_path):
+            if user['id'] not in uuids:
+                raise NotFound("Not Found", None)
+            return uuid_catalog(uuids, req_path)
+        client._uuid_catalog = failing_catalog
+
+        uuids = [str(i) for i in range(250)] + [user['id']]
+        errors = []
+        catalog = client.get_usernames(uuids, chunk_size=100, errors=errors)
+        self.assertEqual(catalog, {user['id']: user['name']})
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(all(isinstance(e, NotFound) for e in errors))
+        self.assertEqual(client.log_request, None)
+        self.assertRaises(NotFound, client.get_usernames, uuids,
+                          chunk_size=100)
+
     # ----------------------------------
     # Get info with wrong uuid
     def test_no_username(self):
@@ -685,6 +755,18 @@ class TestGetUUIDs(unittest.TestCase):
             self.fail("Shouldn't raise an Exception")
         self.assertEqual(catalog[user['name']], user['id'])
 
+    # ----------------------------------
+    # Get uuids in chunks
+    def test_get_uuids_chunked(self):
+        """Test get_uuids with chunked requests"""
+        global token, user, auth_url
+        names = [user['name']] + ["user%d" % i for i in range(20)]
+        client = AstakosClient(token['id'], auth_url, use_pool=True)
+        catalog = client.get_uuids(names, chunk_size=3)
+        self.assertEqual(catalog, {user['name']: user['id']})
+        stats = client.get_stats()["POST " + api_usercatalogs]
+        self.assertEqual(stats['requests'], 7)
+
     # ----------------------------------
     # Get uuid with wrong username
     def test_no_uuid(self):
@@ -826,6 +908,20 @@ class TestCommissions(unittest.TestCase):
             self.fail("Shouldn't raise Exception %s" % err)
         self.assertEqual(response, commission_description)
 
+    # ----------------------------------
+    def test_get_commission_info_stats(self):
+        """Test that the metrics of all the serials are kept together"""
+        global token, auth_url
+        client = AstakosClient(token['id'], auth_url)
+        client.get_commission_info(57)
+        self.assertRaises(NotFound, client.get_commission_info, 58)
+        stats = client.get_stats()
+        endpoint = "GET " + join_urls(api_commissions, "[serial]")
+        self.assertEqual([e for e in stats if "commissions" in e],
+                         [endpoint])
+        self.assertEqual(stats[endpoint]['requests'], 2)
+        self.assertEqual(stats[endpoint]['errors'], 1)
+
     # ----------------------------------
     def test_get_commission_info_not_found(self):
         """Test function call of get_commission_info with invalid serial"""
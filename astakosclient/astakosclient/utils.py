@@ -49,6 +49,7 @@ def retry_dec(func):
                     # return immediately
                     raise err
                 self.logger.warning("AstakosClient request failed..retrying")
+                self._record_retry(*args, **kwargs)
                 attemps += 1
     return decorator
 
@@ -108,6 +109,27 @@ def join_urls(url_a, url_b):
     return url_a.rstrip("/") + "/" + url_b.lstrip("/")
 
 
+# The collections of Astakos whose members are identified in the request
+# paths, with the placeholders that replace the ids in the endpoints
+ENDPOINT_IDS = {
+    "tokens": "[id]",
+    "commissions": "[serial]",
+    "projects": "[id]",
+    "memberships": "[id]",
+}
+ENDPOINT_NAMES = ["action", "memberships"]
+
+
+def endpoint_path(path):
+    """Drop the query and replace the ids in the path of a request"""
+    parts = path.split("?", 1)[0].split("/")
+    for i in range(1, len(parts)):
+        placeholder = ENDPOINT_IDS.get(parts[i - 1])
+        if placeholder and parts[i] and parts[i] not in ENDPOINT_NAMES:
+            parts[i] = placeholder
+    return "/".join(parts)
+
+
 def render_overlimit_exception(response, logger):
     """Render a human readable message for QuotaLimit Exception"""
     resource_name = {
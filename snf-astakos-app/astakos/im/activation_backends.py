@@ -18,6 +18,7 @@ from django.core.exceptions import ImproperlyConfigured
 from django.utils.translation import ugettext as _
 
 from snf_django.lib.api import faults
+from snf_django.lib.astakos import invalidate_token
 
 from astakos.im import models
 from astakos.im import functions
@@ -361,6 +362,7 @@ class ActivationBackend(object):
         user.is_active = False
         user.deactivated_reason = reason
         user.save()
+        invalidate_token(user.auth_token)
         logger.info("User deactivated: %s", user.log_display)
         return ActivationResult(self.Result.DEACTIVATED)
 
@@ -110,7 +110,9 @@ class Command(SynnefoCommand):
             to_sync = []
             for holder, source, resource, value, qh_value in unsynced:
                 to_sync.append(((holder, source, resource), value))
-            quotas.qh.set_quota(to_sync)
+            updated, created = quotas.qh.set_quota(to_sync)
+            write("Updated %s and created %s holdings.\n"
+                  % (updated, created))
 
             if check_unexpected:
                 to_del = []
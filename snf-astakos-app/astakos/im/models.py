@@ -40,6 +40,7 @@ from django.utils.importlib import import_module
 from django.utils.safestring import mark_safe
 
 from synnefo.lib.utils import dict_merge
+from snf_django.lib.astakos import invalidate_token
 
 from astakos.im import settings as astakos_settings
 from astakos.im import auth_providers as auth
@@ -125,6 +126,7 @@ class Component(models.Model):
         else:
             raise ValueError('Could not generate a token')
 
+        invalidate_token(self.auth_token)
         self.auth_token = new_token
         self.auth_token_created = datetime.now()
         if expiration_date:
@@ -569,6 +571,7 @@ class AstakosUser(User):
         else:
             raise ValueError('Could not generate a token')
 
+        invalidate_token(self.auth_token)
         self.auth_token = new_token
         self.auth_token_created = datetime.now()
         self.auth_token_expires = self.auth_token_created + \
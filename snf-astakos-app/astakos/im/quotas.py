@@ -185,7 +185,7 @@ def _level_quota_dict(quotas):
 
 def set_quota(quotas, resource=None):
     q = _level_quota_dict(quotas)
-    qh.set_quota(q, resource=resource)
+    return qh.set_quota(q, resource=resource)
 
 
 PENDING_APP_RESOURCE = 'astakos.pending_app'
@@ -285,7 +285,7 @@ def list_user_quotas(users, qhflt=None):
 def qh_sync_projects(projects, resource=None):
     p_quota, u_quota = astakos_project_quotas(projects, resource=resource)
     p_quota.update(u_quota)
-    set_quota(p_quota, resource=resource)
+    return set_quota(p_quota, resource=resource)
 
 
 def qh_sync_project(project):
@@ -0,0 +1,99 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+from mock import patch
+
+from astakosclient.errors import Unauthorized
+from snf_django.lib import astakos
+from snf_django.lib.api.utils import isoformat
+from astakos.im.auth import make_local_user
+from astakos.im.models import AstakosUser
+from astakos.im.user_logic import verify, accept, deactivate
+
+
+def user_info(token, expires):
+    return {"access": {"token": {"id": token,
+                                 "expires": isoformat(expires)},
+                       "user": {"id": "uuid-%s" % token}}}
+
+
+class TokenCacheTest(TestCase):
+    def setUp(self):
+        self.cache = astakos.TokenCache(60, negative_ttl=60,
+                                        prefix="test_token")
+        patcher = patch("snf_django.lib.astakos._token_cache", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.cache.backend.clear()
+        AstakosUser.objects.all().delete()
+
+    def test_cache(self):
+        info = user_info("token1", datetime.utcnow() + timedelta(hours=1))
+        self.assertEqual(self.cache.get("token1"), None)
+        self.cache.set("token1", info)
+        self.assertEqual(self.cache.get("token1"), info)
+        self.cache.invalidate("token1")
+        self.assertEqual(self.cache.get("token1"), None)
+
+        # Expired tokens are not cached
+        info = user_info("token2", datetime.utcnow() - timedelta(seconds=1))
+        self.cache.set("token2", info)
+        self.assertEqual(self.cache.get("token2"), None)
+
+        # Nor are responses without an expiration date
+        self.cache.set("token3", {"access": {"token": {"id": "token3"}}})
+        self.assertEqual(self.cache.get("token3"), None)
+
+    def test_negative_cache(self):
+        self.cache.set_invalid("token1", Unauthorized("Invalid token"))
+        self.assertRaises(Unauthorized, self.cache.get, "token1")
+
+        self.cache.negative_ttl = 0
+        self.cache.set_invalid("token2", Unauthorized("Invalid token"))
+        self.assertEqual(self.cache.get("token2"), None)
+
+    @patch("astakosclient.AstakosClient.authenticate")
+    def test_authenticate(self, authenticate):
+        url = "https://accounts.example.synnefo.org/identity/v2.0"
+        info = user_info("token1", datetime.utcnow() + timedelta(hours=1))
+        authenticate.return_value = info
+        for i in range(3):
+            self.assertEqual(astakos.user_for_token("token1", url), info)
+        self.assertEqual(authenticate.call_count, 1)
+
+        authenticate.side_effect = Unauthorized("Invalid token")
+        for i in range(3):
+            self.assertEqual(astakos.user_for_token("token2", url), None)
+        self.assertEqual(authenticate.call_count, 2)
+
+    def test_invalidate_on_renew(self):
+        user = make_local_user("user1@synnefo.org")
+        verify(user, user.verification_code)
+        accept(user)
+        token = user.auth_token
+        self.cache.set(token, user_info(token, user.auth_token_expires))
+        user.renew_token()
+        user.save()
+        self.assertEqual(self.cache.get(token), None)
+
+        token = user.auth_token
+        self.cache.set(token, user_info(token, user.auth_token_expires))
+        self.assertFalse(deactivate(user).is_error())
+        self.assertEqual(self.cache.get(token), None)
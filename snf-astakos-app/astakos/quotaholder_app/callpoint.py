@@ -13,6 +13,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import operator
 from datetime import datetime
 from django.db.models import Q
 from astakos.quotaholder_app.exception import (
@@ -29,6 +30,10 @@ from astakos.quotaholder_app.models import (
     Holding, Commission, Provision, ProvisionLog)
 
 
+# Maximum number of holdings that are looked up or written in a single query
+QUOTA_CHUNK_SIZE = 300
+
+
 def format_datetime(d):
     return d.strftime('%Y-%m-%dT%H:%M:%S.%f')[:24]
 
@@ -64,28 +69,46 @@ def delete_quota(keys):
                                resource=resource).delete()
 
 
-def _get_holdings_for_update(holding_keys, resource=None, delete=False):
-    flt = Q(resource=resource) if resource is not None else Q()
-    holders = set(holder for (holder, source, resource) in holding_keys)
-    objs = Holding.objects.filter(flt, holder__in=holders).order_by('pk')
-    hs = objs.select_for_update()
+def _holding_keys_filter(holding_keys):
+    """Build a filter that matches exactly the holdings with the given keys.
+
+    Keys are grouped by holder and source, so that a commission on several
+    resources of a user and a project is matched with a few conditions.
+
+    """
+    groups = _partition_by(lambda k: (k[0], k[1]), holding_keys,
+                           lambda k: k[2])
+    flts = [Q(holder=holder, source=source, resource__in=resources)
+            for (holder, source), resources in sorted(groups.items())]
+    return reduce(operator.or_, flts)
 
+
+def _get_holdings_for_update(holding_keys):
+    """Lock and return the holdings with the given keys.
+
+    Only the requested holdings are locked, so that commissions on unrelated
+    resources of the same holder do not wait for each other. Rows are locked
+    in primary key order, to avoid deadlocks between concurrent requests.
+
+    """
     keys = set(holding_keys)
+    if not keys:
+        return {}
+
+    objs = Holding.objects.filter(_holding_keys_filter(keys)).order_by('pk')
+    hs = objs.select_for_update()
+
     holdings = {}
-    put_back = []
     for h in hs:
-        key = h.holder, h.source, h.resource
-        if key in keys:
-            holdings[key] = h
-        else:
-            put_back.append(h)
-
-    if delete:
-        objs.delete()
-        Holding.objects.bulk_create(put_back)
+        holdings[h.holder, h.source, h.resource] = h
     return holdings
 
 
+def _chunks(l, size):
+    for i in xrange(0, len(l), size):
+        yield l[i:i + size]
+
+
 def _mkProvision(key, quantity):
     holder, source, resource = key
     return {'holder': holder,
@@ -96,29 +119,54 @@ def _mkProvision(key, quantity):
 
 
 def set_quota(quotas, resource=None):
-    holding_keys = [key for (key, limit) in quotas]
-    holdings = _get_holdings_for_update(
-        holding_keys, resource=resource, delete=True)
+    """Set the limits of holdings, creating the holdings that do not exist.
 
-    new_holdings = {}
+    Only the holdings whose limit changes are updated and the rest are left
+    untouched. Large sets of quotas are processed in chunks of
+    QUOTA_CHUNK_SIZE holdings. If `resource' is given, quotas for other
+    resources are ignored. Returns the number of updated and of created
+    holdings.
+
+    """
+    limits = {}
     for key, limit in quotas:
-        holder, source, res = key
-        if resource is not None and resource != res:
+        if resource is not None and resource != key[2]:
             continue
-        h = Holding(holder=holder,
-                    source=source,
-                    resource=res,
-                    limit=limit)
-        try:
-            h_old = holdings[key]
-            h.usage_min = h_old.usage_min
-            h.usage_max = h_old.usage_max
-            h.id = h_old.id
-        except KeyError:
-            pass
-        new_holdings[key] = h
-
-    Holding.objects.bulk_create(new_holdings.values())
+        limits[key] = limit
+
+    # Find the existing holdings, so that they are locked in primary key
+    # order, like in _get_holdings_for_update
+    pks = []
+    for keys in _chunks(sorted(limits.keys()), QUOTA_CHUNK_SIZE):
+        objs = Holding.objects.filter(_holding_keys_filter(keys))
+        pks.extend(objs.values_list('pk', flat=True))
+    pks.sort()
+
+    updated = 0
+    existing = set()
+    for chunk in _chunks(pks, QUOTA_CHUNK_SIZE):
+        hs = Holding.objects.filter(pk__in=chunk).order_by('pk')
+        changed = {}
+        for h in hs.select_for_update():
+            key = h.holder, h.source, h.resource
+            existing.add(key)
+            limit = limits[key]
+            if h.limit != limit:
+                changed.setdefault(limit, []).append(h.pk)
+        for limit, changed_pks in changed.iteritems():
+            updated += Holding.objects.filter(pk__in=changed_pks).update(
+                limit=limit)
+
+    new_holdings = [Holding(holder=holder,
+                            source=source,
+                            resource=res,
+                            limit=limit)
+                    for (holder, source, res), limit in sorted(limits.items())
+                    if (holder, source, res) not in existing]
+    for chunk in _chunks(new_holdings, QUOTA_CHUNK_SIZE):
+        Holding.objects.bulk_create(chunk)
+
+    return updated, len(new_holdings)
 
 
 def _merge_same_keys(provisions):
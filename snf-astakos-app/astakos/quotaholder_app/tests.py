@@ -14,6 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from django.test import TestCase
+from mock import patch
 
 from snf_django.utils.testing import assertGreater, assertIn, assertRaises
 from astakos.quotaholder_app import models
@@ -260,3 +261,36 @@ class QuotaholderTest(TestCase):
         r = qh.get_quota(holders=[holder])
         self.assertEqual(r, {(holder, source, resource1): (limit2, 1, 1),
                              (holder, source, resource2): (22, 2, 2)})
+
+    def test_040_holdings_for_update(self):
+        qh.set_quota([(('h0', 'system', 'r1'), 10),
+                      (('h0', 'system', 'r2'), 10),
+                      (('h0', None, 'r1'), 10),
+                      (('h1', 'system', 'r1'), 10)])
+
+        keys = [('h0', 'system', 'r1'), ('h0', None, 'r1'),
+                ('h0', 'system', 'r3')]
+        holdings = qh._get_holdings_for_update(keys)
+        self.assertEqual(sorted(holdings.keys()),
+                         [('h0', None, 'r1'), ('h0', 'system', 'r1')])
+        self.assertEqual(qh._get_holdings_for_update([]), {})
+
+    def test_050_set_counts(self):
+        quotas = [(('h%d' % i, 'system', 'r1'), 10) for i in range(5)]
+        self.assertEqual(qh.set_quota(quotas), (0, 5))
+        self.assertEqual(qh.set_quota(quotas), (0, 0))
+
+        serial = self.issue_commission([(('h0', 'system', 'r1'), 3)])
+        qh.resolve_pending_commission(self.client, serial)
+
+        quotas = [(('h%d' % i, 'system', 'r1'), 10 + i % 2)
+                  for i in range(7)]
+        with patch.object(qh, 'QUOTA_CHUNK_SIZE', 2):
+            self.assertEqual(qh.set_quota(quotas), (2, 2))
+            self.assertEqual(qh.set_quota(quotas, resource='r2'), (0, 0))
+
+        r = qh.get_quota(resources=['r1'])
+        self.assertEqual(len(r), 7)
+        self.assertEqual(r[('h0', 'system', 'r1')], (10, 3, 3))
+        self.assertEqual(r[('h1', 'system', 'r1')], (11, 0, 0))
+        self.assertEqual(r[('h6', 'system', 'r1')], (10, 0, 0))
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of concurrent commissions against a single project.
+
+Each thread issues and accepts commissions for its own user on a member of
+the same project, in the same way that services commission the resources of
+their users. By default each thread commissions a different resource, so
+the threads should not wait for each other's locks. With --shared all the
+threads commission the same resource, which serializes them and gives the
+baseline throughput.
+
+"""
+
+import os
+from optparse import OptionParser
+from time import sleep, time
+import threading
+import logging
+
+path = os.path.dirname(os.path.realpath(__file__))
+os.environ['SYNNEFO_SETTINGS_DIR'] = path + '/settings'
+os.environ['DJANGO_SETTINGS_MODULE'] = 'synnefo.settings'
+
+from django.db import close_connection
+
+from astakos.im import transaction
+import astakos.quotaholder_app.callpoint as qh
+
+
+PROJECT = 'project:bench'
+CLIENTKEY = 'bench'
+LIMIT = 10 ** 15
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def user_holder(i):
+    return 'user:bench%d' % i
+
+
+def resource_name(i, shared):
+    return 'bench.resource' if shared else 'bench.resource%d' % i
+
+
+@transaction.commit_on_success
+def setup(threads, shared):
+    quotas = []
+    for i in range(threads):
+        resource = resource_name(i, shared)
+        quotas.append(((PROJECT, None, resource), LIMIT))
+        quotas.append(((user_holder(i), PROJECT, resource), LIMIT))
+    qh.set_quota(quotas)
+
+
+@transaction.commit_on_success
+def issue(provisions, hold):
+    serial = qh.issue_commission(CLIENTKEY, provisions, name='bench')
+    # Keep the holdings locked, as a request that does more work would
+    sleep(hold)
+    return serial
+
+
+@transaction.commit_on_success
+def accept(serial):
+    qh.resolve_pending_commission(CLIENTKEY, serial)
+
+
+class CommissionT(threading.Thread):
+    def __init__(self, *args, **kwargs):
+        self.index = kwargs.pop('index')
+        self.shared = kwargs.pop('shared')
+        self.repeat = kwargs.pop('repeat', 1)
+        self.hold = kwargs.pop('hold', 0)
+        threading.Thread.__init__(self, *args, **kwargs)
+        self.errors = 0
+
+    def run(self):
+        resource = resource_name(self.index, self.shared)
+        provisions = [((PROJECT, None, resource), 1),
+                      ((user_holder(self.index), PROJECT, resource), 1)]
+        try:
+            for i in range(self.repeat):
+                try:
+                    accept(issue(provisions, self.hold))
+                except Exception as e:
+                    logger.exception(e)
+                    self.errors += 1
+        finally:
+            close_connection()
+
+
+def test(threads, repeat, hold, shared):
+    logging.basicConfig()
+
+    setup(threads, shared)
+
+    workers = [CommissionT(index=i, shared=shared, repeat=repeat, hold=hold)
+               for i in range(threads)]
+    start = time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time() - start
+
+    errors = sum(worker.errors for worker in workers)
+    commissions = threads * repeat - errors
+    logger.info('%d commissions (%d failed) by %d threads in %.2f seconds:'
+                ' %.2f commissions/sec'
+                % (commissions, errors, threads, elapsed,
+                   commissions / elapsed))
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--threads',
+                      dest='threads',
+                      default=8,
+                      help="Number of concurrent threads (default=8)")
+    parser.add_option('--repeat',
+                      dest='repeat',
+                      default=50,
+                      help="Number of commissions per thread (default=50)")
+    parser.add_option('--hold',
+                      dest='hold',
+                      default=0.01,
+                      help="Seconds to hold the locks of each commission"
+                           " (default=0.01)")
+    parser.add_option('--shared',
+                      action='store_true',
+                      dest='shared',
+                      default=False,
+                      help="Commission the same resource from all threads")
+
+    (options, args) = parser.parse_args()
+
+    test(int(options.threads), int(options.repeat), float(options.hold),
+         options.shared)
+
+
+if __name__ == "__main__":
+    main()
@@ -75,3 +75,6 @@ CLOUDBAR_MENU_URL = '/ui/get_menu'
 TEST_RUNNER = 'pithos.api.test.PithosTestSuiteRunner'
 
 CYCLADES_VOLUME_MAX_SIZE = 100000
+
+# Reload the backends on every allocation
+BACKEND_ALLOCATOR_MODEL_TIMEOUT = 0
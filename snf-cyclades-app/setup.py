@@ -60,7 +60,7 @@ INSTALL_REQUIRES = [
     'snf-django-lib',
     'snf-branding',
     'snf-webproject',
-    'requests>=0.12.1',
+    'requests>=2.4.0',
     'paramiko'
 ]
 
@@ -29,6 +29,15 @@ GANETI_CREATEINSTANCE_KWARGS = {
                  "xen-hvm": {}},
 }
 
+# Maximum number of clients of the RAPI of each Ganeti backend, per process.
+# Each client keeps persistent connections to the RAPI, which are reused by
+# its requests.
+GANETI_RAPI_POOL_SIZE = 8
+# Timeouts, in seconds, for connecting to the RAPI of a Ganeti backend and for
+# reading its responses. None means no timeout.
+GANETI_RAPI_CONNECT_TIMEOUT = 10
+GANETI_RAPI_READ_TIMEOUT = None
+
 # If True, qemu-kvm will hotplug a NIC when connecting a vm to
 # a network. This requires qemu-kvm=1.0.
 GANETI_USE_HOTPLUG = True
@@ -43,8 +52,19 @@ GANETI_DISKS_WAIT_FOR_SYNC = False
 
 # This module implements the strategy for allocating a vm to a backend
 BACKEND_ALLOCATOR_MODULE = "synnefo.logic.allocators.default_allocator"
+# Policy of the "synnefo.logic.allocators.vector_allocator" allocation
+# strategy: "best_fit" packs the VMs in as few backends as possible,
+# "worst_fit" places each VM in the backend with the most free resources and
+# "spread" balances the usage of the resources of the backends.
+BACKEND_ALLOCATOR_POLICY = "best_fit"
+# Maximum number of virtual CPUs per physical CPU of a backend, used by the
+# "synnefo.logic.allocators.vector_allocator" allocation strategy
+BACKEND_ALLOCATOR_VCPU_RATIO = 3
 # Refresh backend statistics timeout, in minutes, used in backend allocation
 BACKEND_REFRESH_MIN = 15
+# Seconds for which the backend allocator uses its in-memory model of the free
+# resources of the backends, before reloading it from the DB
+BACKEND_ALLOCATOR_MODEL_TIMEOUT = 30
 
 # Maximum number of NICs per Ganeti instance. This value must be less or equal
 # than 'max:nic-count' option of Ganeti's ipolicy.
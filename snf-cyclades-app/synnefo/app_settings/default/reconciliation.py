@@ -5,3 +5,12 @@
 
 # Minutes between reconciliations
 RECONCILIATION_MIN = 30
+
+# File with the state of the previous reconciliation of each backend, which is
+# used by incremental reconciliations ('snf-manage reconcile-servers
+# --incremental')
+RECONCILIATION_STATE_FILE = "/var/lib/synnefo/reconciliation-state.json"
+
+# Hours between full reconciliations of a backend, when reconciliations are
+# incremental
+RECONCILIATION_FULL_SWEEP_HOURS = 24
@@ -39,6 +39,13 @@ class PoolManager(object):
     Important!!: Updates on a PoolManager object are not reflected to the DB,
     until save() method is called.
 
+    The bitarray of the available values of the pool, along with their count,
+    is cached and updated on each change. Also, all the values before the
+    'next free' hint are known to be unavailable, so that searching for an
+    available value does not have to scan the pool from its start. Changes on
+    the 'available' and 'reserved' bitarrays must be done with the methods of
+    this class.
+
     """
     def __init__(self, pool_table):
         self.pool_table = pool_table
@@ -50,6 +57,7 @@ class PoolManager(object):
             self.available = self._create_empty_pool(self.pool_size)
             self.reserved = self._create_empty_pool(self.pool_size)
             self.add_padding(self.pool_size)
+        self._update_pool()
 
     def _create_empty_pool(self, size):
         ba = bitarray(size)
@@ -66,18 +74,23 @@ class PoolManager(object):
         self.available = self.available[:-bits]
         self.reserved = self.reserved[:-bits]
 
+    def _update_pool(self):
+        """Recompute the cached bitarray of the available values."""
+        self._pool = self.available & self.reserved
+        self._available_count = self._pool.count(AVAILABLE)
+        self._next_free = 0
+
     @property
     def pool(self):
-        return (self.available & self.reserved)
+        """The bitarray of the available values. It must not be modified."""
+        return self._pool
 
     def get(self, value=None):
         """Get a value from the pool."""
         if value is None:
             if self.empty():
                 raise EmptyPool
-            # Get the first available index
-            index = int(self.pool.index(AVAILABLE))
-            assert(index < self.pool_size)
+            index = self._find_available()
             self._reserve(index)
             return self.index_to_value(index)
         else:
@@ -89,6 +102,30 @@ class PoolManager(object):
             else:
                 raise ValueNotAvailable("Value %s is not available" % value)
 
+    def get_many(self, count):
+        """Get `count' values from the pool.
+
+        The values are found with a single scan of the pool. If the pool does
+        not contain enough available values, EmptyPool is raised and no value
+        is reserved.
+
+        """
+        if count > self._available_count:
+            raise EmptyPool
+        indexes = []
+        for _ in xrange(count):
+            index = self._find_available()
+            self._reserve(index)
+            indexes.append(index)
+        return [self.index_to_value(i) for i in indexes]
+
+    def _find_available(self):
+        """Get the first available index, starting from the hint."""
+        index = int(self._pool.index(AVAILABLE, self._next_free))
+        assert(index < self.pool_size)
+        self._next_free = index + 1
+        return index
+
     def put(self, value, external=False):
         """Return a value to the pool."""
         if value is None:
@@ -106,6 +143,14 @@ class PoolManager(object):
         self._reserve(index, external)
         return True
 
+    def set_maps(self, available=None, reserved=None):
+        """Replace the bitarrays of the available and reserved values."""
+        if available is not None:
+            self.available = bitarray(available)
+        if reserved is not None:
+            self.reserved = bitarray(reserved)
+        self._update_pool()
+
     def save(self, db=True):
         """Save changes to the DB."""
         self.pool_table.available_map = _bitarray_to_string(self.available)
@@ -115,23 +160,31 @@ class PoolManager(object):
 
     def empty(self):
         """Return True when pool is empty."""
-        return not self.pool.any()
+        return self._available_count == 0
 
     def size(self):
         """Return the size of the bitarray(original size + padding)."""
-        return self.pool.length()
+        return self._pool.length()
 
     def _reserve(self, index, external=False):
         if external:
             self.reserved[index] = UNAVAILABLE
         else:
             self.available[index] = UNAVAILABLE
+        if self._pool[index] == AVAILABLE:
+            self._pool[index] = UNAVAILABLE
+            self._available_count -= 1
 
     def _release(self, index, external=False):
         if external:
             self.reserved[index] = AVAILABLE
         else:
             self.available[index] = AVAILABLE
+        if self._pool[index] == UNAVAILABLE and self.available[index] and\
+           self.reserved[index]:
+            self._pool[index] = AVAILABLE
+            self._available_count += 1
+            self._next_free = min(self._next_free, index)
 
     def contains(self, value, index=False):
         if index is False:
@@ -139,7 +192,7 @@ class PoolManager(object):
         return index >= 0 and index < self.pool_size
 
     def count_available(self):
-        return self.pool.count(AVAILABLE)
+        return self._available_count
 
     def count_unavailable(self):
         return self.pool_size - self.count_available()
@@ -202,6 +255,7 @@ class PoolManager(object):
         self.pool_size = self.pool_size + bits_num
         self.add_padding(self.pool_size)
         self.pool_table.size = self.pool_size
+        self._update_pool()
 
     def index_to_value(self, index):
         raise NotImplementedError
@@ -102,6 +102,17 @@ class PoolManagerTestCase(TestCase):
         pool.put(0)
         self.assertEqual(pool.get(), 1)
 
+    def test_set_maps(self):
+        obj = DummyObject(8)
+        pool = DummyPool(obj)
+        self.assertEqual(pool.get(), 0)
+        pool.set_maps(available=bitarray('10111111'))
+        self.assertEqual(pool.count_available(), 7)
+        self.assertEqual(pool.is_available(0), True)
+        self.assertEqual(pool.is_available(1), False)
+        self.assertEqual(pool.get(), 0)
+        self.assertEqual(pool.get(), 2)
+
     def test_extend_pool(self):
         obj = DummyObject(42)
         pool = DummyPool(obj)
@@ -138,6 +149,40 @@ class PoolManagerTestCase(TestCase):
         self.assertEqual(pool.count_reserved(), 1)
         self.assertEqual(pool.count_unreserved(), 9)
 
+    def test_get_many(self):
+        obj = DummyObject(10)
+        pool = DummyPool(obj)
+        pool.reserve(1)
+        pool.reserve(3, external=True)
+        self.assertEqual(pool.get_many(3), [0, 2, 4])
+        self.assertEqual(pool.count_available(), 5)
+        # Not enough values: nothing is reserved
+        self.assertRaises(EmptyPool, pool.get_many, 6)
+        self.assertEqual(pool.count_available(), 5)
+        self.assertEqual(pool.get_many(5), [5, 6, 7, 8, 9])
+        self.assertTrue(pool.empty())
+        self.assertEqual(pool.get_many(0), [])
+
+    def test_next_free(self):
+        obj = DummyObject(10)
+        pool = DummyPool(obj)
+        self.assertEqual(pool.get_many(5), range(5))
+        # Released values are found again
+        pool.put(2)
+        pool.put(1, external=True)
+        self.assertEqual(pool.get(), 2)
+        self.assertEqual(pool.get(), 5)
+        # Values are available only when both released and unreserved
+        pool.reserve(6, external=True)
+        pool.put(3)
+        pool.reserve(3, external=True)
+        self.assertEqual(pool.get(), 7)
+        pool.put(6, external=True)
+        self.assertEqual(pool.get(), 6)
+        self.assertEqual(pool.count_available(), 2)
+        pool.save()
+        self.assertEqual(DummyPool(obj).to_01(), pool.to_01())
+
 
 class HelpersTestCase(TestCase):
     def test_find_padding(self):
@@ -0,0 +1,147 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Simulation of allocation strategies.
+
+An allocation trace is a sequence of (action, vm_id, vm) events, where the
+action is either 'create' or 'delete' and the vm is a dictionary with the
+'cpu', 'ram' and 'disk' of the vm, as passed to the allocation strategies.
+Replaying a trace on a set of empty simulated backends shows how a strategy
+would have placed the vms and how fragmented the free resources of the
+backends would be.
+
+"""
+
+from __future__ import division
+import json
+
+from collections import defaultdict
+
+from synnefo.logic.allocators import vector_allocator
+
+
+RESOURCES = ("cpu", "ram", "disk")
+
+
+class SimulatedBackend(object):
+    """An empty backend with the attributes used by the allocation strategies.
+
+    The free resources of the backend may become negative, when vms are
+    allocated to a backend that can not host them.
+
+    """
+
+    def __init__(self, id, clustername, mtotal, dtotal, ctotal):
+        self.id = id
+        self.clustername = clustername
+        self.mtotal = self.mfree = mtotal
+        self.dtotal = self.dfree = dtotal
+        self.ctotal = ctotal
+        self.pinst_cnt = 0
+        self.vcpus = 0
+
+    def __repr__(self):
+        return "<SimulatedBackend %s>" % self.clustername
+
+    def fits(self, vm):
+        free, _ = vector_allocator.backend_vectors(self)
+        return vector_allocator.fits(free, vector_allocator.vm_vector(vm))
+
+    def add(self, vm):
+        self.mfree -= vm['ram']
+        self.dfree -= vm['disk']
+        self.vcpus += vm['cpu']
+        self.pinst_cnt += 1
+
+    def remove(self, vm):
+        self.mfree += vm['ram']
+        self.dfree += vm['disk']
+        self.vcpus -= vm['cpu']
+        self.pinst_cnt -= 1
+
+
+def load_trace(lines):
+    """Load a trace from JSON lines.
+
+    Each line is an object with the 'action' and the 'id' of the vm and, for
+    the 'create' actions, the 'cpu', 'ram' (in MiB) and 'disk' (in MiB) of the
+    vm.
+
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        event = json.loads(line)
+        vm = None
+        if event["action"] == "create":
+            vm = dict((r, int(event[r])) for r in RESOURCES)
+        elif event["action"] != "delete":
+            raise ValueError("Unknown action '%s'" % event["action"])
+        yield event["action"], event["id"], vm
+
+
+def replay(trace, backends, allocate):
+    """Replay an allocation trace on simulated backends.
+
+    `allocate' is the allocation function of a strategy. Deletions of vms
+    that have not been created in the trace are ignored. Returns the
+    placements of the remaining vms, as a dictionary from the vm ids to
+    their (backend, vm) tuples, and a dictionary with the number of
+    'created', 'deleted' and 'overcommitted' vms, i.e. vms that were
+    allocated to a backend that could not host them.
+
+    """
+    placements = {}
+    counts = defaultdict(int)
+    for action, vm_id, vm in trace:
+        if action == "create":
+            backend = allocate(backends, vm)
+            if not backend.fits(vm):
+                counts["overcommitted"] += 1
+            backend.add(vm)
+            placements[vm_id] = (backend, vm)
+            counts["created"] += 1
+        elif vm_id in placements:
+            backend, vm = placements.pop(vm_id)
+            backend.remove(vm)
+            counts["deleted"] += 1
+    return placements, counts
+
+
+def fragmentation(backends, vm):
+    """Compute the fragmentation of the free resources of the backends.
+
+    The fragmentation of a resource is the fraction of its free amount that
+    is stranded, i.e. it can not be used by vms of the size of `vm', because
+    the backends lack another resource. Returns the number of such vms that
+    the backends can still host and a dictionary with the fragmentation of
+    each resource.
+
+    """
+    demand = vector_allocator.vm_vector(vm)
+    free_vms = 0
+    free = [0] * len(RESOURCES)
+    stranded = [0] * len(RESOURCES)
+    for backend in backends:
+        backend_free, _ = vector_allocator.backend_vectors(backend)
+        backend_free = [max(f, 0) for f in backend_free]
+        count = min(int(f // d) for f, d in zip(backend_free, demand) if d)
+        free_vms += count
+        for i, (f, d) in enumerate(zip(backend_free, demand)):
+            free[i] += f
+            stranded[i] += f - count * d
+    return free_vms, dict((r, s / f if f else 0)
+                          for r, s, f in zip(RESOURCES, stranded, free))
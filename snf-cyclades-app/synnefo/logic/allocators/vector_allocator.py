@@ -0,0 +1,135 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Multi-dimensional bin-packing allocation strategy.
+
+Each backend is described by a vector of its free and of its total
+resources, in virtual CPUs, memory and disk, and each VM by the vector of
+the resources of its flavor. Among the backends that can host the VM, the
+one to host it is chosen based on the free resources that the backends
+will have left, normalized by their size, according to one of the
+following policies:
+
+* best_fit: Pick the backend that will have the least free resources, in
+  order to keep large chunks of resources free for large VMs.
+* worst_fit: Pick the backend that will have the most free resources.
+* spread: Pick the backend whose most used resource will be the least used,
+  in order to balance the load of the backends.
+
+The virtual CPUs of a backend are its physical CPUs multiplied by
+BACKEND_ALLOCATOR_VCPU_RATIO.
+
+"""
+
+from __future__ import division
+import logging
+
+from django.conf import settings
+
+
+log = logging.getLogger(__name__)
+
+POLICIES = ("best_fit", "worst_fit", "spread")
+
+# The strategy uses the virtual CPUs allocated to the VMs of each backend,
+# which the capacity model then computes on each reload
+USES_VCPUS = True
+
+# Virtual CPUs assumed per VM, for backends whose allocated virtual CPUs
+# are not known
+DEFAULT_VM_VCPUS = 4
+
+
+def allocate(backends, vm, policy=None):
+    """Choose the backend to host a vm, according to the allocation policy.
+
+    If no backend has enough free resources to host the vm, the backend with
+    the most free resources is chosen, since the free resources of the
+    backends are conservatively updated on each allocation.
+
+    """
+    return allocate_many(backends, vm, 1, policy=policy)[0]
+
+
+def allocate_many(backends, vm, count, policy=None):
+    """Choose the backends to host `count' vms of the same size.
+
+    The vms are placed one after the other, each time taking into account the
+    resources of the vms that have already been placed. Returns a list with
+    the backend of each vm.
+
+    """
+    if policy is None:
+        policy = settings.BACKEND_ALLOCATOR_POLICY
+    if policy not in POLICIES:
+        raise ValueError("Unknown allocation policy '%s'" % policy)
+
+    demand = vm_vector(vm)
+    vectors = [backend_vectors(backend) for backend in backends]
+    frees = [free for free, total in vectors]
+    totals = [total for free, total in vectors]
+
+    result = []
+    for _ in range(count):
+        scores = [(score(policy, free, total, demand), i)
+                  for i, (free, total) in enumerate(zip(frees, totals))
+                  if fits(free, demand)]
+        if not scores:
+            # Overcommit the backend that will be the least overloaded
+            scores = [(score("spread", free, total, demand), i)
+                      for i, (free, total) in enumerate(zip(frees, totals))]
+        log.debug("Backend scores for VM %s: %s", vm, scores)
+        _, index = min(scores)
+        frees[index] = [f - d for f, d in zip(frees[index], demand)]
+        result.append(backends[index])
+    return result
+
+
+def vm_vector(vm):
+    return [vm['cpu'], vm['ram'], vm['disk']]
+
+
+def backend_vectors(backend):
+    """Return the vectors of the free and the total resources of a backend.
+
+    The allocated virtual CPUs are taken from the `vcpus' attribute of the
+    backend, if it is set by the capacity model. Otherwise, each instance of
+    the backend is considered to have DEFAULT_VM_VCPUS virtual CPUs.
+
+    """
+    ctotal = backend.ctotal * settings.BACKEND_ALLOCATOR_VCPU_RATIO
+    vcpus = getattr(backend, "vcpus", None)
+    if vcpus is None:
+        vcpus = backend.pinst_cnt * DEFAULT_VM_VCPUS
+    free = [ctotal - vcpus, backend.mfree, backend.dfree]
+    total = [ctotal, backend.mtotal, backend.dtotal]
+    return free, total
+
+
+def fits(free, demand):
+    return all(f >= d for f, d in zip(free, demand))
+
+
+def score(policy, free, total, demand):
+    """Score a backend for hosting a vm. The lowest score is the best."""
+    left = [(f - d) / t if t else 0 for f, d, t in zip(free, demand, total)]
+    if policy == "best_fit":
+        return sum(left)
+    elif policy == "worst_fit":
+        return -sum(left)
+    else:
+        # Least utilization of the most utilized resource, ties broken by
+        # the total free resources
+        return (-min(left), -sum(left))
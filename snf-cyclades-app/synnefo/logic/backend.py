@@ -1298,6 +1298,26 @@ def get_jobs(backend, bulk=True):
         return c.GetJobs(bulk=bulk)
 
 
+# Status of the values of Ganeti query results that are available
+QUERY_RS_NORMAL = 0
+
+
+def query(backend, what, fields, qfilter=None):
+    """Query the resources of a Ganeti backend.
+
+    Returns a list with a dictionary of the requested fields for each
+    resource. Fields whose value is not available, e.g. because of an offline
+    node, are None.
+
+    """
+    with pooled_rapi_client(backend) as c:
+        result = c.Query(what, fields, qfilter=qfilter)
+    names = [field["name"] for field in result["fields"]]
+    return [dict((name, value if status == QUERY_RS_NORMAL else None)
+                 for name, (status, value) in zip(names, row))
+            for row in result["data"]]
+
+
 def get_physical_resources(backend):
     """ Get the physical resources of a backend.
 
@@ -15,10 +15,14 @@
 
 import logging
 import datetime
+import threading
+import time
 from django.utils import importlib
 
 from django.conf import settings
-from synnefo.db.models import Backend
+from django.db import close_connection
+from django.db.models import F, Sum
+from synnefo.db.models import Backend, VirtualMachine
 from synnefo.logic import backend as backend_mod
 
 log = logging.getLogger(__name__)
@@ -35,9 +39,11 @@ class BackendAllocator():
     def allocate(self, userid, flavor):
         """Allocate a vm of the specified flavor to a backend.
 
-        Warning!!: An explicit commit is required after calling this function,
-        in order to release the locks acquired by the get_available_backends
-        function.
+        The backend is chosen among the ones of the capacity model and its
+        resources are reserved without locking the backend rows. If the
+        chosen backend can no longer host the vm, because of concurrent
+        allocations or changes of the backend, the model is reloaded and
+        the allocation is retried.
 
         """
 
@@ -47,61 +53,123 @@ class BackendAllocator():
             return backend
 
         # Get the size of the vm
-        disk = flavor_disk(flavor)
-        ram = flavor.ram
-        cpu = flavor.cpu
-        vm = {'ram': ram, 'disk': disk, 'cpu': cpu}
+        vm = flavor_vm(flavor)
 
         log.debug("Allocating VM: %r", vm)
 
-        # Get available backends
-        available_backends = get_available_backends(flavor)
+        for attempt in range(ALLOCATION_ATTEMPTS):
+            with capacity_model.lock:
+                # Get available backends
+                available_backends = \
+                    capacity_model.get_available_backends(
+                        flavor, reload=attempt > 0)
 
-        if not available_backends:
-            return None
+                if not available_backends:
+                    return None
 
-        # Find the best backend to host the vm, based on the allocation
-        # strategy
-        backend = self.strategy_mod.allocate(available_backends, vm)
+                # Find the best backend to host the vm, based on the
+                # allocation strategy
+                backend = self.strategy_mod.allocate(available_backends, vm)
 
-        log.info("Allocated VM %r, in backend %s", vm, backend)
+            # Reduce the free resources of the selected backend by the size
+            # of the vm. Since we are conservatively updating backend
+            # resources, the strategy may pick a backend that does not fit
+            # the vm. Respect its choice after reloading the model.
+            if reserve_backend_resources(backend, vm, force=attempt > 0):
+                log.info("Allocated VM %r, in backend %s", vm, backend)
+                return Backend.objects.get(id=backend.id)
 
-        # Reduce the free resources of the selected backend by the size of
-        # the vm
-        reduce_backend_resources(backend, vm)
+            log.debug("Backend %s can no longer host VM %r", backend, vm)
 
-        return backend
+        return None
 
 
-def get_available_backends(flavor):
-    """Get the list of available backends that can host a new VM of a flavor.
+# Times to try reserving the resources of a new VM in a backend
+ALLOCATION_ATTEMPTS = 3
+
 
-    The list contains the backends that are online and that have enabled
-    the disk_template of the new VM.
+class BackendCapacityModel(object):
+    """In-memory model of the free resources of the available backends.
 
-    Also, if the new VM will be automatically connected to a public network,
-    the backends that do not have an available public IPv4 address are
-    excluded.
+    The model holds the online and undrained backends. If the allocation
+    strategy uses them (USES_VCPUS), the number of virtual CPUs allocated to
+    the VMs of each backend is kept in its `vcpus' attribute. The model is
+    reloaded from the DB, without locking the backend rows, every
+    BACKEND_ALLOCATOR_MODEL_TIMEOUT seconds, and it is updated with the
+    resources reserved by the allocations of this process in between.
+
+    The model must be accessed with its lock held.
 
     """
-    disk_template = flavor.volume_type.disk_template
-    # Ganeti knows only the 'ext' disk template, but the flavors disk template
-    # includes the provider.
-    if disk_template.startswith("ext_"):
-        disk_template = "ext"
 
-    backends = Backend.objects.select_for_update().filter(offline=False,
-                                                          drained=False)
-    # Update the disk_templates if there are empty.
-    [backend_mod.update_backend_disk_templates(b)
-     for b in backends if not b.disk_templates]
-    backends = filter(lambda b: disk_template in b.disk_templates,
-                      list(backends))
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.backends = []
+        self.loaded = None
+
+    def get_backends(self, reload=False):
+        now = time.time()
+        timeout = settings.BACKEND_ALLOCATOR_MODEL_TIMEOUT
+        if reload or self.loaded is None or now - self.loaded >= timeout:
+            self.backends = list(Backend.objects.filter(offline=False,
+                                                        drained=False))
+            # Update the disk_templates if there are empty.
+            [backend_mod.update_backend_disk_templates(b)
+             for b in self.backends if not b.disk_templates]
+            strategy_mod = \
+                importlib.import_module(settings.BACKEND_ALLOCATOR_MODULE)
+            if getattr(strategy_mod, "USES_VCPUS", False):
+                vcpus = VirtualMachine.objects\
+                    .filter(deleted=False, backend__in=self.backends)\
+                    .values("backend").annotate(vcpus=Sum("flavor__cpu"))
+                vcpus = dict((v["backend"], v["vcpus"]) for v in vcpus)
+                for backend in self.backends:
+                    backend.vcpus = vcpus.get(backend.id, 0)
+            self.loaded = now
+            # Update the backend stats if it is needed
+            refresh_backends_stats(self.backends)
+        return self.backends
+
+    def get_available_backends(self, flavor, reload=False):
+        """Get the list of available backends that can host a new VM of a
+        flavor.
+
+        The list contains the backends that are online and that have enabled
+        the disk_template of the new VM.
+
+        """
+        disk_template = flavor.volume_type.disk_template
+        # Ganeti knows only the 'ext' disk template, but the flavors disk
+        # template includes the provider.
+        if disk_template.startswith("ext_"):
+            disk_template = "ext"
 
-    # Update the backend stats if it is needed
-    refresh_backends_stats(backends)
+        return [b for b in self.get_backends(reload=reload)
+                if b.disk_templates and disk_template in b.disk_templates]
 
-    return backends
+    def reduce(self, backend_id, vm):
+        for backend in self.backends:
+            if backend.id == backend_id:
+                reduce_backend_resources(backend, vm)
+
+
+capacity_model = BackendCapacityModel()
+
+
+def get_available_backends(flavor):
+    """Get the list of available backends that can host a new VM of a flavor.
+
+    See BackendCapacityModel.get_available_backends.
+
+    """
+    with capacity_model.lock:
+        return capacity_model.get_available_backends(flavor)
+
+
+def flavor_vm(flavor):
+    """Get the size of a vm of a flavor"""
+    return {'ram': flavor.ram, 'disk': flavor_disk(flavor),
+            'cpu': flavor.cpu}
 
 
 def flavor_disk(flavor):
@@ -114,6 +182,38 @@ def flavor_disk(flavor):
         return flavor.disk * 1024
 
 
+def reserve_backend_resources(backend, vm, force=False):
+    """ Reserve the resources of a vm in a backend.
+
+    Atomically reduce the free resources of the backend in the DB by the size
+    of the vm, if the backend is still available and has enough free memory
+    and disk. If `force' is set, the resources of an available backend are
+    reduced down to zero instead. The capacity model is updated accordingly.
+
+    Returns whether the resources were reserved.
+
+    """
+    ram, disk = vm['ram'], vm['disk']
+    backends = Backend.objects.filter(id=backend.id, offline=False,
+                                      drained=False)
+    reserved = backends.filter(mfree__gte=ram, dfree__gte=disk)\
+                       .update(mfree=F('mfree') - ram,
+                               dfree=F('dfree') - disk,
+                               pinst_cnt=F('pinst_cnt') + 1)
+    if not reserved and force:
+        reserved = backends.update(pinst_cnt=F('pinst_cnt') + 1)
+        if reserved:
+            backends.filter(mfree__gte=ram).update(mfree=F('mfree') - ram)
+            backends.filter(mfree__lt=ram).update(mfree=0)
+            backends.filter(dfree__gte=disk).update(dfree=F('dfree') - disk)
+            backends.filter(dfree__lt=disk).update(dfree=0)
+
+    if reserved:
+        with capacity_model.lock:
+            capacity_model.reduce(backend.id, vm)
+    return bool(reserved)
+
+
 def reduce_backend_resources(backend, vm):
     """ Conservatively update the resources of a backend.
 
@@ -127,25 +227,59 @@ def reduce_backend_resources(backend, vm):
     backend.mfree = 0 if new_mfree < 0 else new_mfree
     backend.dfree = 0 if new_dfree < 0 else new_dfree
     backend.pinst_cnt += 1
+    if getattr(backend, "vcpus", None) is not None:
+        backend.vcpus += vm['cpu']
+
 
-    backend.save()
+# Backends whose statistics are being refreshed
+_refreshing = set()
+_refreshing_lock = threading.Lock()
 
 
 def refresh_backends_stats(backends):
     """ Refresh the statistics of the backends.
 
     Set db backend state to the actual state of the backend, if
-    BACKEND_REFRESH_MIN time has passed.
+    BACKEND_REFRESH_MIN time has passed or the disk templates of the backend
+    are unknown. The backends are queried in background threads, so that
+    allocations do not wait for them.
 
     """
 
     now = datetime.datetime.now()
     delta = datetime.timedelta(minutes=settings.BACKEND_REFRESH_MIN)
     for b in backends:
-        if now > b.updated + delta:
+        if now > b.updated + delta or not b.disk_templates:
+            with _refreshing_lock:
+                if b.id in _refreshing:
+                    continue
+                _refreshing.add(b.id)
             log.debug("Updating resources of backend %r. Last Updated %r",
                       b, b.updated)
-            backend_mod.update_backend_resources(b)
+            thread = threading.Thread(target=refresh_backend_stats,
+                                      args=(b.id,))
+            thread.daemon = True
+            thread.start()
+
+
+def refresh_backend_stats(backend_id):
+    """Update the disk templates and the resources of a backend in the DB"""
+    try:
+        backend = Backend.objects.get(id=backend_id)
+        if not backend.disk_templates:
+            backend_mod.update_backend_disk_templates(backend)
+        resources = backend_mod.get_physical_resources(backend)
+        # Update only the resources, not to override concurrent changes of
+        # the backend
+        Backend.objects.filter(id=backend_id)\
+                       .update(updated=datetime.datetime.now(), **resources)
+    except Exception:
+        log.exception("Failed to refresh the resources of backend %s",
+                      backend_id)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(backend_id)
+        close_connection()
 
 
 def get_backend_for_user(userid):
@@ -320,6 +320,61 @@ def update_cluster(msg):
     backend_mod.update_backend_resources(backend)
 
 
+def coalescing_key(msg):
+    """Return the coalescing key of a message and if it can be superseded.
+
+    Updates of a job that has not finished yet are superseded by any later
+    update of the same job, and copy progress reports by any later report
+    for the same instance. Messages with other side effects, like terminal
+    job statuses and diagnostics, must always be processed and have no key.
+
+    """
+    msg_type = msg["type"]
+    if msg_type == "ganeti-op-status":
+        key = (msg_type, msg["instance"], msg["jobId"])
+        return key, msg["status"] not in rapi.JOB_STATUS_FINALIZED
+    elif msg_type == "ganeti-network-status":
+        # Network modifications reserve addresses before they finish
+        if msg["operation"] == "OP_NETWORK_SET_PARAMS":
+            return None, False
+        key = (msg_type, msg["network"], msg["cluster"], msg["jobId"])
+        return key, msg["status"] not in rapi.JOB_STATUS_FINALIZED
+    elif msg_type == "image-copy-progress":
+        return (msg_type, msg["instance"]), True
+    return None, False
+
+
+def find_superseded(messages):
+    """Return the indexes of the messages superseded by later ones.
+
+    A message is superseded if it can be (see coalescing_key) and a message
+    with the same key and a later or equal event time follows it. Such
+    messages do not have to be processed, since the later message will
+    bring the DB to the same or a newer state.
+
+    """
+    latest = {}
+    superseded = []
+    for index in reversed(xrange(len(messages))):
+        try:
+            msg = json.loads(messages[index]["body"])
+            key, can_supersede = coalescing_key(msg)
+            event_time = tuple(msg["event_time"])
+        except Exception:
+            # Leave invalid messages to the callbacks
+            continue
+        if key is None:
+            continue
+        later = latest.get(key)
+        if later is not None and later >= event_time:
+            if can_supersede:
+                superseded.append(index)
+        else:
+            latest[key] = event_time
+    superseded.reverse()
+    return superseded
+
+
 def dummy_proc(client, message, *args, **kwargs):
     try:
         log.debug("Msg: %s", message['body'])
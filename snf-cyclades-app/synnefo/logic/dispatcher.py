@@ -32,13 +32,15 @@ sys.path.append(path)
 os.environ['DJANGO_SETTINGS_MODULE'] = 'synnefo.settings'
 from django.conf import settings
 
-from django.db import close_connection
+from django.db import close_connection, connections
 
 import time
 
 import json
 import socket
 import traceback
+import threading
+import Queue
 import daemon
 import daemon.runner
 from lockfile import LockTimeout
@@ -52,6 +54,7 @@ import setproctitle
 from synnefo.lib.amqp import AMQPClient
 from synnefo.logic import callbacks
 from synnefo.logic import queues
+from synnefo.logic import rapi_pool
 from synnefo.db.models import Backend, pooled_rapi_client
 
 import logging
@@ -68,6 +71,15 @@ LOGGERS = [log, log_amqp, log_logic]
 # After this timeout the snf-dispatcher will reconnect to the AMQP broker.
 DISPATCHER_RECONNECT_TIMEOUT = 600
 
+# Seconds for which the main loop of snf-dispatcher will wait for messages
+# before handing the acknowledgments of the workers to the AMQP broker.
+WORKERS_POLL_TIMEOUT = 0.1
+# Seconds after which an idle worker will close its DB connection.
+WORKERS_IDLE_TIMEOUT = 60
+# Unacknowledged messages that the AMQP broker will deliver to each worker.
+# Superseded updates are coalesced among the messages queued to a worker.
+WORKERS_PREFETCH_COUNT = 20
+
 
 # Time out after S Seconds while waiting messages from Ganeti clusters to
 # arrive. Warning: During this period snf-dispatcher will not consume any other
@@ -87,14 +99,216 @@ def get_hostname():
     return socket.gethostbyaddr(socket.gethostname())[0]
 
 
+class DispatcherStats(object):
+    """Queue lag and latency of the callbacks of processed messages.
+
+    The queue lag of a message is the time from the Ganeti event it reports
+    until the start of its processing. Superseded messages are counted but
+    not processed.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.callbacks = {}
+        self.lag_count = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def record(self, callback, message, start, end):
+        try:
+            seconds, microseconds = json.loads(message["body"])["event_time"]
+            lag = start - (seconds + microseconds / 1000000.0)
+        except Exception:
+            lag = None
+        with self._lock:
+            stats = self.callbacks.setdefault(callback, [0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += end - start
+            stats[2] = max(stats[2], end - start)
+            if lag is not None:
+                self.lag_count += 1
+                self.lag_total += lag
+                self.lag_max = max(self.lag_max, lag)
+
+    def record_superseded(self, callback):
+        with self._lock:
+            stats = self.callbacks.setdefault(callback, [0, 0.0, 0.0, 0])
+            stats[3] += 1
+
+    def report(self):
+        """Log the statistics of the last interval and reset them."""
+        with self._lock:
+            interval = time.time() - self.started
+            for callback, (count, total, max_time, superseded) in \
+                    sorted(self.callbacks.items()):
+                log.info("Callback %s: %d messages (%d superseded) in %.0f"
+                         " seconds, latency avg %.3f max %.3f seconds",
+                         callback, count, superseded, interval,
+                         total / count if count else 0, max_time)
+            if self.lag_count:
+                log.info("Queue lag: avg %.3f max %.3f seconds",
+                         self.lag_total / self.lag_count, self.lag_max)
+            self.reset()
+
+
+class _WorkerClient(object):
+    """AMQP client handed to the callbacks that run in workers.
+
+    The AMQP client is not thread-safe, so acknowledgments are queued and
+    sent by the main loop of the dispatcher.
+
+    """
+
+    def __init__(self, acks):
+        self.acks = acks
+        self.rejected = False
+
+    def basic_ack(self, message):
+        self.acks.put(("basic_ack", message, {}))
+
+    def basic_nack(self, message):
+        self.acks.put(("basic_nack", message, {}))
+
+    def basic_reject(self, message, requeue=False):
+        self.rejected = True
+        self.acks.put(("basic_reject", message, {"requeue": requeue}))
+
+
+class CallbackWorkers(object):
+    """Pool of threads running the callbacks of incoming messages.
+
+    Messages are partitioned among the workers by the instance or network
+    they refer to, so that the messages of each object are processed in the
+    order they arrived. Each worker keeps its DB connection across messages
+    and closes it when it has been idle for WORKERS_IDLE_TIMEOUT seconds or
+    when processing a message fails.
+
+    Before processing the messages queued to it, a worker acknowledges
+    without processing the ones superseded by later messages of the same
+    job (see callbacks.find_superseded).
+
+    """
+
+    def __init__(self, size, stats):
+        self.stats = stats
+        self.acks = Queue.Queue()
+        self.queues = [Queue.Queue() for i in range(size)]
+        self.threads = [threading.Thread(target=self._work, args=(queue,),
+                                         name="dispatcher-worker-%d" % i)
+                        for i, queue in enumerate(self.queues)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def __len__(self):
+        return len(self.queues)
+
+    def _partition(self, message):
+        try:
+            body = json.loads(message["body"])
+            key = body.get("instance") or body.get("network") or \
+                body.get("cluster")
+        except Exception:
+            key = None
+        return hash(key) % len(self.queues)
+
+    def wrap(self, callback):
+        """Return a callback that hands messages over to the workers."""
+        def dispatch(client, message):
+            queue = self.queues[self._partition(message)]
+            queue.put((callback, message))
+        return dispatch
+
+    def _work(self, queue):
+        client = _WorkerClient(self.acks)
+        stop = False
+        while not stop:
+            try:
+                batch = [queue.get(timeout=WORKERS_IDLE_TIMEOUT)]
+            except Queue.Empty:
+                close_connection()
+                continue
+            while batch[-1] is not None:
+                try:
+                    batch.append(queue.get_nowait())
+                except Queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                stop = True
+
+            superseded = callbacks.find_superseded([m for c, m in batch])
+            for index in superseded:
+                callback, message = batch[index]
+                client.basic_ack(message)
+                self.stats.record_superseded(callback.__name__)
+            superseded = set(superseded)
+            for index, (callback, message) in enumerate(batch):
+                if index not in superseded:
+                    self._process(client, callback, message)
+        close_connection()
+
+    def _process(self, client, callback, message):
+        start = time.time()
+        client.rejected = False
+        try:
+            callback(client, message)
+        except Exception as e:
+            # The callbacks handle their errors and (n)ack the
+            # message themselves. Reject it, if this fails.
+            log.exception("Caught unexpected exception: %s", e)
+            client.basic_reject(message)
+        self.stats.record(callback.__name__, message, start, time.time())
+
+        try:
+            # Release the row locks of the message, like closing the
+            # connection would
+            for connection in connections.all():
+                connection.rollback_unless_managed()
+        except Exception:
+            client.rejected = True
+        if client.rejected:
+            # Recover from broken DB connections
+            close_connection()
+
+    def send_acks(self, client):
+        """Send the acknowledgments of the processed messages."""
+        while True:
+            try:
+                method, message, kwargs = self.acks.get_nowait()
+            except Queue.Empty:
+                return
+            getattr(client, method)(message, **kwargs)
+
+    def stop(self, client):
+        """Wait for the workers to process the pending messages."""
+        for queue in self.queues:
+            queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.send_acks(client)
+
+
 class Dispatcher:
     debug = False
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, workers=0):
         self.debug = debug
+        self.stats = DispatcherStats()
+        self.workers = None
+        if workers:
+            self.workers = CallbackWorkers(workers, self.stats)
         self._init()
 
     def wait(self):
+        if self.workers is not None:
+            return self.wait_workers()
+
         log.info("Waiting for messages..")
         timeout = DISPATCHER_RECONNECT_TIMEOUT
         while True:
@@ -106,6 +320,7 @@ class Dispatcher:
                 # gracefully.
                 close_connection()
                 msg = self.client.basic_wait(timeout=timeout)
+                self._report_stats()
                 if not msg:
                     log.warning("Idle connection for %d seconds. Will connect"
                                 " to a different host. Verify that"
@@ -125,6 +340,50 @@ class Dispatcher:
         self.client.basic_cancel(timeout=1)
         self.client.close(timeout=1)
 
+    def wait_workers(self):
+        """Wait for messages and hand them over to the workers.
+
+        The DB connections are kept by the workers across messages, and the
+        main loop sends the acknowledgments of the processed messages.
+
+        """
+        log.info("Waiting for messages with %d workers..", len(self.workers))
+        timeout = DISPATCHER_RECONNECT_TIMEOUT
+        last_msg = time.time()
+        while True:
+            try:
+                msg = self.client.basic_wait(timeout=WORKERS_POLL_TIMEOUT)
+                self.workers.send_acks(self.client)
+                self._report_stats()
+                if msg:
+                    last_msg = time.time()
+                elif time.time() - last_msg > timeout:
+                    log.warning("Idle connection for %d seconds. Will connect"
+                                " to a different host. Verify that"
+                                " snf-ganeti-eventd is running!!", timeout)
+                    self.client.reconnect(timeout=1)
+                    last_msg = time.time()
+            except select.error as e:
+                if e[0] != errno.EINTR:
+                    log.exception("Caught unexpected exception: %s", e)
+                else:
+                    break
+            except (SystemExit, KeyboardInterrupt):
+                break
+            except Exception as e:
+                log.exception("Caught unexpected exception: %s", e)
+
+        log.info("Clean up AMQP connection before exit")
+        self.client.basic_cancel(timeout=1)
+        self.workers.stop(self.client)
+        self.client.close(timeout=1)
+
+    def _report_stats(self):
+        interval = settings.DISPATCHER_STATS_INTERVAL
+        if interval and time.time() - self.stats.started >= interval:
+            self.stats.report()
+            rapi_pool.report_stats(log)
+
     def _init(self):
         log.info("Initializing")
 
@@ -162,9 +421,15 @@ class Dispatcher:
             self.client.queue_bind(queue=queue, exchange=exchange,
                                    routing_key=routing_key)
 
+            if self.workers is not None:
+                callback = self.workers.wrap(callback)
+                prefetch_count = WORKERS_PREFETCH_COUNT * len(self.workers)
+            else:
+                callback = self._timed(callback)
+                prefetch_count = 5
             self.client.basic_consume(queue=binding[0],
                                       callback=callback,
-                                      prefetch_count=5)
+                                      prefetch_count=prefetch_count)
 
             queue_dl = queues.convert_queue_to_dead(queue)
             exchange_dl = queues.convert_exchange_to_dead(exchange)
@@ -185,6 +450,17 @@ class Dispatcher:
         log.debug("Binding %s(%s) to queue %s with handler 'hadle_request'",
                   exchange, routing_key, queue)
 
+    def _timed(self, callback):
+        """Return a callback that records the latency of `callback'."""
+        def timed_callback(client, message):
+            start = time.time()
+            try:
+                return callback(client, message)
+            finally:
+                self.stats.record(callback.__name__, message, start,
+                                  time.time())
+        return timed_callback
+
 
 def handle_request(client, msg):
     """Callback function for handling requests.
@@ -294,6 +570,11 @@ def parse_arguments(args):
                            " snf-dispatcher process, that will check"
                            " communication between snf-dispatcher and Ganeti"
                            " backends via AMQP brokers")
+    parser.add_option("-w", "--workers", dest="workers", type="int",
+                      default=settings.DISPATCHER_WORKERS,
+                      help=("Number of worker threads processing messages"
+                            " concurrently. 0 processes them one at a time"
+                            " (default: %s)" % settings.DISPATCHER_WORKERS))
 
     return parser.parse_args(args)
 
@@ -450,13 +731,13 @@ def get_user_confirmation():
     return True
 
 
-def debug_mode():
-    disp = Dispatcher(debug=True)
+def debug_mode(opts):
+    disp = Dispatcher(debug=True, workers=opts.workers)
     disp.wait()
 
 
 def daemon_mode(opts):
-    disp = Dispatcher(debug=False)
+    disp = Dispatcher(debug=False, workers=opts.workers)
     disp.wait()
 
 
@@ -508,7 +789,7 @@ def main():
 
     # Debug mode, process messages without daemonizing
     if opts.debug:
-        debug_mode()
+        debug_mode(opts)
         return
 
     # Create pidfile,
@@ -0,0 +1,141 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division
+from collections import Counter
+from functools import partial
+from optparse import make_option
+
+from django.conf import settings
+from django.utils import importlib
+
+from snf_django.management.commands import SynnefoCommand, CommandError
+from synnefo.db.models import Backend, VirtualMachine
+from synnefo.logic.allocators import simulation, vector_allocator
+from synnefo.logic.backend_allocator import flavor_vm
+
+
+HELP_MSG = """Replay an allocation trace with an allocation strategy.
+
+The VMs of the trace are allocated to empty backends with the resources of
+the online backends. The command reports the resulting usage of each backend
+and the fragmentation of their free resources, i.e. the fraction of each
+free resource that can not be used by VMs of the most common size in the
+trace.
+
+By default, the trace is built from the VMs in the DB: each VM is created
+at its creation time and deleted VMs are deleted at their last update time.
+A trace file has one JSON object per line, of the form
+{"action": "create", "id": "vm1", "cpu": 2, "ram": 2048, "disk": 20480}
+or {"action": "delete", "id": "vm1"}, with the memory and disk in MiB.
+"""
+
+
+class Command(SynnefoCommand):
+    help = HELP_MSG
+
+    command_option_list = (
+        make_option("--trace",
+                    dest="trace",
+                    help="File with the allocation trace to replay"),
+        make_option("--allocator",
+                    dest="allocator",
+                    default=None,
+                    help="Module of the allocation strategy (default:"
+                         " BACKEND_ALLOCATOR_MODULE)"),
+        make_option("--policy",
+                    dest="policy",
+                    default=None,
+                    choices=vector_allocator.POLICIES,
+                    help="Policy of the vector allocation strategy"
+                         " (default: BACKEND_ALLOCATOR_POLICY)"),
+    )
+
+    def handle(self, **options):
+        module = options["allocator"] or settings.BACKEND_ALLOCATOR_MODULE
+        try:
+            strategy_mod = importlib.import_module(module)
+        except ImportError as e:
+            raise CommandError("Invalid allocator module '%s': %s"
+                               % (module, e))
+        allocate = strategy_mod.allocate
+        if options["policy"] is not None:
+            if strategy_mod is not vector_allocator:
+                raise CommandError("Option '--policy' applies only to the"
+                                   " vector allocation strategy")
+            allocate = partial(allocate, policy=options["policy"])
+
+        if options["trace"]:
+            try:
+                with open(options["trace"]) as trace_file:
+                    trace = list(simulation.load_trace(trace_file))
+            except (IOError, ValueError, KeyError) as e:
+                raise CommandError("Invalid trace file: %s" % e)
+        else:
+            trace = trace_from_db()
+        if not trace:
+            raise CommandError("The allocation trace is empty")
+
+        backends = [simulation.SimulatedBackend(b.id, b.clustername,
+                                                b.mtotal, b.dtotal, b.ctotal)
+                    for b in Backend.objects.filter(offline=False)
+                                            .order_by("id")]
+        if not backends:
+            raise CommandError("There are no online backends")
+
+        placements, counts = simulation.replay(trace, backends, allocate)
+
+        sizes = Counter(tuple(sorted(vm.items())) for action, _, vm in trace
+                        if action == "create")
+        vm = dict(sizes.most_common(1)[0][0])
+        free_vms, fragmentation = simulation.fragmentation(backends, vm)
+
+        headers = ("id", "clustername", "VMs", "vCPUs", "ctotal", "mfree",
+                   "mtotal", "dfree", "dtotal")
+        table = [(b.id, b.clustername, b.pinst_cnt, b.vcpus, b.ctotal,
+                  b.mfree, b.mtotal, b.dfree, b.dtotal) for b in backends]
+        self.pprint_table(table, headers, options["output_format"],
+                          title="Backends")
+        self.stdout.write("\n")
+
+        summary = [
+            ("Allocator", module),
+            ("Created VMs", counts["created"]),
+            ("Deleted VMs", counts["deleted"]),
+            ("Overcommitted VMs", counts["overcommitted"]),
+            ("Used backends",
+             len(set(b.id for b, _ in placements.values()))),
+            ("Reference VM", "cpu: %(cpu)s, ram: %(ram)s, disk: %(disk)s"
+             % vm),
+            ("Free reference VMs", free_vms),
+        ]
+        summary.extend(("Fragmentation (%s)" % r, "%.2f%%"
+                        % (100 * fragmentation[r]))
+                       for r in simulation.RESOURCES)
+        self.pprint_table([[v for _, v in summary]], [k for k, _ in summary],
+                          options["output_format"], vertical=True,
+                          title="Summary")
+
+
+def trace_from_db():
+    """Build an allocation trace from the VMs in the DB"""
+    events = []
+    vms = VirtualMachine.objects.select_related("flavor__volume_type")
+    for vm in vms:
+        events.append((vm.created, "create", vm.id, flavor_vm(vm.flavor)))
+        if vm.deleted:
+            events.append((vm.updated, "delete", vm.id, None))
+    events.sort(key=lambda e: e[0])
+    return [(action, vm_id, size) for _, action, vm_id, size in events]
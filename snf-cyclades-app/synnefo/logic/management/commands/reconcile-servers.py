@@ -20,12 +20,17 @@ the state of the Ganeti backend. See docstring on top of
 logic/reconciliation.py for a description of reconciliation rules.
 
 """
-import sys
+import errno
+import os
+import time
 import logging
-import subprocess
+import simplejson as json
+from collections import Counter
 from optparse import make_option
 
-from snf_django.management.commands import SynnefoCommand
+from django.conf import settings
+
+from snf_django.management.commands import SynnefoCommand, CommandError
 from synnefo.management.common import get_resource
 from synnefo.logic import reconciliation
 from snf_django.management.utils import parse_bool
@@ -46,6 +51,35 @@ class Command(SynnefoCommand):
                     metavar="True|False",
                     help="Perform server reconciliation for each backend"
                          " parallel."),
+        make_option("--workers",
+                    dest="workers",
+                    type="int",
+                    default=8,
+                    help="Maximum number of backends to reconcile in"
+                         " parallel (default=8)"),
+        make_option("--time-budget",
+                    dest="time_budget",
+                    type="int",
+                    default=None,
+                    metavar="SECONDS",
+                    help="Stop the reconciliation after this number of"
+                         " seconds, leaving the remaining servers for the"
+                         " next reconciliation"),
+        make_option("--incremental",
+                    dest="incremental",
+                    action="store_true",
+                    default=False,
+                    help="Reconcile only the servers that may have changed"
+                         " since the previous reconciliation. A full"
+                         " reconciliation is performed every"
+                         " RECONCILIATION_FULL_SWEEP_HOURS"),
+        make_option("--state-file",
+                    dest="state_file",
+                    default=None,
+                    help="File with the state of the previous"
+                         " reconciliation, used by incremental"
+                         " reconciliations (default:"
+                         " RECONCILIATION_STATE_FILE)"),
         make_option('--fix-stale', action='store_true', dest='fix_stale',
                     default=False, help='Fix (remove) stale DB entries in DB'),
         make_option('--fix-orphans', action='store_true', dest='fix_orphans',
@@ -85,16 +119,13 @@ class Command(SynnefoCommand):
         else:
             backends = reconciliation.get_online_backends()
 
-        parallel = parse_bool(options["parallel"])
-        if parallel and len(backends) > 1:
-            cmd = sys.argv
-            processes = []
-            for backend in backends:
-                p = subprocess.Popen(cmd + ["--backend-id=%s" % backend.id])
-                processes.append(p)
-            for p in processes:
-                p.wait()
-            return
+        workers = options["workers"] if parse_bool(options["parallel"]) else 1
+        if workers < 1:
+            raise CommandError("Invalid number of workers: %s" % workers)
+
+        time_budget = options["time_budget"]
+        if time_budget is not None and time_budget < 1:
+            raise CommandError("Invalid time budget: %s" % time_budget)
 
         verbosity = int(options["verbosity"])
 
@@ -106,7 +137,7 @@ class Command(SynnefoCommand):
         log_handler.setFormatter(formatter)
         if verbosity == 2:
             formatter =\
-                logging.Formatter("%(asctime)s [%(process)d]: %(message)s")
+                logging.Formatter("%(asctime)s [%(threadName)s]: %(message)s")
             log_handler.setFormatter(formatter)
             logger.setLevel(logging.DEBUG)
         elif verbosity == 1:
@@ -118,8 +149,51 @@ class Command(SynnefoCommand):
 
         self._process_args(options)
 
-        for backend in backends:
-            r = reconciliation.BackendReconciler(backend=backend,
-                                                 logger=logger,
-                                                 options=options)
-            r.reconcile()
+        states = None
+        if options["incremental"]:
+            state_file = options["state_file"] or \
+                settings.RECONCILIATION_STATE_FILE
+            states = load_states(state_file)
+
+        start = time.time()
+        results = reconciliation.reconcile_backends(
+            backends, logger, options, workers=workers,
+            time_budget=time_budget, states=states)
+
+        if states is not None:
+            save_states(state_file, states)
+
+        totals = Counter()
+        for stats in results.values():
+            if stats is not None:
+                totals.update(stats)
+        failed = len([s for s in results.values() if s is None])
+        logger.info("Reconciled %d backends (%d failed) in %.2f seconds: %s",
+                    len(results), failed, time.time() - start,
+                    reconciliation.format_stats(totals))
+
+
+def load_states(state_file):
+    """Load the states of the previous reconciliation of the backends."""
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return {}
+        raise CommandError("Can not read state file '%s': %s"
+                           % (state_file, e))
+    except ValueError as e:
+        raise CommandError("Invalid state file '%s': %s" % (state_file, e))
+
+
+def save_states(state_file, states):
+    """Atomically replace the state file with the states of the backends."""
+    tmp_file = "%s.tmp" % state_file
+    try:
+        with open(tmp_file, "w") as f:
+            json.dump(states, f)
+        os.rename(tmp_file, state_file)
+    except (IOError, OSError) as e:
+        raise CommandError("Can not write state file '%s': %s"
+                           % (state_file, e))
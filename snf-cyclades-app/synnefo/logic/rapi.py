@@ -27,6 +27,7 @@
 
 import requests
 import logging
+import select
 import simplejson
 import time
 
@@ -167,9 +168,13 @@ class GanetiRapiClient(object): # pylint: disable=R0904
   _json_encoder = simplejson.JSONEncoder(sort_keys=True)
 
   def __init__(self, host, port=GANETI_RAPI_PORT,
-               username=None, password=None, logger=logging):
+               username=None, password=None, logger=logging,
+               timeout=None, stats=None):
     """Initializes this class.
 
+    The client keeps persistent connections to the cluster master, which are
+    reused by its requests.
+
     @type host: string
     @param host: the ganeti cluster master to interact with
     @type port: int
@@ -179,10 +184,18 @@ class GanetiRapiClient(object): # pylint: disable=R0904
     @type password: string
     @param password: the password to connect with
     @param logger: Logging object
+    @type timeout: float or tuple
+    @param timeout: timeout in seconds of the requests, or a tuple with the
+      connect and the read timeout (default is no timeout)
+    @param stats: object whose C{record(method, path, seconds, failed)}
+      method is called after each request
 
     """
     self._logger = logger
     self._base_url = "https://%s:%s" % (host, port)
+    self._timeout = timeout
+    self._stats = stats
+    self._session = requests.Session()
 
     if username is not None:
       if password is None:
@@ -231,12 +244,18 @@ class GanetiRapiClient(object): # pylint: disable=R0904
     self._logger.debug("Sending request %s %s (query=%r) (content=%r)",
                        method, url, query, encoded_content)
 
-    req_method = getattr(requests, method.lower())
-    r = req_method(url, auth=self._auth, headers=headers, params=query,
-                   data=encoded_content, verify=False)
-
+    start = time.time()
+    try:
+      r = self._session.request(method, url, auth=self._auth,
+                                headers=headers, params=query,
+                                data=encoded_content, verify=False,
+                                timeout=self._timeout)
+    except Exception:
+      self._RecordRequest(method, path, start, True)
+      raise
 
     http_code = r.status_code
+    self._RecordRequest(method, path, start, http_code != HTTP_OK)
     if r.content is not None:
         response_content = simplejson.loads(r.content)
     else:
@@ -255,6 +274,45 @@ class GanetiRapiClient(object): # pylint: disable=R0904
 
     return response_content
 
+  def _RecordRequest(self, method, path, start, failed):
+    """Reports the latency of a request to the stats object, if any.
+
+    """
+    if self._stats is not None:
+      self._stats.record(method, path, time.time() - start, failed)
+
+  def CloseDeadConnections(self):
+    """Closes the idle persistent connections that are no longer usable.
+
+    A connection is unusable when the server has closed it, or has sent
+    unexpected data over it. Such connections are detected by their socket
+    being readable while no request is in progress.
+
+    @rtype: int
+    @return: the number of the closed connections
+
+    """
+    closed = 0
+    for adapter in self._session.adapters.values():
+      pools = adapter.poolmanager.pools
+      for key in pools.keys():
+        pool = pools.get(key)
+        queue = getattr(pool, "pool", None)
+        if queue is None:
+          continue
+        for conn in list(queue.queue):
+          sock = getattr(conn, "sock", None)
+          if sock is not None and select.select((sock,), (), (), 0)[0]:
+            conn.close()
+            closed += 1
+    return closed
+
+  def Close(self):
+    """Closes the persistent connections to the cluster master.
+
+    """
+    self._session.close()
+
   def GetVersion(self):
     """Gets the Remote API version running on the cluster.
 
@@ -13,6 +13,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
+import threading
+
+from django.conf import settings
 from objpool import ObjectPool
 from synnefo.logic.rapi import GanetiRapiClient
 
@@ -21,11 +25,67 @@ log = getLogger(__name__)
 
 _pools = {}
 _hashes = {}
-pool_size = 8
+
+# Upper bounds, in seconds, of the buckets of the latency histograms of the
+# RAPI requests. The last bucket holds the slower requests.
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+
+class RapiStats(object):
+    """Latency histograms of the requests to a Ganeti RAPI, per endpoint.
+
+    The endpoints are identified by the method and the path of the requests,
+    with the name of the resource replaced, e.g. 'GET /2/instances/[name]'.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, method, path, seconds, failed):
+        endpoint = "%s %s" % (method, endpoint_path(path))
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = {"count": 0, "failed": 0, "total": 0.0, "max": 0.0,
+                         "histogram": [0] * (len(LATENCY_BUCKETS) + 1)}
+                self.endpoints[endpoint] = stats
+            stats["count"] += 1
+            stats["failed"] += int(failed)
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            stats["histogram"][bucket] += 1
+
+    def get(self, reset=False):
+        """Get the statistics of each endpoint, optionally resetting them."""
+        with self._lock:
+            endpoints = dict((endpoint, dict(stats,
+                                             histogram=stats["histogram"][:]))
+                             for endpoint, stats in self.endpoints.items())
+            if reset:
+                self.endpoints = {}
+        return endpoints
+
+
+def endpoint_path(path):
+    """Replace the name of the resource in the path of a RAPI request."""
+    parts = path.split("/")
+    if len(parts) > 3:
+        parts[3] = "[name]"
+    return "/".join(parts)
 
 
 class GanetiRapiClientPool(ObjectPool):
-    """Pool of Ganeti RAPI Clients."""
+    """Pool of Ganeti RAPI Clients.
+
+    Each client keeps persistent connections to the RAPI. The connections
+    that have been closed by the RAPI server are closed when the client is
+    taken from the pool. The latency of the requests of all the clients is
+    recorded in the 'stats' of the pool.
+
+    """
 
     def __init__(self, host, port, user, passwd, size=None):
         log.debug("INIT: Initializing pool of size %d, host %s,"
@@ -35,14 +95,22 @@ class GanetiRapiClientPool(ObjectPool):
         self.port = port
         self.user = user
         self.passwd = passwd
+        self.stats = RapiStats()
 
     def _pool_create(self):
         log.debug("CREATE: Creating new client from pool %r", self)
-        client = GanetiRapiClient(self.host, self.port, self.user, self.passwd)
+        timeout = (settings.GANETI_RAPI_CONNECT_TIMEOUT,
+                   settings.GANETI_RAPI_READ_TIMEOUT)
+        client = GanetiRapiClient(self.host, self.port, self.user, self.passwd,
+                                  timeout=timeout, stats=self.stats)
         client._pool = self
         return client
 
     def _pool_verify(self, client):
+        closed = client.CloseDeadConnections()
+        if closed:
+            log.debug("VERIFY: Closed %d dead connections of client %r",
+                      closed, client)
         return True
 
     def _pool_cleanup(self, conn):
@@ -61,7 +129,8 @@ def get_rapi_client(backend_id, backend_hash, host, port, user, passwd):
     # does the pool need to be created?
     if backend_hash not in _pools:
         log.debug("GET: No Pool. Creating new for host %s", host)
-        pool = GanetiRapiClientPool(host, port, user, passwd, pool_size)
+        pool = GanetiRapiClientPool(host, port, user, passwd,
+                                    settings.GANETI_RAPI_POOL_SIZE)
         _pools[backend_hash] = pool
         # Delete Pool for old backend_hash
         if backend_id in _hashes:
@@ -80,3 +149,31 @@ def put_rapi_client(client):
         log.debug("PUT: client %r does not have a pool", client)
         return
     pool.pool_put(client)
+
+
+def get_stats(reset=False):
+    """Get the latency statistics of the RAPI requests of this process.
+
+    Returns a dictionary from the host of each Ganeti backend to the
+    statistics of the endpoints of its RAPI, as returned by RapiStats.get.
+
+    """
+    return dict((pool.host, pool.stats.get(reset=reset))
+                for pool in _pools.values())
+
+
+def report_stats(logger=log):
+    """Log the latency statistics of the RAPI requests and reset them."""
+    buckets = ["<=%gs" % b for b in LATENCY_BUCKETS]
+    buckets.append(">%gs" % LATENCY_BUCKETS[-1])
+    for host, endpoints in sorted(get_stats(reset=True).items()):
+        for endpoint, stats in sorted(endpoints.items()):
+            histogram = ", ".join("%s: %d" % (bucket, count)
+                                  for bucket, count in zip(buckets,
+                                                           stats["histogram"])
+                                  if count)
+            logger.info("RAPI %s %s: %d requests (%d failed), latency avg"
+                        " %.3f max %.3f seconds (%s)", host, endpoint,
+                        stats["count"], stats["failed"],
+                        stats["total"] / stats["count"], stats["max"],
+                        histogram)
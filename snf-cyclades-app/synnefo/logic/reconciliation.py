@@ -35,15 +35,34 @@ In the code, D, G are Python dicts mapping instance ids to operating state.
 For D, the operating state is chosen from VirtualMachine.OPER_STATES.
 For G, the operating state is True if the machine is up, False otherwise.
 
+The fixes of each server are applied in a separate, short transaction.
+Multiple backends can be reconciled concurrently with reconcile_backends.
+
+Reconciliation can be incremental, based on the state of the previous
+reconciliation of a backend: the serial number and the operating state of
+each Ganeti instance, and the time of the reconciliation. Then, only the
+servers whose Ganeti instance changed, the servers that were updated in the
+DB since the previous reconciliation, the stale, orphan and building servers,
+and the servers with pending tasks are reconciled. Every
+RECONCILIATION_FULL_SWEEP_HOURS the reconciliation is a full one, as a safety
+net for changes that can not be detected, e.g. inconsistencies that were not
+fixed. Snapshots are reconciled only by full reconciliations.
+
 """
 
 
 from django.conf import settings
+from django.db import close_connection
+from django.db.models import Q
 
 import logging
 import itertools
+import threading
+import time
+import Queue
 import bitarray
 import simplejson as json
+from collections import Counter
 from datetime import datetime, timedelta
 
 from synnefo.db import transaction
@@ -62,9 +81,35 @@ logging.basicConfig()
 
 BUILDING_NIC_TIMEOUT = timedelta(seconds=120)
 
+# Fields of the Ganeti instances that are used by reconciliation
+GANETI_INSTANCE_FIELDS = ["name", "beparams", "oper_state", "mtime",
+                          "serial_no", "tags", "disk.sizes", "disk.names",
+                          "disk.uuids", "nic.ips", "nic.names", "nic.macs",
+                          "nic.networks.names"]
+
+# Stats of the inconsistencies of the servers that exist in both the DB and
+# Ganeti
+UNSYNCED_STATS = ("building", "unsynced_operstate", "unsynced_flavor",
+                  "unsynced_nics", "unsynced_disks", "pending_tasks")
+
 
 class BackendReconciler(object):
-    def __init__(self, backend, logger, options=None):
+    """Reconcile the servers of a backend.
+
+    The servers are reconciled until the `deadline' timestamp, if any, and the
+    rest are left for the next reconciliation. The number of servers found
+    in each inconsistent state, along with the time spent fetching the state
+    of the servers and reconciling them, are kept in `stats'.
+
+    If the `state' of the previous reconciliation of the backend is given,
+    the reconciliation is incremental, unless a full one is due. After a
+    complete reconciliation, the new state of the backend is kept in
+    `state'.
+
+    """
+
+    def __init__(self, backend, logger, options=None, deadline=None,
+                 state=None):
         self.backend = backend
         self.log = logger
         self.client = backend.get_client()
@@ -72,15 +117,74 @@ class BackendReconciler(object):
             self.options = {}
         else:
             self.options = options
+        self.deadline = deadline
+        self.state = state
+        self.stats = Counter()
+        # Servers that were found unsynced, which are checked again by the
+        # next reconciliation, whether they were fixed or not
+        self.unsynced = set()
 
     def close(self):
         self.backend.put_client(self.client)
 
-    @transaction.commit_on_success
     def reconcile(self):
         log = self.log
         backend = self.backend
         log.debug("Reconciling backend %s", backend)
+        self.stats = Counter()
+
+        try:
+            incremental = self.is_incremental()
+            start = time.time()
+            if incremental:
+                self.stats["incremental"] = 1
+                self.fetch_changed()
+            else:
+                self.fetch()
+            self.stats["fetch_time"] = time.time() - start
+
+            start = time.time()
+            self.stale_servers = self.reconcile_stale_servers()
+            self.orphan_servers = self.reconcile_orphan_servers()
+            self.unsynced_servers = self.reconcile_unsynced_servers()
+            if not incremental and not self.out_of_time():
+                self.unsynced_snapshots = self.reconcile_unsynced_snapshots()
+            self.stats["reconcile_time"] = time.time() - start
+        finally:
+            self.close()
+
+        if self.state is not None and not self.stats["out_of_time"]:
+            self.state = self.get_state(incremental)
+
+    def is_incremental(self):
+        """Check whether the reconciliation can be incremental."""
+        if not self.state or "instances" not in self.state:
+            return False
+        full_sweep = datetime.fromtimestamp(self.state["full_sweep"])
+        period = timedelta(hours=settings.RECONCILIATION_FULL_SWEEP_HOURS)
+        return datetime.now() < full_sweep + period
+
+    def get_state(self, incremental):
+        """Get the state of the backend after the reconciliation."""
+        event_time = time.mktime(self.event_time.timetuple())
+        if incremental:
+            instances = self.gnt_serials
+            full_sweep = self.state["full_sweep"]
+        else:
+            instances = dict((server_id, [server["serial_no"],
+                                          server["state"]])
+                             for server_id, server in self.gnt_servers.items())
+            full_sweep = event_time
+        return {"event_time": event_time,
+                "full_sweep": full_sweep,
+                "instances": dict((str(server_id), value)
+                                  for server_id, value in instances.items()
+                                  if server_id not in self.unsynced)}
+
+    def fetch(self):
+        """Get the state of the servers from the DB and the Ganeti backend."""
+        log = self.log
+        backend = self.backend
 
         self.event_time = datetime.now()
 
@@ -95,11 +199,67 @@ class BackendReconciler(object):
         self.gnt_jobs = get_ganeti_jobs(backend)
         log.debug("Got jobs from Ganeti backend")
 
-        self.stale_servers = self.reconcile_stale_servers()
-        self.orphan_servers = self.reconcile_orphan_servers()
-        self.unsynced_servers = self.reconcile_unsynced_servers()
-        self.unsynced_snapshots = self.reconcile_unsynced_snapshots()
-        self.close()
+        self.stats["servers"] = len(self.db_servers_keys |
+                                    self.gnt_servers_keys)
+
+    def fetch_changed(self):
+        """Get the state of the servers that may have changed since the
+        previous reconciliation."""
+        log = self.log
+        backend = self.backend
+
+        self.event_time = datetime.now()
+        since = datetime.fromtimestamp(self.state["event_time"])
+        previous = self.state["instances"]
+
+        self.gnt_serials = get_ganeti_server_serials(backend)
+        changed = set(server_id
+                      for server_id, value in self.gnt_serials.items()
+                      if previous.get(str(server_id)) != value)
+        log.debug("Got %d changed servers from Ganeti backend.", len(changed))
+
+        db_servers = backend.virtual_machines.filter(deleted=False)
+        db_ids = set(db_servers.values_list("id", flat=True))
+        changed |= set(db_servers.filter(Q(updated__gte=since) |
+                                         Q(operstate="BUILD") |
+                                         Q(task__isnull=False))
+                                 .values_list("id", flat=True))
+        # Stale and orphan servers
+        changed |= db_ids ^ set(self.gnt_serials.keys())
+
+        self.db_servers = get_database_servers(backend,
+                                               server_ids=changed & db_ids)
+        self.db_servers_keys = set(self.db_servers.keys())
+        log.debug("Got servers info from database.")
+
+        gnt_ids = changed & set(self.gnt_serials.keys())
+        self.gnt_servers = get_ganeti_servers(backend, server_ids=gnt_ids)
+        self.gnt_servers_keys = set(self.gnt_servers.keys())
+        log.debug("Got servers info from Ganeti backend.")
+
+        job_ids = set()
+        for db_server in self.db_servers.values():
+            if db_server.operstate == "BUILD":
+                job_ids.add(db_server.backendjobid)
+            if db_server.task is not None:
+                job_ids.add(db_server.task_job_id)
+        job_ids.discard(None)
+        self.gnt_jobs = get_ganeti_jobs(backend, job_ids=job_ids)
+        log.debug("Got jobs from Ganeti backend")
+
+        self.stats["servers"] = len(self.db_servers_keys |
+                                    self.gnt_servers_keys)
+
+    def out_of_time(self):
+        """Check whether the time for the reconciliation is over."""
+        if self.deadline is None or time.time() < self.deadline:
+            return False
+        if not self.stats["out_of_time"]:
+            self.log.warning("Reconciliation time of backend %s is over."
+                             " The remaining servers will be reconciled"
+                             " next time.", self.backend)
+            self.stats["out_of_time"] = 1
+        return True
 
     def get_build_status(self, db_server):
         """Return the status of the build job.
@@ -134,7 +294,10 @@ class BackendReconciler(object):
                 build_status, end_timestamp = self.get_build_status(db_server)
                 if build_status == "ERROR":
                     # Special handling of BUILD eerrors
-                    self.reconcile_building_server(db_server)
+                    if self.out_of_time():
+                        continue
+                    with transaction.commit_on_success():
+                        self.reconcile_building_server(db_server)
                 elif build_status != "RUNNING":
                     stale.append(server_id)
             elif (db_server.operstate == "ERROR" and
@@ -146,6 +309,7 @@ class BackendReconciler(object):
                 stale.append(server_id)
 
         # Report them
+        self.stats["stale"] += len(stale)
         if stale:
             self.log.info("Found stale servers %s at backend %s",
                           ", ".join(map(str, stale)), self.backend)
@@ -155,17 +319,21 @@ class BackendReconciler(object):
         # Fix them
         if stale and self.options["fix_stale"]:
             for server_id in stale:
-                vm = get_locked_server(server_id)
-                backend_mod.process_op_status(
-                    vm=vm,
-                    etime=self.event_time,
-                    jobid=-0,
-                    opcode='OP_INSTANCE_REMOVE', status='success',
-                    logmsg='Reconciliation: simulated Ganeti event')
+                if self.out_of_time():
+                    return
+                with transaction.commit_on_success():
+                    vm = get_locked_server(server_id)
+                    backend_mod.process_op_status(
+                        vm=vm,
+                        etime=self.event_time,
+                        jobid=-0,
+                        opcode='OP_INSTANCE_REMOVE', status='success',
+                        logmsg='Reconciliation: simulated Ganeti event')
             self.log.debug("Simulated Ganeti removal for stale servers.")
 
     def reconcile_orphan_servers(self):
         orphans = self.gnt_servers_keys - self.db_servers_keys
+        self.stats["orphans"] += len(orphans)
         if orphans:
             self.log.info("Found orphan servers %s at backend %s",
                           ", ".join(map(str, orphans)), self.backend)
@@ -174,39 +342,49 @@ class BackendReconciler(object):
 
         if orphans and self.options["fix_orphans"]:
             for server_id in orphans:
+                if self.out_of_time():
+                    return
                 server_name = utils.id_to_instance_name(server_id)
                 self.client.DeleteInstance(server_name)
             self.log.debug("Issued OP_INSTANCE_REMOVE for orphan servers.")
 
     def reconcile_unsynced_servers(self):
         for server_id in self.db_servers_keys & self.gnt_servers_keys:
-            db_server = self.db_servers[server_id]
-            gnt_server = self.gnt_servers[server_id]
-            if db_server.operstate == "BUILD":
-                build_status, end_timestamp = self.get_build_status(db_server)
-                if build_status == "RUNNING":
-                    # Do not reconcile building VMs
-                    continue
-                elif build_status == "ERROR":
-                    # Special handling of build errors
-                    self.reconcile_building_server(db_server)
-                    continue
-                elif end_timestamp >= self.event_time:
-                    # Do not continue reconciliation for building server that
-                    # the build job completed after quering the state of
-                    # Ganeti servers.
-                    continue
-
-            self.reconcile_unsynced_operstate(server_id, db_server,
-                                              gnt_server)
-            self.reconcile_unsynced_flavor(server_id, db_server,
-                                           gnt_server)
-            self.reconcile_unsynced_nics(server_id, db_server, gnt_server)
-            self.reconcile_unsynced_disks(server_id, db_server, gnt_server)
-            if db_server.task is not None:
-                self.reconcile_pending_task(server_id, db_server)
+            if self.out_of_time():
+                return
+            found = sum(self.stats[stat] for stat in UNSYNCED_STATS)
+            with transaction.commit_on_success():
+                self.reconcile_unsynced_server(server_id)
+            if sum(self.stats[stat] for stat in UNSYNCED_STATS) > found:
+                self.unsynced.add(server_id)
+
+    def reconcile_unsynced_server(self, server_id):
+        db_server = self.db_servers[server_id]
+        gnt_server = self.gnt_servers[server_id]
+        if db_server.operstate == "BUILD":
+            build_status, end_timestamp = self.get_build_status(db_server)
+            if build_status == "RUNNING":
+                # Do not reconcile building VMs
+                return
+            elif build_status == "ERROR":
+                # Special handling of build errors
+                self.reconcile_building_server(db_server)
+                return
+            elif end_timestamp >= self.event_time:
+                # Do not continue reconciliation for building server that
+                # the build job completed after quering the state of
+                # Ganeti servers.
+                return
+
+        self.reconcile_unsynced_operstate(server_id, db_server, gnt_server)
+        self.reconcile_unsynced_flavor(server_id, db_server, gnt_server)
+        self.reconcile_unsynced_nics(server_id, db_server, gnt_server)
+        self.reconcile_unsynced_disks(server_id, db_server, gnt_server)
+        if db_server.task is not None:
+            self.reconcile_pending_task(server_id, db_server)
 
     def reconcile_building_server(self, db_server):
+        self.stats["building"] += 1
         self.log.info("Server '%s' is BUILD in DB, but 'ERROR' in Ganeti.",
                       db_server.id)
         if self.options["fix_unsynced"]:
@@ -223,6 +401,7 @@ class BackendReconciler(object):
 
     def reconcile_unsynced_operstate(self, server_id, db_server, gnt_server):
         if db_server.operstate != gnt_server["state"]:
+            self.stats["unsynced_operstate"] += 1
             self.log.info("Server '%s' is '%s' in DB and '%s' in Ganeti.",
                           server_id, db_server.operstate, gnt_server["state"])
             if self.options["fix_unsynced"]:
@@ -259,6 +438,7 @@ class BackendReconciler(object):
                 self.log.warning("Server '%s' has unknown flavor.", server_id)
                 return
 
+            self.stats["unsynced_flavor"] += 1
             self.log.info("Server '%s' has flavor '%s' in DB and '%s' in"
                           " Ganeti", server_id, db_flavor, gnt_flavor)
             if self.options["fix_unsynced_flavors"]:
@@ -303,6 +483,7 @@ class BackendReconciler(object):
                 nics_changed = True
                 break
         if nics_changed:
+            self.stats["unsynced_nics"] += 1
             msg = "Found unsynced NICs for server '%s'.\n"\
                   "\tDB:\n\t\t%s\n\tGaneti:\n\t\t%s"
             db_nics_str = "\n\t\t".join(map(format_db_nic, db_nics))
@@ -336,6 +517,7 @@ class BackendReconciler(object):
                 disks_changed = True
                 break
         if disks_changed:
+            self.stats["unsynced_disks"] += 1
             msg = "Found unsynced disks for server '%s'.\n"\
                   "\tDB:\n\t\t%s\n\tGaneti:\n\t\t%s"
             db_disks_str = "\n\t\t".join(map(format_db_disk, db_disks))
@@ -365,6 +547,7 @@ class BackendReconciler(object):
             if db_server.task_job_id != job_id:
                 # task has changed!
                 return
+            self.stats["pending_tasks"] += 1
             self.log.info("Found server '%s' with pending task: '%s'",
                           server_id, db_server.task)
             if self.options["fix_pending_tasks"]:
@@ -384,6 +567,8 @@ class BackendReconciler(object):
                              if s["status"] == OBJECT_UNAVAILABLE]
 
         for snapshot in unavail_snapshots:
+            if self.out_of_time():
+                return
             uuid = snapshot["id"]
             backend_info = snapshot["backend_info"]
             if backend_info is None:
@@ -406,6 +591,7 @@ class BackendReconciler(object):
                     # Snapshot in unavailable but no job exists
                     state = OBJECT_ERROR
 
+                self.stats["unsynced_snapshots"] += 1
                 self.log.info("Snapshot '%s' is '%s' in Pithos DB but should"
                               " be '%s'", uuid, snapshot["status"], state)
                 if self.options["fix_unsynced_snapshots"]:
@@ -488,15 +674,110 @@ def get_online_backends():
     return Backend.objects.filter(offline=False)
 
 
-def get_database_servers(backend):
+def reconcile_backends(backends, logger, options, workers=1,
+                       time_budget=None, states=None):
+    """Reconcile the servers of a number of backends.
+
+    The backends are reconciled by `workers' threads, each one fetching the
+    state of a backend and reconciling its servers at a time, so that the
+    Ganeti backends are queried concurrently. If `time_budget' is set, the
+    reconciliation stops after this number of seconds, leaving the rest of
+    the servers for the next reconciliation.
+
+    If `states' is given, it is a dictionary with the state of the previous
+    reconciliation of each backend, by the ID of the backend as a string. The
+    reconciliation is incremental for the backends with a state, and the new
+    states of the backends are stored in the dictionary.
+
+    The progress of the reconciliation is logged after each backend. Returns
+    a dictionary with the stats of each reconciled backend, as kept by
+    BackendReconciler, or None for the backends that failed.
+
+    """
+    deadline = None
+    if time_budget is not None:
+        deadline = time.time() + time_budget
+    queue = Queue.Queue()
+    for backend in backends:
+        queue.put(backend)
+    results = {}
+    lock = threading.Lock()
+
+    def reconcile():
+        while True:
+            try:
+                backend = queue.get_nowait()
+            except Queue.Empty:
+                return
+            start = time.time()
+            try:
+                state = None
+                if states is not None:
+                    state = states.get(str(backend.id), {})
+                reconciler = BackendReconciler(backend, logger, options,
+                                               deadline=deadline, state=state)
+                reconciler.reconcile()
+                stats = reconciler.stats
+                if states is not None and reconciler.state:
+                    with lock:
+                        states[str(backend.id)] = reconciler.state
+            except Exception:
+                logger.exception("Failed to reconcile backend %s", backend)
+                stats = None
+            with lock:
+                results[backend] = stats
+                done = len(results)
+            logger.info("Reconciled backend %s in %.2f seconds (%d/%d): %s",
+                        backend, time.time() - start, done, len(backends),
+                        format_stats(stats) if stats is not None
+                        else "FAILED")
+
+    def reconcile_in_thread():
+        try:
+            reconcile()
+        finally:
+            close_connection()
+
+    if workers <= 1 or len(backends) <= 1:
+        reconcile()
+    else:
+        threads = [threading.Thread(target=reconcile_in_thread)
+                   for _ in range(min(workers, len(backends)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return results
+
+
+def format_stats(stats):
+    """Format the stats of the reconciliation of a backend."""
+    return ", ".join("%s: %s" % (key, "%.2f" % value
+                                 if isinstance(value, float) else value)
+                     for key, value in sorted(stats.items()))
+
+
+def get_database_servers(backend, server_ids=None):
     servers = backend.virtual_machines.select_related("flavor")\
                                       .prefetch_related("nics__ips__subnet")\
                                       .filter(deleted=False)
+    if server_ids is not None:
+        if not server_ids:
+            return {}
+        servers = servers.filter(id__in=server_ids)
     return dict([(s.id, s) for s in servers])
 
 
-def get_ganeti_servers(backend):
-    gnt_instances = backend_mod.get_instances(backend)
+def get_ganeti_servers(backend, server_ids=None):
+    if server_ids is None:
+        gnt_instances = backend_mod.get_instances(backend)
+    elif not server_ids:
+        return {}
+    else:
+        names = map(utils.id_to_instance_name, server_ids)
+        qfilter = ["|"] + [["==", "name", name] for name in names]
+        gnt_instances = backend_mod.query(backend, "instance",
+                                          GANETI_INSTANCE_FIELDS, qfilter)
     # Filter out non-synnefo instances
     snf_backend_prefix = settings.BACKEND_PREFIX_ID
     gnt_instances = filter(lambda i: i["name"].startswith(snf_backend_prefix),
@@ -522,6 +803,7 @@ def parse_gnt_instance(instance):
     return {
         "id": instance_id,
         "state": state,  # FIX
+        "serial_no": instance.get("serial_no"),
         "updated": datetime.fromtimestamp(instance["mtime"]),
         "disks": disks_from_instance(instance),
         "nics": nics_from_instance(instance),
@@ -566,8 +848,40 @@ def disks_from_instance(i):
     return disks
 
 
-def get_ganeti_jobs(backend):
-    gnt_jobs = backend_mod.get_jobs(backend)
+def get_ganeti_server_serials(backend):
+    """Get the serial number and the operating state of the Ganeti servers.
+
+    These are retrieved without the rest of the info of the instances, and
+    are used to detect the instances that have changed.
+
+    """
+    gnt_instances = backend_mod.query(backend, "instance",
+                                      ["name", "serial_no", "oper_state"])
+    snf_backend_prefix = settings.BACKEND_PREFIX_ID
+    serials = {}
+    for instance in gnt_instances:
+        if not instance["name"].startswith(snf_backend_prefix):
+            continue
+        try:
+            instance_id = utils.id_from_instance_name(instance["name"])
+        except Exception:
+            logger.error("Ignoring instance with malformed name %s",
+                         instance["name"])
+            continue
+        state = instance["oper_state"] and "STARTED" or "STOPPED"
+        serials[instance_id] = [instance["serial_no"], state]
+    return serials
+
+
+def get_ganeti_jobs(backend, job_ids=None):
+    if job_ids is None:
+        gnt_jobs = backend_mod.get_jobs(backend)
+    elif not job_ids:
+        return {}
+    else:
+        qfilter = ["|"] + [["==", "id", int(job_id)] for job_id in job_ids]
+        gnt_jobs = backend_mod.query(backend, "job",
+                                     ["id", "status", "end_ts"], qfilter)
     return dict([(int(j["id"]), j) for j in gnt_jobs])
 
 
@@ -852,7 +1166,7 @@ def check_pool_consistent(pool, pool_class, used_values, fix, logger):
                 or "unavailable"
             logger.error(msg, pool, value, value1, value2)
         if fix:
-            pool.available = dummy_pool.available
+            pool.set_maps(available=dummy_pool.available)
             pool.save()
             logger.info("Fixed available map of pool '%s'", pool)
 
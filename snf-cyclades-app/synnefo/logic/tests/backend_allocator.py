@@ -0,0 +1,215 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Provides automated tests for the backend allocator
+
+from __future__ import division
+from datetime import datetime, timedelta
+from functools import partial
+
+from django.conf import settings
+from django.test import TestCase
+from mock import patch
+
+from synnefo.db import models_factory as mfactory
+from synnefo.db.models import Backend
+from synnefo.logic import backend_allocator
+from synnefo.logic.allocators import simulation, vector_allocator
+from synnefo.logic.backend_allocator import BackendAllocator
+from snf_django.utils.testing import override_settings
+
+
+class BackendAllocatorTest(TestCase):
+    def setUp(self):
+        self.flavor = mfactory.FlavorFactory(ram=1024, disk=10,
+                                             volume_type__disk_template="file")
+        backend_allocator.capacity_model.loaded = None
+
+    def test_allocate(self):
+        backend = mfactory.BackendFactory()
+        allocated = BackendAllocator().allocate("user", self.flavor)
+        self.assertEqual(allocated, backend)
+        backend = Backend.objects.get(id=backend.id)
+        self.assertEqual(backend.mfree, 8192 - 1024)
+        self.assertEqual(backend.dfree, 132423 - 10 * 1024)
+        self.assertEqual(backend.pinst_cnt, 3)
+        # The default strategy does not use the vCPUs of the backends
+        with backend_allocator.capacity_model.lock:
+            backends = backend_allocator.capacity_model.get_backends()
+        self.assertFalse(hasattr(backends[0], "vcpus"))
+
+    def test_no_backends(self):
+        mfactory.BackendFactory(disk_templates=["drbd"])
+        mfactory.BackendFactory(drained=True)
+        mfactory.BackendFactory(offline=True)
+        self.assertEqual(BackendAllocator().allocate("user", self.flavor),
+                         None)
+
+    def test_overcommit(self):
+        backend = mfactory.BackendFactory(mfree=512)
+        self.assertEqual(BackendAllocator().allocate("user", self.flavor),
+                         backend)
+        backend = Backend.objects.get(id=backend.id)
+        self.assertEqual(backend.mfree, 0)
+        self.assertEqual(backend.pinst_cnt, 3)
+
+    def test_stale_model(self):
+        backend1 = mfactory.BackendFactory(mfree=16384)
+        backend2 = mfactory.BackendFactory(mfree=2048)
+        with override_settings(settings, BACKEND_ALLOCATOR_MODEL_TIMEOUT=300):
+            backend_allocator.get_available_backends(self.flavor)
+            # Changes of the backends are noticed when allocation fails
+            Backend.objects.filter(id=backend1.id).update(drained=True)
+            allocated = BackendAllocator().allocate("user", self.flavor)
+            self.assertEqual(allocated, backend2)
+            self.assertEqual(Backend.objects.get(id=backend2.id).mfree, 1024)
+            # The model is updated with the reserved resources
+            with backend_allocator.capacity_model.lock:
+                backends = backend_allocator.capacity_model.get_backends()
+            self.assertEqual([(b.id, b.mfree) for b in backends],
+                             [(backend2.id, 1024)])
+
+    @patch("synnefo.logic.backend.get_available_disk_templates")
+    def test_missing_disk_templates(self, disk_templates):
+        backend = mfactory.BackendFactory(disk_templates=[])
+        disk_templates.return_value = ["file", "plain"]
+        # The disk templates are fetched once, when the model is loaded
+        with override_settings(settings, BACKEND_ALLOCATOR_MODEL_TIMEOUT=300):
+            allocated = BackendAllocator().allocate("user", self.flavor)
+            self.assertEqual(allocated, backend)
+            self.assertEqual(BackendAllocator().allocate("user", self.flavor),
+                             backend)
+        disk_templates.assert_called_once_with(backend)
+        self.assertEqual(Backend.objects.get(id=backend.id).disk_templates,
+                         ["file", "plain"])
+
+    @patch("synnefo.logic.backend_allocator.close_connection")
+    @patch("synnefo.logic.backend_allocator.threading.Thread")
+    @patch("synnefo.logic.backend.get_physical_resources")
+    def test_refresh_stats(self, resources, thread, close_connection):
+        updated = datetime.now() - timedelta(minutes=60)
+        backend = mfactory.BackendFactory()
+        Backend.objects.filter(id=backend.id).update(updated=updated)
+        # Backend stats are refreshed in the background
+        allocated = BackendAllocator().allocate("user", self.flavor)
+        self.assertEqual(allocated, backend)
+        thread.assert_called_once_with(
+            target=backend_allocator.refresh_backend_stats,
+            args=(backend.id,))
+        self.assertFalse(resources.called)
+
+        resources.return_value = {"mfree": 4096, "mtotal": 16384,
+                                  "dfree": 1024, "dtotal": 2048,
+                                  "pinst_cnt": 7, "ctotal": 16}
+        backend_allocator.refresh_backend_stats(backend.id)
+        backend = Backend.objects.get(id=backend.id)
+        self.assertEqual((backend.mfree, backend.dfree, backend.pinst_cnt),
+                         (4096, 1024, 7))
+        self.assertTrue(backend.updated > updated)
+
+    def test_vector_allocator(self):
+        backend1 = mfactory.BackendFactory(mfree=2048)
+        backend2 = mfactory.BackendFactory(mfree=4096)
+        mfactory.VirtualMachineFactory(backend=backend2, flavor__cpu=2)
+        module = "synnefo.logic.allocators.vector_allocator"
+        with override_settings(settings, BACKEND_ALLOCATOR_MODULE=module,
+                               BACKEND_ALLOCATOR_POLICY="best_fit",
+                               BACKEND_ALLOCATOR_MODEL_TIMEOUT=300):
+            allocated = [BackendAllocator().allocate("user", self.flavor)
+                         for _ in range(3)]
+            self.assertEqual(allocated, [backend1, backend1, backend2])
+            self.assertEqual(Backend.objects.get(id=backend1.id).mfree, 0)
+            self.assertEqual(Backend.objects.get(id=backend2.id).mfree, 3072)
+            # The model keeps track of the vCPUs of the backends
+            with backend_allocator.capacity_model.lock:
+                backends = backend_allocator.capacity_model.get_backends()
+            self.assertEqual(sorted((b.id, b.vcpus) for b in backends),
+                             [(backend1.id, 2 * self.flavor.cpu),
+                              (backend2.id, 2 + self.flavor.cpu)])
+
+
+class DummyBackend(object):
+    def __init__(self, id, mfree, dfree=1000, ctotal=4, vcpus=0,
+                 mtotal=1000, dtotal=1000):
+        self.id = id
+        self.mfree = mfree
+        self.dfree = dfree
+        self.mtotal = mtotal
+        self.dtotal = dtotal
+        self.ctotal = ctotal
+        self.vcpus = vcpus
+        self.pinst_cnt = 0
+
+    def __repr__(self):
+        return "<DummyBackend %s>" % self.id
+
+
+class VectorAllocatorTest(TestCase):
+    def setUp(self):
+        patcher = patch.object(settings, "BACKEND_ALLOCATOR_VCPU_RATIO", 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.backends = [DummyBackend(1, mfree=300),
+                         DummyBackend(2, mfree=900),
+                         DummyBackend(3, mfree=500, vcpus=3)]
+        self.vm = {"cpu": 1, "ram": 200, "disk": 100}
+
+    def allocate(self, policy, vm=None):
+        return vector_allocator.allocate(self.backends, vm or self.vm,
+                                         policy=policy).id
+
+    def test_policies(self):
+        self.assertEqual(self.allocate("best_fit"), 3)
+        self.assertEqual(self.allocate("worst_fit"), 2)
+        self.assertEqual(self.allocate("spread"), 2)
+        # The third backend lacks the vCPUs to host the vm
+        vm = {"cpu": 3, "ram": 200, "disk": 100}
+        self.assertEqual(self.allocate("best_fit", vm), 1)
+        self.assertRaises(ValueError, self.allocate, "first_fit")
+
+    def test_overcommit(self):
+        vm = {"cpu": 1, "ram": 1000, "disk": 100}
+        self.assertEqual(self.allocate("best_fit", vm), 2)
+
+    def test_allocate_many(self):
+        backends = vector_allocator.allocate_many(self.backends, self.vm, 5,
+                                                  policy="best_fit")
+        self.assertEqual([b.id for b in backends], [3, 1, 2, 2, 2])
+        backends = vector_allocator.allocate_many(self.backends, self.vm, 4,
+                                                  policy="spread")
+        self.assertEqual([b.id for b in backends], [2, 2, 2, 1])
+
+    def test_simulation(self):
+        backends = [simulation.SimulatedBackend(i, "backend%d" % i,
+                                                mtotal=1000, dtotal=1000,
+                                                ctotal=4)
+                    for i in range(2)]
+        trace = ['{"action": "create", "id": %d, "cpu": 1, "ram": 300,'
+                 ' "disk": 100}' % i for i in range(4)]
+        trace += ['{"action": "delete", "id": 1}',
+                  '{"action": "delete", "id": 42}']
+        trace = list(simulation.load_trace(trace))
+        allocate = partial(vector_allocator.allocate, policy="best_fit")
+        placements, counts = simulation.replay(trace, backends, allocate)
+        self.assertEqual(dict(counts), {"created": 4, "deleted": 1})
+        self.assertEqual(sorted((k, b.id) for k, (b, _) in placements.items()),
+                         [(0, 0), (2, 0), (3, 1)])
+        self.assertEqual((backends[0].mfree, backends[0].vcpus), (400, 2))
+
+        vm = {"cpu": 1, "ram": 300, "disk": 100}
+        free_vms, fragmentation = simulation.fragmentation(backends, vm)
+        self.assertEqual(free_vms, 3)
+        self.assertEqual(fragmentation["ram"], 200 / 1100)
+        self.assertEqual(fragmentation["cpu"], 2 / 5)
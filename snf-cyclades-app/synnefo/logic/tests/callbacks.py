@@ -28,7 +28,7 @@ from datetime import datetime
 from mock import patch
 from synnefo.api.util import allocate_resource
 from synnefo.logic.callbacks import (update_db, update_network,
-                                     update_build_progress)
+                                     update_build_progress, find_superseded)
 from snf_django.utils.testing import mocked_quotaholder
 from synnefo.logic.rapi import GanetiApiError
 
@@ -712,3 +712,57 @@ class UpdateBuildProgressTest(TestCase):
             self.assertTrue(client.basic_ack.called)
             vm = self.get_db_vm()
             self.assertEqual(vm.buildpercentage, old)
+
+
+class FindSupersededTest(TestCase):
+    def create_msg(self, event_time, **kwargs):
+        kwargs['event_time'] = split_time(event_time)
+        return {'body': json.dumps(kwargs)}
+
+    def test_op_status(self):
+        t = time()
+        msgs = [self.create_msg(t, type='ganeti-op-status', instance='vm',
+                                jobId=1, status='queued'),
+                self.create_msg(t + 1, type='ganeti-op-status',
+                                instance='vm', jobId=1, status='running'),
+                self.create_msg(t + 2, type='ganeti-op-status',
+                                instance='vm', jobId=2, status='running'),
+                self.create_msg(t + 3, type='ganeti-op-status',
+                                instance='vm', jobId=1, status='success'),
+                self.create_msg(t + 4, type='ganeti-op-status',
+                                instance='vm', jobId=1, status='error')]
+        # Terminal statuses are never superseded
+        self.assertEqual(find_superseded(msgs), [0, 1])
+
+    def test_out_of_order(self):
+        t = time()
+        msgs = [self.create_msg(t + 1, type='ganeti-op-status',
+                                instance='vm', jobId=1, status='running'),
+                self.create_msg(t, type='ganeti-op-status', instance='vm',
+                                jobId=1, status='queued')]
+        self.assertEqual(find_superseded(msgs), [])
+
+    def test_build_progress(self):
+        t = time()
+        msgs = [self.create_msg(t, type='image-copy-progress',
+                                instance='vm', progress=10),
+                self.create_msg(t + 1, type='image-info', instance='vm',
+                                messages=['info']),
+                self.create_msg(t + 2, type='image-copy-progress',
+                                instance='vm2', progress=10),
+                self.create_msg(t + 3, type='image-copy-progress',
+                                instance='vm', progress=50),
+                {'body': 'invalid'}]
+        self.assertEqual(find_superseded(msgs), [0])
+
+    def test_network_modify(self):
+        t = time()
+        msgs = [self.create_msg(t, type='ganeti-network-status',
+                                network='net', cluster='cluster', jobId=1,
+                                operation='OP_NETWORK_SET_PARAMS',
+                                status='running'),
+                self.create_msg(t + 1, type='ganeti-network-status',
+                                network='net', cluster='cluster', jobId=1,
+                                operation='OP_NETWORK_SET_PARAMS',
+                                status='success')]
+        self.assertEqual(find_superseded(msgs), [])
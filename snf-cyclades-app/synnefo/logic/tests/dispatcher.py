@@ -0,0 +1,197 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Provides automated tests for the workers of the dispatcher
+
+import json
+import threading
+
+from django.test import TestCase
+from mock import Mock, patch
+
+from synnefo.logic.dispatcher import CallbackWorkers, DispatcherStats
+
+# Seconds to wait for a worker to reach a point of a test
+WAIT_TIMEOUT = 10
+
+
+def create_msg(**kwargs):
+    return {"body": json.dumps(kwargs)}
+
+
+@patch("synnefo.logic.dispatcher.connections")
+@patch("synnefo.logic.dispatcher.close_connection")
+class CallbackWorkersTest(TestCase):
+    def setUp(self):
+        self.client = Mock()
+        self.stats = DispatcherStats()
+
+    def test_partition(self, close_connection, connections):
+        connections.all.return_value = []
+        workers = CallbackWorkers(3, self.stats)
+        keys = [("instance", "vm1"), ("network", "net1"),
+                ("cluster", "cluster1"), ("instance", "vm2")]
+        processed = []
+        lock = threading.Lock()
+
+        def update_db(client, message):
+            body = json.loads(message["body"])
+            with lock:
+                processed.append((threading.current_thread().name,
+                                  body["key"], body["seq"]))
+            client.basic_ack(message)
+
+        # Messages of the same object go to the same worker
+        for kind, key in keys:
+            index = workers._partition(create_msg(seq=0, **{kind: key}))
+            self.assertEqual(workers._partition(
+                create_msg(seq=1, type="ganeti-op-status", **{kind: key})),
+                index)
+
+        dispatch = workers.wrap(update_db)
+        for seq in range(40):
+            kind, key = keys[seq % len(keys)]
+            dispatch(self.client, create_msg(key=key, seq=seq,
+                                             **{kind: key}))
+        workers.stop(self.client)
+
+        self.assertEqual(len(processed), 40)
+        self.assertEqual(self.client.basic_ack.call_count, 40)
+        # and are processed in the order they arrived
+        for kind, key in keys:
+            threads = set(t for t, k, s in processed if k == key)
+            self.assertEqual(len(threads), 1)
+            sequence = [s for t, k, s in processed if k == key]
+            self.assertEqual(sequence, sorted(sequence))
+            self.assertEqual(len(sequence), 10)
+
+    def test_send_acks(self, close_connection, connections):
+        connections.all.return_value = []
+        workers = CallbackWorkers(1, self.stats)
+        processed = threading.Event()
+        msgs = [create_msg(instance="vm1", seq=i) for i in range(3)]
+
+        def update_db(client, message):
+            seq = json.loads(message["body"])["seq"]
+            if seq == 0:
+                client.basic_ack(message)
+            elif seq == 1:
+                client.basic_nack(message)
+            else:
+                client.basic_reject(message, requeue=True)
+                processed.set()
+
+        dispatch = workers.wrap(update_db)
+        for msg in msgs:
+            dispatch(self.client, msg)
+        self.assertTrue(processed.wait(WAIT_TIMEOUT))
+        # The acknowledgments of the workers are only queued
+        self.assertFalse(self.client.basic_ack.called)
+        self.assertFalse(self.client.basic_nack.called)
+        self.assertFalse(self.client.basic_reject.called)
+
+        # and sent by the main loop
+        workers.send_acks(self.client)
+        self.client.basic_ack.assert_called_once_with(msgs[0])
+        self.client.basic_nack.assert_called_once_with(msgs[1])
+        self.client.basic_reject.assert_called_once_with(msgs[2],
+                                                         requeue=True)
+        workers.stop(self.client)
+        self.assertEqual(self.client.basic_ack.call_count, 1)
+
+    def test_failed_callback(self, close_connection, connections):
+        connections.all.return_value = []
+        workers = CallbackWorkers(1, self.stats)
+        processed = threading.Event()
+        msgs = [create_msg(instance="vm1", seq=i) for i in range(2)]
+
+        def update_db(client, message):
+            if json.loads(message["body"])["seq"] == 0:
+                raise Exception("Failed")
+            client.basic_ack(message)
+            processed.set()
+
+        dispatch = workers.wrap(update_db)
+        for msg in msgs:
+            dispatch(self.client, msg)
+        self.assertTrue(processed.wait(WAIT_TIMEOUT))
+        # The message is rejected and the DB connection is closed
+        self.assertEqual(close_connection.call_count, 1)
+        workers.send_acks(self.client)
+        self.client.basic_reject.assert_called_once_with(msgs[0],
+                                                         requeue=False)
+        self.client.basic_ack.assert_called_once_with(msgs[1])
+        workers.stop(self.client)
+        self.assertEqual(self.stats.callbacks["update_db"][0], 2)
+
+    def test_stop(self, close_connection, connections):
+        connections.all.return_value = []
+        workers = CallbackWorkers(2, self.stats)
+        release = threading.Event()
+        msgs = [create_msg(instance="vm%d" % (i % 4), seq=i)
+                for i in range(20)]
+
+        def update_db(client, message):
+            release.wait(WAIT_TIMEOUT)
+            client.basic_ack(message)
+
+        dispatch = workers.wrap(update_db)
+        for msg in msgs:
+            dispatch(self.client, msg)
+        timer = threading.Timer(0.1, release.set)
+        timer.start()
+        # The pending messages are processed and their acks are sent
+        workers.stop(self.client)
+        timer.join()
+        self.assertEqual(self.client.basic_ack.call_count, 20)
+        for msg in msgs:
+            self.client.basic_ack.assert_any_call(msg)
+        self.assertFalse(any(t.is_alive() for t in workers.threads))
+        self.assertTrue(workers.acks.empty())
+
+
+class DispatcherStatsTest(TestCase):
+    def test_record(self):
+        stats = DispatcherStats()
+        msg = create_msg(instance="vm1", event_time=[100, 500000])
+        stats.record("update_db", msg, 101.0, 101.25)
+        stats.record("update_db", msg, 102.0, 102.75)
+        # Messages without an event time have no lag
+        stats.record("update_db", create_msg(instance="vm1"), 103.0, 103.5)
+        stats.record("update_db", {"body": "invalid"}, 104.0, 104.5)
+        stats.record_superseded("update_db")
+        self.assertEqual(stats.callbacks["update_db"], [4, 2.0, 0.75, 1])
+        self.assertEqual(stats.lag_count, 2)
+        self.assertAlmostEqual(stats.lag_total, 2.0)
+        self.assertAlmostEqual(stats.lag_max, 1.5)
+
+    @patch("synnefo.logic.dispatcher.log")
+    def test_report(self, log):
+        stats = DispatcherStats()
+        stats.record("update_db", create_msg(event_time=[100, 0]),
+                     101.0, 101.5)
+        stats.record("update_network", create_msg(), 102.0, 102.25)
+        stats.report()
+        calls = [c[0] for c in log.info.call_args_list]
+        self.assertEqual([(c[1], c[2], c[3], c[5], c[6]) for c in calls[:2]],
+                         [("update_db", 1, 0, 0.5, 0.5),
+                          ("update_network", 1, 0, 0.25, 0.25)])
+        self.assertEqual(calls[2][1:], (1.0, 1.0))
+        # The statistics are reset after each report
+        self.assertEqual(stats.callbacks, {})
+        self.assertEqual(stats.lag_count, 0)
+        log.reset_mock()
+        stats.report()
+        self.assertFalse(log.info.called)
@@ -13,11 +13,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import socket
+
 from django.test import TestCase
 
 from synnefo.logic import rapi_pool
+from synnefo.logic.rapi import GanetiRapiClient
 
-from mock import patch
+from mock import patch, ANY
 
 
 @patch('synnefo.logic.rapi_pool.GanetiRapiClient', spec=True)
@@ -25,7 +28,8 @@ class GanetiRapiPoolTest(TestCase):
     def test_new_client(self, rclient):
         cl = rapi_pool.get_rapi_client(1, 'amxixa', 'cluster0', '5080', 'user',
                                        'pass')
-        rclient.assert_called_once_with("cluster0", "5080", "user", "pass")
+        rclient.assert_called_once_with("cluster0", "5080", "user", "pass",
+                                        timeout=(10, None), stats=ANY)
         self.assertTrue('amxixa' in rapi_pool._pools)
         self.assertTrue(cl._pool is rapi_pool._pools[rapi_pool._hashes[1]])
 
@@ -38,23 +42,26 @@ class GanetiRapiPoolTest(TestCase):
     def test_get_from_pool(self, rclient):
         cl = rapi_pool.get_rapi_client(1, 'dummyhash', 'cluster1', '5080',
                                        'user', 'pass')
-        rclient.assert_called_once_with("cluster1", "5080", "user", "pass")
+        rclient.assert_called_once_with("cluster1", "5080", "user", "pass",
+                                        timeout=(10, None), stats=ANY)
         rapi_pool.put_rapi_client(cl)
         rclient.reset_mock()
         cl2 = rapi_pool.get_rapi_client(1, 'dummyhash', 'cluster1', '5080',
                                         'user', 'pass')
         self.assertTrue(cl is cl2)
-        self.assertFalse(rclient.mock_calls)
+        self.assertFalse(rclient.called)
 
     def test_changed_credentials(self, rclient):
         cl = rapi_pool.get_rapi_client(1, 'dummyhash2', 'cluster2', '5080',
                                        'user', 'pass')
-        rclient.assert_called_once_with("cluster2", "5080", "user", "pass")
+        rclient.assert_called_once_with("cluster2", "5080", "user", "pass",
+                                        timeout=(10, None), stats=ANY)
         rapi_pool.put_rapi_client(cl)
         rclient.reset_mock()
         rapi_pool.get_rapi_client(1, 'dummyhash3', 'cluster2', '5080',
                                   'user', 'new_pass')
-        rclient.assert_called_once_with("cluster2", "5080", "user", "new_pass")
+        rclient.assert_called_once_with("cluster2", "5080", "user", "new_pass",
+                                        timeout=(10, None), stats=ANY)
         self.assertFalse('dummyhash2' in rapi_pool._pools)
 
     def test_no_pool(self, rclient):
@@ -63,3 +70,65 @@ class GanetiRapiPoolTest(TestCase):
         cl._pool = None
         rapi_pool.put_rapi_client(cl)
         self.assertTrue(cl not in rapi_pool._pools.values())
+
+    def test_verify(self, rclient):
+        cl = rapi_pool.get_rapi_client(1, 'dummyhash4', 'cluster4', '5080',
+                                       'user', 'pass')
+        rapi_pool.put_rapi_client(cl)
+        cl.CloseDeadConnections.reset_mock()
+        cl2 = rapi_pool.get_rapi_client(1, 'dummyhash4', 'cluster4', '5080',
+                                        'user', 'pass')
+        self.assertTrue(cl is cl2)
+        cl.CloseDeadConnections.assert_called_once_with()
+
+
+class RapiStatsTest(TestCase):
+    def test_stats(self):
+        stats = rapi_pool.RapiStats()
+        stats.record("GET", "/2/instances/snf-1", 0.02, False)
+        stats.record("GET", "/2/instances/snf-2", 0.5, True)
+        stats.record("GET", "/2/instances/snf-2", 40, False)
+        stats.record("PUT", "/2/instances/snf-2/startup", 0.001, False)
+        stats.record("GET", "/version", 0.001, False)
+        endpoints = stats.get(reset=True)
+        self.assertEqual(sorted(endpoints.keys()),
+                         ["GET /2/instances/[name]", "GET /version",
+                          "PUT /2/instances/[name]/startup"])
+        instance = endpoints["GET /2/instances/[name]"]
+        self.assertEqual((instance["count"], instance["failed"],
+                          instance["max"]), (3, 1, 40))
+        self.assertEqual(instance["histogram"], [0, 1, 0, 1, 0, 0, 0, 0, 1])
+        self.assertEqual(stats.get(), {})
+
+    def test_client_stats(self):
+        stats = rapi_pool.RapiStats()
+        client = GanetiRapiClient("cluster0", stats=stats)
+        with patch.object(client._session, "request") as request:
+            request.return_value.status_code = 200
+            request.return_value.content = "2"
+            self.assertEqual(client.GetVersion(), 2)
+            request.return_value.status_code = 500
+            request.return_value.content = '"Error"'
+            self.assertRaises(Exception, client.GetVersion)
+            request.side_effect = IOError
+            self.assertRaises(IOError, client.GetVersion)
+        version = stats.get()["GET /version"]
+        self.assertEqual((version["count"], version["failed"]), (3, 2))
+        self.assertEqual(request.call_args[1]["timeout"], None)
+
+    def test_dead_connections(self):
+        client = GanetiRapiClient("cluster0")
+        adapter = client._session.get_adapter("https://cluster0:5080")
+        pool = adapter.poolmanager.connection_from_url("https://cluster0:5080")
+        alive, dead = socket.socketpair(), socket.socketpair()
+        dead[1].close()
+        conns = [pool._get_conn() for i in range(2)]
+        for conn, sock in zip(conns, (alive[0], dead[0])):
+            conn.sock = sock
+            pool._put_conn(conn)
+        self.assertEqual(client.CloseDeadConnections(), 1)
+        self.assertTrue(conns[0].sock is not None)
+        self.assertTrue(conns[1].sock is None)
+        self.assertEqual(client.CloseDeadConnections(), 0)
+        alive[1].close()
+        client.Close()
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
+from datetime import datetime, timedelta
 from django.test import TestCase
 
 from synnefo.db.models import VirtualMachine, Network, BackendNetwork
@@ -100,6 +101,101 @@ class ServerReconciliationTest(TestCase):
         vm3 = VirtualMachine.objects.get(id=vm3.id)
         self.assertTrue(vm3.deleted)
 
+    def test_reconcile_backends(self, mrapi):
+        vm1 = mfactory.VirtualMachineFactory(backend=self.backend,
+                                             deleted=False,
+                                             operstate="ACTIVE")
+        options = dict(self.reconciler.options, fix_stale=True)
+        # No time left for reconciliation
+        with mocked_quotaholder():
+            results = reconciliation.reconcile_backends(
+                [self.backend], logging.getLogger(), options, time_budget=0)
+        self.assertEqual(results.keys(), [self.backend])
+        stats = results[self.backend]
+        self.assertEqual((stats["servers"], stats["stale"],
+                          stats["out_of_time"]), (1, 1, 1))
+        self.assertFalse(VirtualMachine.objects.get(id=vm1.id).deleted)
+
+        with mocked_quotaholder():
+            results = reconciliation.reconcile_backends(
+                [self.backend], logging.getLogger(), options, workers=4)
+        self.assertEqual(results[self.backend]["stale"], 1)
+        self.assertFalse(results[self.backend]["out_of_time"])
+        self.assertTrue(VirtualMachine.objects.get(id=vm1.id).deleted)
+
+    def test_incremental(self, mrapi):
+        vm1 = mfactory.VirtualMachineFactory(backend=self.backend,
+                                             deleted=False,
+                                             operstate="STARTED")
+        vm2 = mfactory.VirtualMachineFactory(backend=self.backend,
+                                             deleted=False,
+                                             operstate="STOPPED")
+
+        def instance(vm, serial_no, oper_state):
+            return {"name": vm.backend_vm_id,
+                    "beparams": {"maxmem": vm.flavor.ram,
+                                 "minmem": vm.flavor.ram,
+                                 "vcpus": vm.flavor.cpu},
+                    "oper_state": oper_state,
+                    "mtime": time(),
+                    "serial_no": serial_no,
+                    "disk.sizes": [],
+                    "disk.names": [],
+                    "disk.uuids": [],
+                    "nic.ips": [],
+                    "nic.names": [],
+                    "nic.macs": [],
+                    "nic.networks.names": [],
+                    "tags": []}
+
+        instances = [instance(vm1, 1, True), instance(vm2, 1, False)]
+        mrapi().GetInstances.return_value = instances
+        # The first reconciliation is a full one
+        reconciler = reconciliation.BackendReconciler(
+            self.backend, logging.getLogger(), self.reconciler.options,
+            state={})
+        reconciler.reconcile()
+        self.assertFalse(reconciler.stats["incremental"])
+        self.assertEqual(reconciler.state["instances"],
+                         {str(vm1.id): [1, "STARTED"],
+                          str(vm2.id): [1, "STOPPED"]})
+        VirtualMachine.objects.update(updated=datetime.now() -
+                                      timedelta(hours=1))
+
+        # Only the changed server is reconciled
+        instances[1] = instance(vm2, 2, True)
+
+        def query(what, fields, qfilter=None):
+            names = [i["name"] for i in instances]
+            if qfilter is not None:
+                names = [f[2] for f in qfilter[1:]]
+            return {"fields": [{"name": field} for field in fields],
+                    "data": [[[0, i[field]] for field in fields]
+                             for i in instances if i["name"] in names]}
+        mrapi().Query.side_effect = query
+        reconciler = reconciliation.BackendReconciler(
+            self.backend, logging.getLogger(), self.reconciler.options,
+            state=reconciler.state)
+        with mocked_quotaholder():
+            reconciler.reconcile()
+        self.assertTrue(reconciler.stats["incremental"])
+        self.assertEqual(reconciler.stats["servers"], 1)
+        self.assertEqual(VirtualMachine.objects.get(id=vm2.id).operstate,
+                         "STARTED")
+        mrapi().Query.assert_called_with(
+            "instance", reconciliation.GANETI_INSTANCE_FIELDS,
+            qfilter=["|", ["==", "name", vm2.backend_vm_id]])
+        # The fixed server is checked again by the next reconciliation
+        self.assertEqual(reconciler.state["instances"],
+                         {str(vm1.id): [1, "STARTED"]})
+
+        # A full reconciliation is performed periodically
+        reconciler.state["full_sweep"] -= \
+            settings.RECONCILIATION_FULL_SWEEP_HOURS * 3600
+        self.assertFalse(reconciliation.BackendReconciler(
+            self.backend, logging.getLogger(),
+            state=reconciler.state).is_incremental())
+
     def test_orphan_server(self, mrapi):
         cmrapi = self.reconciler.client
         mrapi().GetInstances.return_value =\
@@ -63,6 +63,24 @@ PROPERTY_PREFIX = 'property:'
 PLANKTON_META = ('container_format', 'disk_format', 'name',
                  'status', 'created_at', 'volume_id', 'description')
 
+# Image attributes by which the pithos backend can order the images, mapped
+# to the respective version property or metadata key
+SORT_KEYS = {
+    'id': 'uuid',
+    'size': 'size',
+    'created_at': 'mtime',
+    'updated_at': 'mtime',
+    'name': PLANKTON_PREFIX + 'name',
+    'disk_format': PLANKTON_PREFIX + 'disk_format',
+    'container_format': PLANKTON_PREFIX + 'container_format'}
+
+# Image attributes by which the pithos backend can filter the images, mapped
+# to the respective metadata key
+FILTER_KEYS = {
+    'name': PLANKTON_PREFIX + 'name',
+    'disk_format': PLANKTON_PREFIX + 'disk_format',
+    'container_format': PLANKTON_PREFIX + 'container_format'}
+
 SNAPSHOTS_CONTAINER = "snapshots"
 SNAPSHOTS_TYPE = "application/octet-stream"
 
@@ -397,35 +415,64 @@ class PlanktonBackend(object):
     def _list_images(self, user=None, filters=None, params=None,
                      check_permissions=True):
         filters = filters or {}
+        if params is None:
+            params = {}
+        sort_key = params.get('sort_key', 'created_at')
+        sort_dir = params.get('sort_dir', 'desc')
+        marker = params.get('marker')
+        limit = params.get('limit')
+
+        keys = ['%s=%s' % (FILTER_KEYS[key], val)
+                for key, val in sorted(filters.items()) if key in FILTER_KEYS]
+        size_max = filters.get('size_max')
+        size_range = (filters.get('size_min'),
+                      size_max + 1 if size_max is not None else None)
+        status = filters.get('status')
+
+        # The status of an image and the attributes that are not in SORT_KEYS
+        # are computed by image_to_dict, so in that case the images are
+        # filtered, sorted and paginated here instead of the backend.
+        local = status is not None or sort_key not in SORT_KEYS
+        kwargs = {}
+        if not local:
+            kwargs = {'sort_key': SORT_KEYS[sort_key], 'sort_dir': sort_dir,
+                      'limit': limit}
+            if marker is not None:
+                location = self._get_marker_location(marker,
+                                                     check_permissions)
+                kwargs['marker'] = '/'.join(location)
 
-        # TODO: Use filters
-        # # Fix keys
-        # keys = [PLANKTON_PREFIX + 'name']
-        # size_range = (None, None)
-        # for key, val in filters.items():
-        #     if key == 'size_min':
-        #         size_range = (val, size_range[1])
-        #     elif key == 'size_max':
-        #         size_range = (size_range[0], val)
-        #     else:
-        #         keys.append('%s = %s' % (PLANKTON_PREFIX + key, val))
         _images = self.backend.get_domain_objects(
             domain=PLANKTON_DOMAIN, user=user,
-            check_permissions=check_permissions)
+            check_permissions=check_permissions, keys=keys,
+            size_range=size_range, **kwargs)
 
         images = []
         for (location, metadata, permissions) in _images:
             location = Location(*location.split("/", 2))
             images.append(image_to_dict(location, metadata, permissions))
 
-        if params is None:
-            params = {}
-
-        key = itemgetter(params.get('sort_key', 'created_at'))
-        reverse = params.get('sort_dir', 'desc') == 'desc'
-        images.sort(key=key, reverse=reverse)
+        if local:
+            if status is not None:
+                images = [img for img in images
+                          if img["status"].lower() == status.lower()]
+            images.sort(key=itemgetter(sort_key), reverse=sort_dir == 'desc')
+            if marker is not None:
+                ids = [img["id"] for img in images]
+                if marker not in ids:
+                    raise faults.BadRequest("Invalid marker '%s'" % marker)
+                images = images[ids.index(marker) + 1:]
+            if limit:
+                images = images[:limit]
         return images
 
+    def _get_marker_location(self, marker, check_permissions=True):
+        try:
+            return self.get_pithos_object(
+                marker, check_permissions=check_permissions)[0]
+        except (NameError, NotAllowedError, faults.ItemNotFound):
+            raise faults.BadRequest("Invalid marker '%s'" % marker)
+
     @handle_pithos_backend
     def list_images(self, filters=None, params=None, check_permissions=True):
         return self._list_images(user=self.user, filters=filters,
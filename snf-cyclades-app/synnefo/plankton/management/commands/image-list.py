@@ -41,7 +41,7 @@ class Command(SynnefoCommand):
         check_perm = user is not None
 
         with PlanktonBackend(user) as backend:
-            images = backend.list_images(user, check_permissions=check_perm)
+            images = backend.list_images(check_permissions=check_perm)
             if options["public"]:
                 images = filter(lambda x: x['is_public'], images)
             images.sort(key=lambda x: x['created_at'], reverse=True)
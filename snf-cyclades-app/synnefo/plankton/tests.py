@@ -322,3 +322,55 @@ class PlanktonTest(BaseAPITest):
     def test_list_images_filters_error_1(self, backend):
         response = self.get(join_urls(IMAGES_URL, "?size_max="))
         self.assertBadRequest(response)
+
+    def test_list_images_filters_error_2(self, backend):
+        response = self.get(join_urls(IMAGES_URL, "?limit=foo"))
+        self.assertBadRequest(response)
+        response = self.get(join_urls(IMAGES_URL, "?limit=0"))
+        self.assertBadRequest(response)
+
+    @assert_backend_closed
+    def test_list_images_filters(self, backend):
+        backend().get_domain_objects.return_value = []
+        response = self.get(join_urls(
+            IMAGES_URL, "?name=Debian%20Base&disk_format=diskdump&size_min=10"
+                        "&size_max=20&sort_key=name&sort_dir=asc&limit=5"))
+        self.assertSuccess(response)
+        self.assertEqual(json.loads(response.content), [])
+        backend().get_domain_objects.assert_called_once_with(
+            domain="plankton", user="user", check_permissions=True,
+            keys=["plankton:disk_format=diskdump",
+                  "plankton:name=Debian Base"],
+            size_range=(10, 21), sort_key="plankton:name", sort_dir="asc",
+            limit=5)
+
+    def test_list_images_filter_status(self, backend):
+        def image(uuid, available, created):
+            meta = {"uuid": uuid,
+                    "bytes": 42,
+                    "mapfile": "unique_mapfile",
+                    "is_snapshot": False,
+                    "hash": "unique_mapfile",
+                    "version": 42,
+                    "version_timestamp": Decimal(created),
+                    "available": available,
+                    "plankton:name": uuid}
+            return ("img_owner/images/%s" % uuid, meta, {})
+
+        backend().get_domain_objects.return_value = [
+            image("img1", 1, "1392487853.863673"),
+            image("img2", 0, "1392487854.863673"),
+            image("img3", 1, "1392487855.863673"),
+            image("img4", 1, "1392487856.863673")]
+        response = self.get(join_urls(
+            IMAGES_URL, "?status=available&marker=img4&limit=1"))
+        self.assertSuccess(response)
+        self.assertEqual([img["id"] for img in json.loads(response.content)],
+                         ["img3"])
+        backend().get_domain_objects.assert_called_once_with(
+            domain="plankton", user="user", check_permissions=True,
+            keys=[], size_range=(None, None))
+
+        response = self.get(join_urls(IMAGES_URL, "?status=available&"
+                                                  "marker=img2"))
+        self.assertBadRequest(response)
@@ -34,7 +34,7 @@ from synnefo.plankton.backend import split_url
 FILTERS = ('name', 'container_format', 'disk_format', 'status', 'size_min',
            'size_max')
 
-PARAMS = ('sort_key', 'sort_dir')
+PARAMS = ('sort_key', 'sort_dir', 'marker', 'limit')
 
 SORT_KEY_OPTIONS = ('id', 'name', 'status', 'size', 'disk_format',
                     'container_format', 'created_at', 'updated_at')
@@ -317,6 +317,14 @@ def list_images(request, detail=False):
     if not params['sort_dir'] in SORT_DIR_OPTIONS:
         raise faults.BadRequest("Invalid 'sort_dir'")
 
+    if 'limit' in params:
+        try:
+            params['limit'] = int(params['limit'])
+        except ValueError:
+            raise faults.BadRequest("Malformed request.")
+        if params['limit'] <= 0:
+            raise faults.BadRequest("Invalid 'limit'")
+
     if 'size_max' in filters:
         try:
             filters['size_max'] = int(filters['size_max'])
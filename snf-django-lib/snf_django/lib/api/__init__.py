@@ -25,9 +25,9 @@ from django.utils import simplejson as json
 from django.template.loader import render_to_string
 from django.views.decorators import csrf
 
-from astakosclient import AstakosClient
 from astakosclient.errors import AstakosClientException
 from django.conf import settings
+from snf_django.lib import astakos
 from snf_django.lib.api import faults
 
 import itertools
@@ -101,11 +101,8 @@ def api_method(http_method=None, token_required=True, user_required=True,
                             logger.error("Cannot authenticate without having"
                                          " an Astakos Authentication URL")
                             raise
-                    astakos = AstakosClient(token, astakos_url,
-                                            use_pool=True,
-                                            retry=2,
-                                            logger=logger)
-                    user_info = astakos.authenticate()
+                    user_info = astakos.authenticate(token, astakos_url,
+                                                     logger=logger)
                     request.user_uniq = user_info["access"]["user"]["id"]
                     request.user = user_info
 
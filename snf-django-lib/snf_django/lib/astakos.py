@@ -14,19 +14,133 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import hashlib
+from calendar import timegm
+from time import time
+
+from dateutil.parser import parse as date_parse
+from django.conf import settings
+from django.core.cache import get_cache
 
 from astakosclient import AstakosClient
 from astakosclient.errors import (Unauthorized, NoUUID, NoUserName,
                                   AstakosClientException)
 
 
+class TokenCache(object):
+    """Cache of the results of token authentications.
+
+    The responses of Astakos for valid tokens are kept for `ttl` seconds,
+    but never past the expiration of the token. Tokens rejected by Astakos
+    are kept for `negative_ttl` seconds. Entries are stored in the Django
+    cache given by `backend`, which is process-local by default. Use a
+    shared one (e.g. memcached) to let all processes see the invalidations
+    of tokens that Astakos renews or revokes.
+    """
+
+    def __init__(self, ttl, negative_ttl=0, backend="locmem://",
+                 prefix="snf_token"):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.prefix = prefix
+        self.backend = get_cache(backend)
+
+    def _key(self, token):
+        if isinstance(token, unicode):
+            token = token.encode("utf-8")
+        return "%s_%s" % (self.prefix, hashlib.sha1(token).hexdigest())
+
+    def get(self, token):
+        """Return the cached response of Astakos for the token.
+
+        Raise Unauthorized if Astakos has rejected the token and return
+        None if there is no entry for it.
+        """
+        entry = self.backend.get(self._key(token))
+        if entry is None:
+            return None
+        valid, value = entry
+        if not valid:
+            raise Unauthorized(*value)
+        return value
+
+    def set(self, token, user_info):
+        try:
+            expires = user_info["access"]["token"]["expires"]
+            expires_at = timegm(date_parse(expires).utctimetuple())
+        except (KeyError, TypeError, ValueError):
+            return
+        timeout = min(self.ttl, int(expires_at - time()))
+        if timeout > 0:
+            self.backend.set(self._key(token), (True, user_info), timeout)
+
+    def set_invalid(self, token, error):
+        if self.negative_ttl > 0:
+            self.backend.set(self._key(token),
+                             (False, (error.message, error.details)),
+                             self.negative_ttl)
+
+    def invalidate(self, token):
+        self.backend.delete(self._key(token))
+
+
+_token_cache = None
+
+
+def get_token_cache():
+    """Return the token cache, or None if it is disabled."""
+    global _token_cache
+    if _token_cache is None:
+        ttl = getattr(settings, "ASTAKOS_TOKEN_CACHE_TTL", 0)
+        negative_ttl = getattr(settings, "ASTAKOS_TOKEN_CACHE_NEGATIVE_TTL",
+                               0)
+        if not ttl and not negative_ttl:
+            return None
+        backend = getattr(settings, "ASTAKOS_TOKEN_CACHE_BACKEND",
+                          "locmem://")
+        _token_cache = TokenCache(ttl, negative_ttl, backend)
+    return _token_cache
+
+
+def invalidate_token(token):
+    """Drop the token from the token cache.
+
+    Astakos calls this when it renews or revokes a token, so that the
+    services stop accepting it, provided that they use a shared cache.
+    """
+    cache = get_token_cache()
+    if cache is not None and token:
+        cache.invalidate(token)
+
+
+def authenticate(token, astakos_auth_url, logger=None):
+    """Authenticate the token with Astakos, using the token cache.
+
+    Return the response of Astakos, or raise an AstakosClientException.
+    """
+    cache = get_token_cache()
+    if cache is not None:
+        user_info = cache.get(token)
+        if user_info is not None:
+            return user_info
+    client = AstakosClient(token, astakos_auth_url,
+                           retry=2, use_pool=True, logger=logger)
+    try:
+        user_info = client.authenticate()
+    except Unauthorized as e:
+        if cache is not None:
+            cache.set_invalid(token, e)
+        raise
+    if cache is not None:
+        cache.set(token, user_info)
+    return user_info
+
+
 def user_for_token(token, astakos_auth_url, logger=None):
     if token is None:
         return None
-    client = AstakosClient(token, astakos_auth_url,
-                           retry=2, use_pool=True, logger=logger)
     try:
-        return client.authenticate()
+        return authenticate(token, astakos_auth_url, logger)
     except Unauthorized:
         return None
 
@@ -70,20 +184,18 @@ class UserCache(object):
 
     def fetch_names(self, uuid_list):
         total = len(uuid_list)
-        split = self.split
         count = 0
 
-        for start in range(0, total, split):
-            end = start + split
-            try:
-                names = \
-                    self.astakos.service_get_usernames(uuid_list[start:end])
-                count += len(names)
-
-                self.users.update(names)
-            except AstakosClientException:
-                pass
-            except Exception as err:
+        # The names of the chunks that were looked up are kept, even if
+        # the lookup of other chunks failed
+        errors = []
+        names = self.astakos.service_get_usernames(uuid_list,
+                                                   chunk_size=self.split,
+                                                   errors=errors)
+        count = len(names)
+        self.users.update(names)
+        for err in errors:
+            if not isinstance(err, AstakosClientException):
                 self.logger.error("Unexpected error while fetching "
                                   "user display names: %s" % repr(err))
 
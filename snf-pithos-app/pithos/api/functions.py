@@ -35,7 +35,7 @@ from pithos.api.util import (
     get_content_range, socket_read_iterator, SaveToBackendHandler,
     object_data_response, put_object_block, hashmap_md5, simple_list_response,
     api_method, is_uuid, retrieve_uuid, retrieve_uuids,
-    retrieve_displaynames, Checksum, NoChecksum
+    retrieve_displaynames, Checksum, NoChecksum, iter_blocks, BlockUploader
 )
 
 from pithos.api.settings import (UPDATE_MD5, TRANSLATE_UUIDS,
@@ -483,12 +483,14 @@ def container_update(request, v_account, v_container):
         request.backend.can_write_container(request.user_uniq, v_account,
                                             v_container)
 
+        uploader = BlockUploader(request.backend)
         for data in socket_read_iterator(request, content_length,
                                          request.backend.block_size):
             # TODO: Raise 408 (Request Timeout) if this takes too long.
             # TODO: Raise 499 (Client Disconnect) if a length is defined
             #       and we stop before getting this much data.
-            hashmap.append(request.backend.put_block(data))
+            uploader.put(data)
+        hashmap = uploader.finish()
 
     response = HttpResponse(status=202)
     if hashmap:
@@ -939,15 +941,16 @@ def object_write(request, v_account, v_container, v_object):
         etag = request.META.get('HTTP_ETAG')
         checksum_compute = Checksum() if etag or UPDATE_MD5 else NoChecksum()
         size = 0
-        hashmap = []
+        uploader = BlockUploader(request.backend)
         for data in socket_read_iterator(request, content_length,
                                          request.backend.block_size):
             # TODO: Raise 408 (Request Timeout) if this takes too long.
             # TODO: Raise 499 (Client Disconnect) if a length is defined
             #       and we stop before getting this much data.
             size += len(data)
-            hashmap.append(request.backend.put_block(data))
+            uploader.put(data)
             checksum_compute.update(data)
+        hashmap = uploader.finish()
 
         checksum = checksum_compute.hexdigest()
         if etag and parse_etags(etag)[0].lower() != checksum:
@@ -1229,9 +1232,13 @@ def object_update(request, v_account, v_container, v_object):
         else:
             data = ''
             sbi = 0
+            # Each iteration consumes one source block.
+            src_blocks = iter_blocks(
+                request.backend,
+                src_hashmap[:int(length / request.backend.block_size) + 2])
             while length > 0:
                 if sbi < len(src_hashmap):
-                    data += request.backend.get_block(src_hashmap[sbi])
+                    data += next(src_blocks)
                 if length < request.backend.block_size:
                     data = data[:length]
                 bytes = put_object_block(request, hashmap, data, offset,
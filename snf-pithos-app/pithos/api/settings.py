@@ -56,6 +56,11 @@ ASTAKOS_AUTH_URL = getattr(
 ASTAKOSCLIENT_POOLSIZE = \
     getattr(settings, 'PITHOS_ASTAKOSCLIENT_POOLSIZE', 200)
 
+# Look up user names and uuids in Astakos in concurrent requests
+# of this many entries.
+USER_CATALOG_CHUNK_SIZE = \
+    getattr(settings, 'PITHOS_USER_CATALOG_CHUNK_SIZE', 100)
+
 
 # --------------------------------------
 # Define a LazyAstakosUrl
@@ -193,6 +198,60 @@ BACKEND_MAP_CHECK_INTERVAL = getattr(settings,
 BACKEND_MAPFILE_PREFIX = getattr(settings,
                                  'PITHOS_BACKEND_MAPFILE_PREFIX', 'snf_file_')
 
+# The number of blocks to fetch ahead of the block currently being sent to
+# the client while serving object data (0 disables read-ahead)
+BACKEND_BLOCK_PREFETCH = getattr(settings, 'PITHOS_BACKEND_BLOCK_PREFETCH', 0)
+
+# The maximum number of blocks fetched concurrently for read-ahead by a
+# single worker process
+BACKEND_BLOCK_PREFETCH_POOL_SIZE = getattr(
+    settings, 'PITHOS_BACKEND_BLOCK_PREFETCH_POOL_SIZE', 8)
+
+# The maximum memory (in bytes) that a single download may hold in
+# prefetched blocks
+BACKEND_BLOCK_PREFETCH_MEMORY = getattr(
+    settings, 'PITHOS_BACKEND_BLOCK_PREFETCH_MEMORY', 64 * 1024 * 1024)
+
+# The maximum size (in bytes) of the cache of recently read blocks
+# (0 disables the cache)
+BACKEND_BLOCK_CACHE_SIZE = getattr(settings,
+                                   'PITHOS_BACKEND_BLOCK_CACHE_SIZE', 0)
+
+# The directory of a block cache shared by all worker processes of the host,
+# e.g. under /dev/shm, or None for a separate cache in each process
+BACKEND_BLOCK_CACHE_PATH = getattr(settings,
+                                   'PITHOS_BACKEND_BLOCK_CACHE_PATH', None)
+
+# The number of blocks of an upload that may be hashed and stored while the
+# following ones are being read from the client (0 disables it)
+BACKEND_BLOCK_UPLOAD_PARALLEL = getattr(
+    settings, 'PITHOS_BACKEND_BLOCK_UPLOAD_PARALLEL', 0)
+
+# The maximum number of blocks hashed and stored concurrently for uploads by
+# a single worker process
+BACKEND_BLOCK_UPLOAD_POOL_SIZE = getattr(
+    settings, 'PITHOS_BACKEND_BLOCK_UPLOAD_POOL_SIZE', 8)
+
+# The maximum memory (in bytes) that a single upload may hold in blocks not
+# stored yet
+BACKEND_BLOCK_UPLOAD_MEMORY = getattr(
+    settings, 'PITHOS_BACKEND_BLOCK_UPLOAD_MEMORY', 64 * 1024 * 1024)
+
+# Keep the container and account statistics updates of each request in
+# memory and apply them coalesced, right before committing the transaction
+BACKEND_DEFER_STATISTICS = getattr(settings,
+                                   'PITHOS_BACKEND_DEFER_STATISTICS', False)
+
+# The maximum size (in bytes) of the cache of recently read object hashmaps
+# (0 disables the cache)
+BACKEND_HASHMAP_CACHE_SIZE = getattr(settings,
+                                     'PITHOS_BACKEND_HASHMAP_CACHE_SIZE', 0)
+
+# The maximum number of leaves in the cache of the Merkle trees of recently
+# updated objects (0 disables the cache)
+BACKEND_HASHMAP_TREES_SIZE = getattr(settings,
+                                     'PITHOS_BACKEND_HASHMAP_TREES_SIZE', 0)
+
 # The maximum allowed metadata items per domain for a Pithos+ resource
 RESOURCE_MAX_METADATA = getattr(settings, 'PITHOS_RESOURCE_MAX_METADATA', 32)
 
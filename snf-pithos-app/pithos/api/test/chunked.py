@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# coding=utf8
+
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests and benchmark of the chunked transfer decoding of uploads.
+
+The benchmark compares the buffer based decoder of socket_read_iterator
+with the former string concatenating one. Run it with:
+
+  DJANGO_SETTINGS_MODULE=synnefo.settings python -m pithos.api.test.chunked
+"""
+
+import io
+import time
+import unittest
+
+from StringIO import StringIO
+
+from pithos.api.test.util import get_random_data
+from pithos.api.util import socket_read_iterator
+from snf_django.lib.api import faults
+
+
+def encode_chunked(data, chunk_size):
+    chunks = []
+    for i in xrange(0, len(data), chunk_size):
+        chunk = data[i:i + chunk_size]
+        chunks.append('%x\r\n%s\r\n' % (len(chunk), chunk))
+    chunks.append('0\r\n\r\n')
+    return ''.join(chunks)
+
+
+class FakeRequest(object):
+    def __init__(self, stream):
+        self.environ = {'wsgi.input': stream}
+        self.META = {'SERVER_SOFTWARE': 'test'}
+
+
+class ChunkedStream(object):
+    """Chunked encoded body of `size` bytes, produced on the fly.
+
+    Like a socket, every read returns a newly allocated string.
+    """
+
+    def __init__(self, size, chunk_size):
+        self.left = size
+        self.chunk_size = chunk_size
+        self.payload = 'x' * (chunk_size + 1)
+        self.chunk_left = 0
+
+    def readline(self):
+        self.chunk_left = min(self.chunk_size, self.left)
+        self.left -= self.chunk_left
+        return '%x\r\n' % self.chunk_left
+
+    def read(self, n):
+        if not self.chunk_left:
+            return '\r\n'[:n]
+        n = min(n, self.chunk_left)
+        self.chunk_left -= n
+        return self.payload[:n]
+
+
+class BufferedChunkedStream(ChunkedStream):
+    def readinto(self, b):
+        n = min(len(b), self.chunk_left)
+        b[:n] = buffer(self.payload, 0, n)
+        self.chunk_left -= n
+        return n
+
+
+def concat_read_iterator(sock, blocksize):
+    """The former string concatenating chunked decoder."""
+
+    data = ''
+    while True:
+        chunk_length = int(sock.readline().split(';')[0], 16)
+        if chunk_length == 0:
+            if len(data) > 0:
+                yield data
+            return
+        while chunk_length > 0:
+            chunk = sock.read(min(chunk_length, blocksize))
+            chunk_length -= len(chunk)
+            data += chunk
+            if len(data) >= blocksize:
+                ret = data[:blocksize]
+                data = data[blocksize:]
+                yield ret
+        sock.read(2)  # CRLF
+
+
+class ChunkedReadTest(unittest.TestCase):
+    def assertDechunked(self, stream_class, data, chunk_size, blocksize):
+        stream = stream_class(encode_chunked(data, chunk_size))
+        blocks = list(socket_read_iterator(FakeRequest(stream), -1,
+                                           blocksize))
+        self.assertEqual(''.join(blocks), data)
+        for block in blocks[:-1]:
+            self.assertEqual(len(block), blocksize)
+            self.assertTrue(isinstance(block, str))
+
+    def test_read_chunked(self):
+        data = get_random_data(length=10000)
+        for stream_class in (io.BytesIO, StringIO):
+            for chunk_size in (1, 100, 1024, 3000, 10000):
+                for blocksize in (1000, 1024, 4096, 20000):
+                    self.assertDechunked(stream_class, data, chunk_size,
+                                         blocksize)
+
+    def test_read_chunked_empty(self):
+        stream = io.BytesIO('0\r\n\r\n')
+        self.assertEqual(list(socket_read_iterator(FakeRequest(stream), -1,
+                                                   1024)), [])
+
+    def test_read_chunked_truncated(self):
+        stream = io.BytesIO(encode_chunked('a' * 1000, 500)[:600])
+        self.assertRaises(faults.BadRequest, list,
+                          socket_read_iterator(FakeRequest(stream), -1, 1024))
+
+
+def benchmark(size=1024 * 1024 * 1024,
+              chunk_sizes=(3000, 64 * 1024, 5 * 1024 * 1024),
+              blocksize=4 * 1024 * 1024):
+    def run(name, iterator):
+        start = time.time()
+        total = sum(len(block) for block in iterator)
+        assert total == size
+        elapsed = time.time() - start
+        print '  %-22s %8.3f s %9.1f MB/s' % (
+            name, elapsed, size / elapsed / 1024 / 1024)
+
+    for chunk_size in chunk_sizes:
+        print 'Decoding %d MB in chunks of %d bytes into blocks of %d KB' % (
+            size / 1024 / 1024, chunk_size, blocksize / 1024)
+        run('string concatenation', concat_read_iterator(
+            ChunkedStream(size, chunk_size), blocksize))
+        run('buffer, read', socket_read_iterator(
+            FakeRequest(ChunkedStream(size, chunk_size)), -1, blocksize))
+        run('buffer, readinto', socket_read_iterator(
+            FakeRequest(BufferedChunkedStream(size, chunk_size)), -1,
+            blocksize))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -618,6 +618,39 @@ class ContainerGet(PithosAPITest):
             objects.remove('')
         self.assertEquals(['photos/me.jpg'], objects)
 
+    def test_list_pseudo_hierarchical_folders_many_objects(self):
+        self.create_container('container')
+        url = join_urls(self.pithos_path, self.user, 'container')
+        onames = ['a/%02d' % i for i in range(40)]
+        onames += ['b%02d' % i for i in range(40)]
+        onames += ['c/d/%02d' % i for i in range(20)]
+        onames += ['c/%02d' % i for i in range(20)]
+        onames += ['e/']
+        for oname in onames:
+            self.upload_object('container', oname, length=1)
+
+        r = self.get('%s?delimiter=/' % url)
+        self.assertEqual(r.status_code, 200)
+        objects = r.content.split('\n')
+        if '' in objects:
+            objects.remove('')
+        expected = ['a/'] + ['b%02d' % i for i in range(40)] + ['c/', 'e/']
+        self.assertEquals(expected, objects)
+
+        r = self.get('%s?prefix=c/&delimiter=/&limit=25' % url)
+        objects = r.content.split('\n')
+        if '' in objects:
+            objects.remove('')
+        expected = ['c/%02d' % i for i in range(20)] + ['c/d/']
+        self.assertEquals(expected, objects)
+
+        r = self.get('%s?delimiter=/&limit=5' % url)
+        objects = r.content.split('\n')
+        if '' in objects:
+            objects.remove('')
+        self.assertEquals(['a/'] + ['b%02d' % i for i in range(5)],
+                          objects)
+
     def test_extended_list_json(self):
         url = join_urls(self.pithos_path, self.user, 'apples')
         params = {'format': 'json', 'limit': 2, 'prefix': 'photos/animals',
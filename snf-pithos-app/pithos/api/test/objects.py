@@ -22,6 +22,8 @@ from urllib import quote, unquote
 from functools import partial
 from unittest import skipIf
 
+from mock import patch
+
 from pithos.api.test import (PithosAPITest, pithos_settings,
                              AssertMappingInvariant, AssertUUidInvariant,
                              TEST_BLOCK_SIZE, TEST_HASH_ALGORITHM,
@@ -655,6 +657,23 @@ class ObjectGet(PithosAPITest):
             self.assertEqual(h, hash)
             i += 1
 
+    @patch('pithos.api.util.BACKEND_BLOCK_PREFETCH', 2)
+    def test_get_prefetch(self):
+        cname = self.containers[0]
+        l = 5 * pithos_settings.BACKEND_BLOCK_SIZE + 10
+        oname, odata = self.upload_object(cname, length=l)[:-1]
+        url = join_urls(self.pithos_path, self.user, cname, oname)
+
+        r = self.get(url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content, odata)
+
+        # read-ahead stops at the end of the requested range
+        bs = pithos_settings.BACKEND_BLOCK_SIZE
+        r = self.get(url, HTTP_RANGE='bytes=%d-%d' % (bs + 1, 3 * bs))
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r.content, odata[bs + 1:3 * bs + 1])
+
 
 class ObjectPut(PithosAPITest):
     def setUp(self):
@@ -741,6 +760,23 @@ class ObjectPut(PithosAPITest):
         self.assertEqual(r.status_code, 200)
         self.assertEqual(r.content, data)
 
+    @patch('pithos.api.util.BACKEND_BLOCK_UPLOAD_PARALLEL', 2)
+    def test_upload_parallel(self):
+        cname = self.container
+        l = 5 * pithos_settings.BACKEND_BLOCK_SIZE + 10
+        oname, odata, r = self.upload_object(cname, length=l)
+
+        if pithos_settings.UPDATE_MD5:
+            etag = md5_hash(odata)
+        else:
+            etag = merkle(odata)
+        self.assertEqual(r['ETag'], etag)
+
+        url = join_urls(self.pithos_path, self.user, cname, oname)
+        r = self.get(url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content, odata)
+
     def test_upload_unprocessable_entity(self):
         cname = self.container
         oname = get_random_name()
@@ -343,3 +343,50 @@ class TestPermissions(PithosAPITest):
 
         self._assert_read(subfolder, self.users)
         self._assert_write(subfolder, [])
+
+    def test_inheritance_follows_folder_type(self):
+        cname = self.container
+        folder = self.create_folder(cname, HTTP_X_OBJECT_SHARING='read=*')[0]
+        subfolder = self.create_folder(cname, '%s/%s' % (folder,
+                                                         get_random_name()))[0]
+        oname = self.upload_object(cname, '%s/%s' % (subfolder,
+                                                     get_random_name()))[0]
+        url = join_urls(self.pithos_path, self.user, cname, oname)
+        r = self.head(url, user='alice')
+        self.assertEqual(r.status_code, 200)
+
+        # the subfolder shares the object once it has its own permissions
+        surl = join_urls(self.pithos_path, self.user, cname, subfolder)
+        r = self.post(surl, content_type='', HTTP_CONTENT_RANGE='bytes */*',
+                      HTTP_X_OBJECT_SHARING='read=bob')
+        self.assertEqual(r.status_code, 202)
+        r = self.head(url, user='alice')
+        self.assertEqual(r.status_code, 403)
+        r = self.head(url, user='bob')
+        self.assertEqual(r.status_code, 200)
+
+        # a plain object does not share the objects under its path,
+        # so the permissions of the outer folder apply again
+        self.upload_object(cname, subfolder)
+        r = self.head(surl, user='bob')
+        self.assertEqual(r.status_code, 200)
+        r = self.head(surl, user='chuck')
+        self.assertEqual(r.status_code, 403)
+        r = self.head(url, user='chuck')
+        self.assertEqual(r.status_code, 200)
+
+    def test_inheritance_folder_type_parameters(self):
+        cname = self.container
+        folder = get_random_name()
+        url = join_urls(self.pithos_path, self.user, cname, folder)
+        r = self.put(url, data='',
+                     content_type='application/directory; charset=UTF-8',
+                     HTTP_X_OBJECT_SHARING='read=alice')
+        self.assertEqual(r.status_code, 201)
+        oname = self.upload_object(cname, '%s/%s' % (folder,
+                                                     get_random_name()))[0]
+        url = join_urls(self.pithos_path, self.user, cname, oname)
+        r = self.head(url, user='alice')
+        self.assertEqual(r.status_code, 200)
+        r = self.head(url, user='bob')
+        self.assertEqual(r.status_code, 403)
@@ -13,8 +13,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import deque
 from functools import wraps, partial
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
+from threading import Lock
 from urllib import quote, unquote, urlencode
 from urlparse import urlunsplit, urlsplit, parse_qsl
 
@@ -39,6 +42,7 @@ from snf_django.lib.api import faults, utils
 from pithos.api.settings import (BACKEND_DB_MODULE, BACKEND_DB_CONNECTION,
                                  BACKEND_BLOCK_MODULE,
                                  ASTAKOSCLIENT_POOLSIZE,
+                                 USER_CATALOG_CHUNK_SIZE,
                                  SERVICE_TOKEN,
                                  ASTAKOS_AUTH_URL,
                                  BACKEND_ACCOUNT_QUOTA,
@@ -50,6 +54,17 @@ from pithos.api.settings import (BACKEND_DB_MODULE, BACKEND_DB_CONNECTION,
                                  BACKEND_XSEG_POOL_SIZE,
                                  BACKEND_MAP_CHECK_INTERVAL,
                                  BACKEND_MAPFILE_PREFIX,
+                                 BACKEND_BLOCK_PREFETCH,
+                                 BACKEND_BLOCK_PREFETCH_POOL_SIZE,
+                                 BACKEND_BLOCK_PREFETCH_MEMORY,
+                                 BACKEND_BLOCK_CACHE_SIZE,
+                                 BACKEND_BLOCK_CACHE_PATH,
+                                 BACKEND_BLOCK_UPLOAD_PARALLEL,
+                                 BACKEND_BLOCK_UPLOAD_POOL_SIZE,
+                                 BACKEND_BLOCK_UPLOAD_MEMORY,
+                                 BACKEND_DEFER_STATISTICS,
+                                 BACKEND_HASHMAP_CACHE_SIZE,
+                                 BACKEND_HASHMAP_TREES_SIZE,
                                  RADOS_STORAGE, RADOS_POOL_BLOCKS,
                                  RADOS_POOL_MAPS, TRANSLATE_UUIDS,
                                  PUBLIC_URL_SECURITY, PUBLIC_URL_ALPHABET,
@@ -324,7 +339,8 @@ def retrieve_displaynames(token, uuids, return_dict=False, fail_silently=True):
     astakos = AstakosClient(token, ASTAKOS_AUTH_URL,
                             retry=2, use_pool=True,
                             logger=logger)
-    catalog = astakos.get_usernames(uuids) or {}
+    catalog = astakos.get_usernames(
+        uuids, chunk_size=USER_CATALOG_CHUNK_SIZE) or {}
     missing = list(set(uuids) - set(catalog))
     if missing and not fail_silently:
         raise ItemNotExists('Unknown displaynames: %s' %
@@ -350,7 +366,8 @@ def retrieve_uuids(token, displaynames, return_dict=False, fail_silently=True):
     astakos = AstakosClient(token, ASTAKOS_AUTH_URL,
                             retry=2, use_pool=True,
                             logger=logger)
-    catalog = astakos.get_uuids(displaynames) or {}
+    catalog = astakos.get_uuids(
+        displaynames, chunk_size=USER_CATALOG_CHUNK_SIZE) or {}
     missing = list(set(displaynames) - set(catalog))
     if missing and not fail_silently:
         raise ItemNotExists('Unknown uuids: %s' %
@@ -722,7 +739,12 @@ def socket_read_iterator(request, length=0, blocksize=4096):
             raise faults.BadRequest('Maximum size is reached')
 
         # Long version (do the dechunking).
-        data = ''
+        # Read the chunks directly into a block sized buffer, to avoid
+        # concatenating and slicing strings for every chunk.
+        buf = bytearray(blocksize)
+        view = memoryview(buf)
+        filled = 0
+        readinto = getattr(sock, 'readinto', None)
         while length < MAX_UPLOAD_SIZE:
             # Get chunk size.
             if hasattr(sock, 'readline'):
@@ -742,20 +764,27 @@ def socket_read_iterator(request, length=0, blocksize=4096):
                 raise faults.BadRequest('Bad chunk size')
             # Check if done.
             if chunk_length == 0:
-                if len(data) > 0:
-                    yield data
+                if filled > 0:
+                    yield view[:filled].tobytes()
                 return
             # Get the actual data.
             while chunk_length > 0:
-                chunk = sock.read(min(chunk_length, blocksize))
-                chunk_length -= len(chunk)
+                size = min(chunk_length, blocksize - filled)
+                if readinto is not None:
+                    n = readinto(view[filled:filled + size])
+                else:
+                    chunk = sock.read(size)
+                    n = len(chunk)
+                    buf[filled:filled + n] = chunk
+                if not n:
+                    raise faults.BadRequest()
+                chunk_length -= n
                 if length > 0:
-                    length += len(chunk)
-                data += chunk
-                if len(data) >= blocksize:
-                    ret = data[:blocksize]
-                    data = data[blocksize:]
-                    yield ret
+                    length += n
+                filled += n
+                if filled == blocksize:
+                    yield view.tobytes()
+                    filled = 0
             sock.read(2)  # CRLF
         raise faults.BadRequest('Maximum size is reached')
     else:
@@ -769,6 +798,57 @@ def socket_read_iterator(request, length=0, blocksize=4096):
             yield data
 
 
+_block_upload_pool = None
+_block_upload_pool_lock = Lock()
+
+
+def get_block_upload_pool():
+    """Return the worker pool shared by all block uploaders."""
+
+    global _block_upload_pool
+    with _block_upload_pool_lock:
+        if _block_upload_pool is None:
+            _block_upload_pool = ThreadPool(BACKEND_BLOCK_UPLOAD_POOL_SIZE)
+    return _block_upload_pool
+
+
+class BlockUploader(object):
+    """Store the blocks of an upload while the next ones are being read.
+
+    Each block is hashed and stored by the shared upload pool, so that the
+    backend work overlaps with reading the following blocks from the client.
+    At most `window` blocks are in flight; when the window is full, adding a
+    block waits for the oldest one. The hashmap keeps the order in which the
+    blocks were added.
+    """
+
+    def __init__(self, backend, window=None):
+        self.backend = backend
+        if window is None:
+            window = min(BACKEND_BLOCK_UPLOAD_PARALLEL,
+                         BACKEND_BLOCK_UPLOAD_MEMORY / backend.block_size)
+        self.window = window
+        self.hashmap = []
+        self.pending = deque()
+
+    def put(self, data):
+        if self.window <= 0:
+            self.hashmap.append(self.backend.put_block(data))
+            return
+
+        while len(self.pending) >= self.window:
+            self.hashmap.append(self.pending.popleft().get())
+        self.pending.append(get_block_upload_pool().apply_async(
+            self.backend.put_block, (data,)))
+
+    def finish(self):
+        """Wait for the pending blocks and return the hashmap."""
+
+        while self.pending:
+            self.hashmap.append(self.pending.popleft().get())
+        return self.hashmap
+
+
 class SaveToBackendHandler(FileUploadHandler):
     """Handle a file from an HTML form the django way."""
 
@@ -779,7 +859,7 @@ class SaveToBackendHandler(FileUploadHandler):
     def put_data(self, length):
         if len(self.data) >= length:
             block = self.data[:length]
-            self.file.hashmap.append(self.backend.put_block(block))
+            self.uploader.put(block)
             self.checksum_compute.update(block)
             self.data = self.data[length:]
 
@@ -787,10 +867,11 @@ class SaveToBackendHandler(FileUploadHandler):
                  content_length, charset=None):
         self.checksum_compute = NoChecksum() if not UPDATE_MD5 else Checksum()
         self.data = ''
+        self.uploader = BlockUploader(self.backend)
         self.file = UploadedFile(
             name=file_name, content_type=content_type, charset=charset)
         self.file.size = 0
-        self.file.hashmap = []
+        self.file.hashmap = self.uploader.hashmap
 
     def receive_data_chunk(self, raw_data, start):
         self.data += raw_data
@@ -802,10 +883,70 @@ class SaveToBackendHandler(FileUploadHandler):
         l = len(self.data)
         if l > 0:
             self.put_data(l)
+        self.uploader.finish()
         self.file.etag = self.checksum_compute.hexdigest()
         return self.file
 
 
+_block_prefetch_pool = None
+_block_prefetch_pool_lock = Lock()
+
+
+def get_block_prefetch_pool():
+    """Return the worker pool shared by all block prefetchers."""
+
+    global _block_prefetch_pool
+    with _block_prefetch_pool_lock:
+        if _block_prefetch_pool is None:
+            _block_prefetch_pool = ThreadPool(BACKEND_BLOCK_PREFETCH_POOL_SIZE)
+    return _block_prefetch_pool
+
+
+class BlockPrefetcher(object):
+    """Retrieve the blocks of a hashmap ahead of the reader.
+
+    Each time a block is requested, the blocks following it (at most `window`
+    of them) are submitted to the shared prefetch pool, so that the backend
+    round-trips overlap with sending the current block to the client.
+    """
+
+    def __init__(self, backend, hashmap, window):
+        self.backend = backend
+        self.hashmap = hashmap
+        self.window = window
+        self.pending = {}
+
+    def get(self, index, last=None):
+        """Return the data of block `index`.
+
+        Read-ahead never goes past block `last`, if given.
+        """
+
+        if last is None or last >= len(self.hashmap):
+            last = len(self.hashmap) - 1
+        last = min(last, index + self.window)
+
+        # Drop blocks the reader has skipped or will not need.
+        for i in self.pending.keys():
+            if i < index or i > last:
+                del self.pending[i]
+
+        # Request all the newly needed blocks in a single batch.
+        missing = [i for i in xrange(index + 1, last + 1)
+                   if i not in self.pending]
+        if missing:
+            result = get_block_prefetch_pool().apply_async(
+                self.backend.get_blocks,
+                ([self.hashmap[i] for i in missing],))
+            for pos, i in enumerate(missing):
+                self.pending[i] = (result, pos)
+
+        if index not in self.pending:
+            return self.backend.get_block(self.hashmap[index])
+        result, pos = self.pending.pop(index)
+        return result.get()[pos]
+
+
 class ObjectWrapper(object):
     """Return the object's data block-per-block in each iteration.
 
@@ -830,9 +971,28 @@ class ObjectWrapper(object):
         self.range_index = -1
         self.offset, self.length = self.ranges[0]
 
+        # Bound read-ahead by the memory allowed per download.
+        self.prefetch = min(BACKEND_BLOCK_PREFETCH,
+                            BACKEND_BLOCK_PREFETCH_MEMORY /
+                            self.backend.block_size)
+        self.prefetcher = None
+
     def __iter__(self):
         return self
 
+    def get_block(self):
+        if self.prefetch <= 0:
+            return self.backend.get_block(self.block_hash)
+
+        if (self.prefetcher is None or
+                self.prefetcher.hashmap is not
+                self.hashmaps[self.file_index]):
+            self.prefetcher = BlockPrefetcher(
+                self.backend, self.hashmaps[self.file_index], self.prefetch)
+        # Do not read ahead past the end of the current range.
+        last = int((self.offset + self.length - 1) / self.backend.block_size)
+        return self.prefetcher.get(self.block_index, last)
+
     def part_iterator(self):
         if self.length > 0:
             # Get the file for the current offset.
@@ -849,7 +1009,7 @@ class ObjectWrapper(object):
                 self.block_hash = self.hashmaps[
                     self.file_index][self.block_index]
                 try:
-                    self.block = self.backend.get_block(self.block_hash)
+                    self.block = self.get_block()
                 except ItemNotExists:
                     raise faults.ItemNotFound('Block does not exist')
 
@@ -973,6 +1133,19 @@ def put_object_block(request, hashmap, data, offset, is_snapshot):
     return bl  # Return ammount of data written.
 
 
+def iter_blocks(backend, hashmap):
+    """Yield the data of the blocks in the hashmap.
+
+    The blocks are retrieved in batches, as large as the read-ahead memory
+    limit allows.
+    """
+
+    batch = max(1, BACKEND_BLOCK_PREFETCH_MEMORY / backend.block_size)
+    for i in xrange(0, len(hashmap), batch):
+        for data in backend.get_blocks(hashmap[i:i + batch]):
+            yield data
+
+
 def hashmap_md5(backend, hashmap, size):
     """Produce the MD5 sum from the data in the hashmap."""
 
@@ -980,8 +1153,8 @@ def hashmap_md5(backend, hashmap, size):
     #       with the same hashmap and size...
     md5 = hashlib.md5()
     bs = backend.block_size
-    for bi, hash in enumerate(hashmap):
-        data = backend.get_block(hash)  # Blocks come in padded.
+    for bi, data in enumerate(iter_blocks(backend, hashmap)):
+        # Blocks come in padded.
         if bi == len(hashmap) - 1:
             data = data[:size % bs]
         md5.update(data)
@@ -1005,6 +1178,8 @@ if RADOS_STORAGE:
 else:
     BLOCK_PARAMS = {'mappool': None,
                     'blockpool': None, }
+BLOCK_PARAMS.update({'block_cache_size': BACKEND_BLOCK_CACHE_SIZE,
+                     'block_cache_path': BACKEND_BLOCK_CACHE_PATH})
 
 BACKEND_KWARGS = dict(
     db_module=BACKEND_DB_MODULE,
@@ -1028,7 +1203,10 @@ BACKEND_KWARGS = dict(
     mapfile_prefix=BACKEND_MAPFILE_PREFIX,
     resource_max_metadata=RESOURCE_MAX_METADATA,
     acc_max_groups=ACC_MAX_GROUPS,
-    acc_max_group_members=ACC_MAX_GROUP_MEMBERS)
+    acc_max_group_members=ACC_MAX_GROUP_MEMBERS,
+    defer_statistics=BACKEND_DEFER_STATISTICS,
+    hashmap_cache_size=BACKEND_HASHMAP_CACHE_SIZE,
+    hashmap_trees_size=BACKEND_HASHMAP_TREES_SIZE)
 
 _pithos_backend_pool = PithosBackendPool(size=BACKEND_POOL_SIZE,
                                          **BACKEND_KWARGS)
@@ -17,7 +17,7 @@ import re
 
 
 _regexfilter = re.compile(
-    '(!?)\s*(\S+?)\s*(?:(=|!=|<=|>=|<|>)\s*(\S*?)\s*)?$', re.UNICODE)
+    '(!?)\s*(\S+?)\s*(?:(=|!=|<=|>=|<|>)\s*(.*?)\s*)?$', re.UNICODE)
 
 
 def parse_filters(terms):
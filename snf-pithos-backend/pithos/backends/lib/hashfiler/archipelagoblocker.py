@@ -40,6 +40,7 @@ class ArchipelagoBlocker(object):
     blocksize = None
     blockpool = None
     hashtype = None
+    batch_size = 64
 
     def __init__(self, **params):
         cfg = ConfigParser.ConfigParser()
@@ -69,19 +70,30 @@ class ArchipelagoBlocker(object):
         name = hexlify(blkhash)
         return ArchipelagoObject(name, self.ioctx_pool, self.dst_port, create)
 
-    def _check_rear_block(self, blkhash):
-        filename = hexlify(blkhash)
+    def _check_rear_blocks(self, blkhashes):
+        """Return the set of the given hashes found in block storage.
+
+        The info requests for up to `batch_size` hashes are submitted at
+        once, before waiting on any of them.
+        """
+        existing = set()
         ioctx = self.ioctx_pool.pool_get()
-        req = Request.get_info_request(ioctx, self.dst_port, filename)
-        req.submit()
-        req.wait()
-        ret = req.success()
-        req.put()
-        self.ioctx_pool.pool_put(ioctx)
-        if ret:
-            return True
-        else:
-            return False
+        try:
+            for i in xrange(0, len(blkhashes), self.batch_size):
+                batch = blkhashes[i:i + self.batch_size]
+                reqs = [Request.get_info_request(ioctx, self.dst_port,
+                                                 hexlify(h))
+                        for h in batch]
+                try:
+                    self._run_requests(reqs)
+                    existing.update(h for h, req in zip(batch, reqs)
+                                    if req.success())
+                finally:
+                    for req in reqs:
+                        req.put()
+        finally:
+            self.ioctx_pool.pool_put(ioctx)
+        return existing
 
     def block_hash(self, data):
         """Hash a block of data"""
@@ -93,11 +105,14 @@ class ArchipelagoBlocker(object):
         """Check hashes for existence and
            return those missing from block storage.
         """
+        existing = self._check_rear_blocks(list(set(hashes)))
         notfound = []
         append = notfound.append
+        seen = set()
 
         for h in hashes:
-            if h not in notfound and not self._check_rear_block(h):
+            if h not in existing and h not in seen:
+                seen.add(h)
                 append(h)
 
         return notfound
@@ -124,44 +139,57 @@ class ArchipelagoBlocker(object):
 
         return blocks
 
-    def block_retr_archipelago(self, hashes):
-        """Retrieve blocks from storage by their hashes"""
-        blocks = []
-        append = blocks.append
-
-        ioctx = self.ioctx_pool.pool_get()
-        archip_emptyhash = hexlify(self.emptyhash)
-
-        for h in hashes:
-            if h == archip_emptyhash:
-                append(self._pad(''))
-                continue
-            req = Request.get_info_request(ioctx, self.dst_port, h)
+    def _run_requests(self, reqs):
+        """Submit all the given requests before waiting on any of them."""
+        for req in reqs:
             req.submit()
+        for req in reqs:
             req.wait()
-            ret = req.success()
-            if ret:
-                info = req.get_data(_type=xseg_reply_info)
-                size = info.contents.size
+
+    def _retr_archipelago(self, ioctx, targets):
+        """Retrieve a batch of distinct blocks and return them in a dict."""
+        dst_port = self.dst_port
+        reqs = [Request.get_info_request(ioctx, dst_port, h) for h in targets]
+        try:
+            self._run_requests(reqs)
+            if not all(req.success() for req in reqs):
+                raise Exception("Bad block file.")
+            sizes = [req.get_data(_type=xseg_reply_info).contents.size
+                     for req in reqs]
+        finally:
+            for req in reqs:
                 req.put()
-                req_data = Request.get_read_request(ioctx, self.dst_port, h,
-                                                    size=size)
-                req_data.submit()
-                req_data.wait()
-                ret_data = req_data.success()
-                if ret_data:
-                    append(self._pad(string_at(req_data.get_data(), size)))
-                    req_data.put()
-                else:
-                    req_data.put()
-                    self.ioctx_pool.pool_put(ioctx)
-                    raise Exception("Cannot retrieve Archipelago data.")
-            else:
+
+        reqs = [Request.get_read_request(ioctx, dst_port, h, size=size)
+                for h, size in zip(targets, sizes)]
+        try:
+            self._run_requests(reqs)
+            if not all(req.success() for req in reqs):
+                raise Exception("Cannot retrieve Archipelago data.")
+            return dict((h, self._pad(string_at(req.get_data(), size)))
+                        for h, size, req in zip(targets, sizes, reqs))
+        finally:
+            for req in reqs:
                 req.put()
-                self.ioctx_pool.pool_put(ioctx)
-                raise Exception("Bad block file.")
-        self.ioctx_pool.pool_put(ioctx)
-        return blocks
+
+    def block_retr_archipelago(self, hashes):
+        """Retrieve blocks from storage by their hashes.
+
+        The requests for up to `batch_size` blocks are submitted at once,
+        so that the blocks of a batch are retrieved concurrently.
+        """
+        archip_emptyhash = hexlify(self.emptyhash)
+        targets = list(set(hashes) - set([archip_emptyhash]))
+        blocks = {archip_emptyhash: self._pad('')}
+
+        ioctx = self.ioctx_pool.pool_get()
+        try:
+            for i in xrange(0, len(targets), self.batch_size):
+                blocks.update(self._retr_archipelago(
+                    ioctx, targets[i:i + self.batch_size]))
+        finally:
+            self.ioctx_pool.pool_put(ioctx)
+        return [blocks[h] for h in hashes]
 
     def block_stor(self, blocklist):
         """Store a bunch of blocks and return (hashes, missing).
@@ -171,8 +199,8 @@ class ArchipelagoBlocker(object):
         """
         block_hash = self.block_hash
         hashlist = [block_hash(b) for b in blocklist]
-        missing = [i for i, h in enumerate(hashlist) if not
-                   self._check_rear_block(h)]
+        existing = self._check_rear_blocks(list(set(hashlist)))
+        missing = [i for i, h in enumerate(hashlist) if h not in existing]
         for i in missing:
             with self._get_rear_block(hashlist[i], 1) as rbl:
                 rbl.sync_write(blocklist[i])  # XXX: verify?
@@ -0,0 +1,177 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import errno
+import logging
+
+from collections import OrderedDict
+from tempfile import mkstemp
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class BlockCache(object):
+    """Process-local cache of blocks, keyed by block hash.
+
+    Blocks never change once stored under their hash, so entries are never
+    invalidated. The least recently used ones are evicted when the cached
+    data grow past `size` bytes.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        """Return the cached block or None."""
+        with self._lock:
+            block = self._blocks.pop(key, None)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks[key] = block
+            self.hits += 1
+            return block
+
+    def put(self, key, block):
+        if len(block) > self.size:
+            return
+        with self._lock:
+            old = self._blocks.pop(key, None)
+            if old is not None:
+                self.used -= len(old)
+            self._blocks[key] = block
+            self.used += len(block)
+            while self.used > self.size:
+                _, evicted = self._blocks.popitem(last=False)
+                self.used -= len(evicted)
+
+
+class SharedBlockCache(object):
+    """Cache of blocks kept in files under `path`, keyed by block hash.
+
+    The cache is shared by all processes on the host that use the same
+    path, which should reside on a memory backed filesystem (e.g. /dev/shm).
+    Entries are written atomically and touched on every hit, so that
+    evicting the files with the oldest modification time approximates LRU
+    across processes. Eviction runs every time about `size / 16` bytes have
+    been added by this process.
+    """
+
+    def __init__(self, size, path):
+        self.size = size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._added = 0
+        self._sweep_threshold = max(size / 16, 1)
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _entry(self, key):
+        return os.path.join(self.path, key)
+
+    def get(self, key):
+        """Return the cached block or None."""
+        entry = self._entry(key)
+        try:
+            with open(entry, 'rb') as f:
+                block = f.read()
+            os.utime(entry, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return block
+
+    def put(self, key, block):
+        if len(block) > self.size:
+            return
+        try:
+            fd, tmp = mkstemp(dir=self.path, prefix='.')
+        except OSError:
+            logger.exception("Cannot create block cache entry")
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(block)
+            os.rename(tmp, self._entry(key))
+        except (IOError, OSError):
+            logger.exception("Cannot store block cache entry")
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+
+        self._added += len(block)
+        if self._added >= self._sweep_threshold:
+            self._added = 0
+            self.sweep()
+
+    def sweep(self):
+        """Evict the least recently used entries beyond the size limit."""
+        entries = []
+        used = 0
+        for name in os.listdir(self.path):
+            if name.startswith('.'):
+                continue  # entry being written
+            try:
+                st = os.stat(self._entry(name))
+            except OSError:
+                continue  # evicted by another process
+            entries.append((st.st_mtime, st.st_size, name))
+            used += st.st_size
+
+        entries.sort()
+        for mtime, size, name in entries:
+            if used <= self.size:
+                break
+            try:
+                os.unlink(self._entry(name))
+            except OSError:
+                pass
+            used -= size
+
+
+_caches = {}
+_caches_lock = Lock()
+
+
+def get_block_cache(size, path=None):
+    """Return the block cache for the given parameters.
+
+    All the stores of a process that use the same parameters share a single
+    cache instance. If a path is given, the cache is also shared with other
+    processes.
+    """
+    with _caches_lock:
+        cache = _caches.get((size, path))
+        if cache is None:
+            if path:
+                cache = SharedBlockCache(size, path)
+            else:
+                cache = BlockCache(size)
+            _caches[(size, path)] = cache
+        return cache
@@ -43,7 +43,9 @@ class Blocker(object):
         return self.archip_blocker.block_retr(hashes)
 
     def block_retr_archipelago(self, hashes):
-        """Retrieve blocks from storage by theri hashes."""
+        """Retrieve blocks from storage by their hashes.
+           All the blocks are requested before waiting on any of them.
+        """
         return self.archip_blocker.block_retr_archipelago(hashes)
 
     def block_stor(self, blocklist):
@@ -16,6 +16,7 @@
 import os
 
 from blocker import Blocker
+from blockcache import get_block_cache
 from mapper import Mapper
 
 
@@ -23,6 +24,7 @@ class Store(object):
     """Store.
        Required constructor parameters: path, block_size, hash_algorithm,
        blockpool, mappool.
+       Optional block_cache_size, block_cache_path.
     """
 
     def __init__(self, **params):
@@ -35,6 +37,12 @@ class Store(object):
               'archipelago_cfile': params['archipelago_cfile'],
               }
         self.mapper = Mapper(**pm)
+        cache_size = params.get('block_cache_size')
+        if cache_size:
+            self.block_cache = get_block_cache(cache_size,
+                                               params.get('block_cache_path'))
+        else:
+            self.block_cache = None
 
     def map_get(self, name, size):
         return self.mapper.map_retr(name, size)
@@ -52,11 +60,25 @@ class Store(object):
         return blocks[0]
 
     def block_get_archipelago(self, hash):
-        blocks = self.blocker.block_retr_archipelago((hash,))
+        blocks = self.block_get_archipelago_bulk((hash,))
         if not blocks:
             return None
         return blocks[0]
 
+    def block_get_archipelago_bulk(self, hashes):
+        cache = self.block_cache
+        if cache is None:
+            return self.blocker.block_retr_archipelago(hashes)
+
+        blocks = dict((h, cache.get(h)) for h in set(hashes))
+        missing = [h for h, block in blocks.iteritems() if block is None]
+        if missing:
+            retrieved = self.blocker.block_retr_archipelago(missing)
+            for h, block in zip(missing, retrieved):
+                cache.put(h, block)
+                blocks[h] = block
+        return [blocks[h] for h in hashes]
+
     def block_put(self, data):
         hashes, absent = self.blocker.block_stor((data,))
         return hashes[0]
@@ -0,0 +1,31 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+def access_inherit_candidates(path):
+    """Return the paths whose permissions may be inherited by path, i.e.
+       the path itself and each of its parents, with and without a
+       trailing slash, excluding the account.
+    """
+
+    # Only keep path components.
+    parts = path.rstrip('/').split('/')
+    valid = []
+    for i in range(1, len(parts)):
+        subp = '/'.join(parts[:i + 1])
+        valid.append(subp)
+        if subp != path:
+            valid.append(subp + '/')
+    return valid
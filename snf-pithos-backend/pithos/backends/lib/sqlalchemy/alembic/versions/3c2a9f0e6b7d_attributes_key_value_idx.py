@@ -0,0 +1,24 @@
+"""Index plankton attributes by key and value
+
+Revision ID: 3c2a9f0e6b7d
+Revises: 5adc52055209
+Create Date: 2014-10-20 12:14:31.520317
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c2a9f0e6b7d'
+down_revision = '5adc52055209'
+
+from alembic import op
+from sqlalchemy.sql import text
+
+
+def upgrade():
+    op.create_index('idx_attributes_key_value_plankton', 'attributes',
+                    ['key', 'value'],
+                    postgresql_where=text("attributes.domain = 'plankton'"))
+
+
+def downgrade():
+    op.drop_index('idx_attributes_key_value_plankton', tablename='attributes')
@@ -14,15 +14,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from time import time
-from operator import itemgetter
-from itertools import groupby
 from collections import defaultdict
 
 from sqlalchemy import (Table, Integer, BigInteger, DECIMAL, Boolean,
                         Column, String, MetaData, ForeignKey)
 from sqlalchemy.schema import Index, Sequence
 from sqlalchemy.sql import (func, and_, or_, not_, select, bindparam, exists,
-                            functions)
+                            functions, case)
 from sqlalchemy.sql.expression import true, literal, type_coerce
 from sqlalchemy.exc import NoSuchTableError, IntegrityError
 
@@ -187,6 +185,9 @@ def create_tables(engine):
     Index('idx_attributes_key_domain_plankton', attributes.c.key,
           attributes.c.domain,
           postgresql_where=attributes.c.domain == "plankton")
+    Index('idx_attributes_key_value_plankton', attributes.c.key,
+          attributes.c.value,
+          postgresql_where=attributes.c.domain == "plankton")
     Index('idx_attributes_key_domain_pithos', attributes.c.key,
           attributes.c.domain,
           postgresql_where=attributes.c.domain == "pithos")
@@ -215,6 +216,7 @@ class Node(DBWorker):
     def __init__(self, **params):
         self._props = params.pop('props')
         self.mapfile_prefix = params.pop('mapfile_prefix', 'snf_file_')
+        self._statistics_pending = None
         DBWorker.__init__(self, **params)
         try:
             metadata = MetaData(self.engine)
@@ -423,6 +425,7 @@ class Node(DBWorker):
         if nodes:
             s = self.nodes.delete().where(self.nodes.c.node.in_(nodes))
             self.conn.execute(s).close()
+            self._statistics_forget(nodes)
 
         return hashes, size, serials
 
@@ -480,6 +483,7 @@ class Node(DBWorker):
         if nodes:
             s = self.nodes.delete().where(self.nodes.c.node.in_(nodes))
             self.conn.execute(s).close()
+            self._statistics_forget(nodes)
 
         return hashes, size, serials
 
@@ -506,6 +510,7 @@ class Node(DBWorker):
 
         s = self.nodes.delete().where(self.nodes.c.node == node)
         self.conn.execute(s).close()
+        self._statistics_forget([node])
         return True
 
     def node_accounts(self, accounts=()):
@@ -626,6 +631,9 @@ class Node(DBWorker):
            for all versions under node that belong to the cluster.
         """
 
+        if self._statistics_pending:
+            self._statistics_apply_pending()
+
         s = select([self.statistics.c.population,
                     self.statistics.c.size,
                     self.statistics.c.mtime])
@@ -642,33 +650,8 @@ class Node(DBWorker):
            size of objects and mtime in the node's namespace.
            May be zero or positive or negative numbers.
         """
-        s = select([self.statistics.c.population, self.statistics.c.size],
-                   and_(self.statistics.c.node == node,
-                        self.statistics.c.cluster == cluster))
-        rp = self.conn.execute(s)
-        r = rp.fetchone()
-        rp.close()
-        if not r:
-            prepopulation, presize = (0, 0)
-        else:
-            prepopulation, presize = r
-        population += prepopulation
-        population = max(population, 0)
-        size += presize
 
-        # insert or replace
-        # TODO better upsert
-        u = self.statistics.update().where(and_(
-            self.statistics.c.node == node,
-            self.statistics.c.cluster == cluster))
-        u = u.values(population=population, size=size, mtime=mtime)
-        rp = self.conn.execute(u)
-        rp.close()
-        if rp.rowcount == 0:
-            ins = self.statistics.insert()
-            ins = ins.values(node=node, population=population, size=size,
-                             mtime=mtime, cluster=cluster)
-            self.conn.execute(ins).close()
+        self._statistics_add([node], population, size, mtime, cluster)
 
     def statistics_update_ancestors(self, node, population, size, mtime,
                                     cluster=0, recursion_depth=None):
@@ -678,20 +661,151 @@ class Node(DBWorker):
            Population is not recursive.
         """
 
-        i = 0
-        while True:
-            if node == ROOTNODE:
-                break
-            if recursion_depth is not None and recursion_depth <= i:
-                break
-            props = self.node_get_properties(node)
-            if props is None:
+        parents = self._statistics_ancestors(node, recursion_depth)
+        if not parents:
+            return
+        self._statistics_add(parents[:1], population, size, mtime, cluster)
+        if len(parents) > 1:
+            self._statistics_add(parents[1:], 0, size, mtime, cluster)
+
+    def statistics_defer(self):
+        """Keep the statistics updates in memory until statistics_flush().
+           Updates to the same node are coalesced into a single one,
+           so population is kept from dropping below zero only once.
+           The statistics read by statistics_get() are always up to date.
+        """
+
+        self._statistics_pending = {}
+
+    def statistics_flush(self):
+        """Apply the deferred statistics updates and stop deferring."""
+
+        self._statistics_apply_pending()
+        self._statistics_pending = None
+
+    def statistics_discard(self):
+        """Drop the deferred statistics updates and stop deferring."""
+
+        self._statistics_pending = None
+
+    def _statistics_ancestors(self, node, recursion_depth=None, levels=4):
+        """Return the parent of node and its ancestors, up to the root
+           or up to ``recursion_depth`` levels (if not None).
+           Up to ``levels`` ancestors are looked up with each query.
+        """
+
+        ancestors = []
+        while node != ROOTNODE:
+            if recursion_depth is not None:
+                levels = min(levels, recursion_depth - len(ancestors))
+                if levels <= 0:
+                    break
+            n0 = prev = self.nodes.alias('n0')
+            columns = [prev.c.parent]
+            from_obj = prev
+            for i in xrange(1, levels):
+                n = self.nodes.alias('n%d' % i)
+                from_obj = from_obj.outerjoin(
+                    n, and_(n.c.node == prev.c.parent,
+                            prev.c.parent != ROOTNODE))
+                columns.append(n.c.parent)
+                prev = n
+            s = select(columns, n0.c.node == node, from_obj=[from_obj])
+            rp = self.conn.execute(s)
+            r = rp.fetchone()
+            rp.close()
+            if r is None:
                 break
-            parent, path = props
-            self.statistics_update(parent, population, size, mtime, cluster)
-            node = parent
-            population = 0  # Population isn't recursive
-            i += 1
+            for parent in r:
+                if parent is None:
+                    return ancestors
+                ancestors.append(parent)
+                if parent == ROOTNODE:
+                    return ancestors
+            node = ancestors[-1]
+        return ancestors
+
+    def _statistics_add(self, nodes, population, size, mtime, cluster):
+        pending = self._statistics_pending
+        if pending is None:
+            self._statistics_apply(nodes, population, size, mtime, cluster)
+            return
+
+        for node in nodes:
+            key = (node, cluster)
+            if key in pending:
+                prepopulation, presize, _ = pending[key]
+                pending[key] = (prepopulation + population, presize + size,
+                                mtime)
+            else:
+                pending[key] = (population, size, mtime)
+
+    def _statistics_forget(self, nodes):
+        """Drop the deferred statistics updates of removed nodes,
+           whose statistics are removed along with them.
+        """
+
+        pending = self._statistics_pending
+        if not pending:
+            return
+
+        nodes = set(nodes)
+        for key in pending.keys():
+            if key[0] in nodes:
+                del pending[key]
+
+    def _statistics_apply_pending(self):
+        pending = self._statistics_pending
+        if not pending:
+            return
+
+        # Nodes are updated in descending order, i.e. from the children to
+        # the root since nodes are created after their parents, as they are
+        # when not deferring. Concurrent transactions thus lock statistics
+        # in the same order. Consecutive nodes with the same deltas are
+        # updated with a single statement.
+        updates = []
+        for (node, cluster), deltas in sorted(pending.iteritems(),
+                                              reverse=True):
+            key = (cluster,) + deltas
+            if updates and updates[-1][0] == key:
+                updates[-1][1].append(node)
+            else:
+                updates.append((key, [node]))
+        pending.clear()
+        for (cluster, population, size, mtime), nodes in updates:
+            self._statistics_apply(nodes, population, size, mtime, cluster)
+
+    def _statistics_apply(self, nodes, population, size, mtime, cluster):
+        """Add population and size to the statistics of all the given nodes
+           and set their mtime, with a single statement if the statistics
+           exist. Population never drops below zero.
+        """
+
+        c = self.statistics.c
+        values = {'size': c.size + size, 'mtime': mtime}
+        if population:
+            values['population'] = case(
+                [(c.population + population < 0, 0)],
+                else_=c.population + population)
+        u = self.statistics.update().where(and_(c.node.in_(nodes),
+                                                c.cluster == cluster))
+        rp = self.conn.execute(u.values(**values))
+        rp.close()
+        if rp.rowcount == len(nodes):
+            return
+
+        existing = set()
+        if rp.rowcount:
+            s = select([c.node], and_(c.node.in_(nodes),
+                                      c.cluster == cluster))
+            rp = self.conn.execute(s)
+            existing.update(row[0] for row in rp.fetchall())
+            rp.close()
+        ins = [{'node': node, 'population': max(population, 0),
+                'size': size, 'mtime': mtime, 'cluster': cluster}
+               for node in nodes if node not in existing]
+        self.conn.execute(self.statistics.insert(), ins).close()
 
     def statistics_latest(self, node, before=inf, except_cluster=0):
         """Return population, total size and last mtime
@@ -1167,6 +1281,55 @@ class Node(DBWorker):
         rp.close()
         return [r[0] for r in rows]
 
+    def _construct_size(self, versions, sizeq):
+        """Return the conditions restricting the size of versions
+           to the range set by sizeq.
+        """
+
+        conds = []
+        if sizeq and len(sizeq) == 2:
+            if sizeq[0]:
+                conds.append(versions.c.size >= sizeq[0])
+            if sizeq[1]:
+                conds.append(versions.c.size < sizeq[1])
+        return conds
+
+    def _construct_filters(self, versions, domain, filterq):
+        """Return the conditions the attributes of versions
+           in the domain must meet according to filterq.
+        """
+
+        conds = []
+        if not domain or not filterq:
+            return conds
+        included, excluded, opers = parse_filters(filterq)
+        if included:
+            subs = select([1])
+            subs = subs.where(self.attributes.c.serial ==
+                              versions.c.serial).correlate(versions)
+            subs = subs.where(self.attributes.c.domain == domain)
+            subs = subs.where(or_(*[self.attributes.c.key.op('=')(x)
+                              for x in included]))
+            conds.append(exists(subs))
+        if excluded:
+            subs = select([1])
+            subs = subs.where(self.attributes.c.serial ==
+                              versions.c.serial).correlate(versions)
+            subs = subs.where(self.attributes.c.domain == domain)
+            subs = subs.where(or_(*[self.attributes.c.key.op('=')(x)
+                              for x in excluded]))
+            conds.append(not_(exists(subs)))
+        for k, o, val in opers:
+            subs = select([1])
+            subs = subs.where(self.attributes.c.serial ==
+                              versions.c.serial).correlate(versions)
+            subs = subs.where(self.attributes.c.domain == domain)
+            subs = subs.where(
+                and_(self.attributes.c.key.op('=')(k),
+                     self.attributes.c.value.op(o)(val)))
+            conds.append(exists(subs))
+        return conds
+
     def latest_version_list(self, parent, prefix='', delimiter=None,
                             start='', limit=10000, before=inf,
                             except_cluster=0, pathq=[], domain=None,
@@ -1287,43 +1450,10 @@ class Node(DBWorker):
         if conja or conjb:
             s = s.where(or_(d4.c.path.in_(conjb), *conja))
 
-        if sizeq and len(sizeq) == 2:
-            if sizeq[0]:
-                s = s.where(self.versions.c.size >= sizeq[0])
-            if sizeq[1]:
-                s = s.where(self.versions.c.size < sizeq[1])
-
-        if domain and filterq:
-            included, excluded, opers = parse_filters(filterq)
-            if included:
-                subs = select([1])
-                subs = subs.where(self.attributes.c.serial ==
-                                  self.versions.c.serial
-                                  ).correlate(self.versions)
-                subs = subs.where(self.attributes.c.domain == domain)
-                subs = subs.where(or_(*[self.attributes.c.key.op('=')(x)
-                                  for x in included]))
-                s = s.where(exists(subs))
-            if excluded:
-                subs = select([1])
-                subs = subs.where(self.attributes.c.serial ==
-                                  self.versions.c.serial
-                                  ).correlate(self.versions)
-                subs = subs.where(self.attributes.c.domain == domain)
-                subs = subs.where(or_(*[self.attributes.c.key.op('=')(x)
-                                  for x in excluded]))
-                s = s.where(not_(exists(subs)))
-            if opers:
-                for k, o, val in opers:
-                    subs = select([1])
-                    subs = subs.where(self.attributes.c.serial ==
-                                      self.versions.c.serial
-                                      ).correlate(self.versions)
-                    subs = subs.where(self.attributes.c.domain == domain)
-                    subs = subs.where(
-                        and_(self.attributes.c.key.op('=')(k),
-                             self.attributes.c.value.op(o)(val)))
-                    s = s.where(exists(subs))
+        for cond in self._construct_size(self.versions, sizeq):
+            s = s.where(cond)
+        for cond in self._construct_filters(self.versions, domain, filterq):
+            s = s.where(cond)
 
         s = s.order_by(d4.c.path)
 
@@ -1342,32 +1472,46 @@ class Node(DBWorker):
         matches = []
         mappend = matches.append
 
-        rp = self.conn.execute(s, start=start)
+        # Fetch the rows in pages and skip each virtual directory found,
+        # by querying again from the path following it. Pages start small
+        # and grow while no virtual directory is found, so that the cost is
+        # proportional to the results, not to the number of paths under the
+        # prefix.
+        fetch = 16
         while True:
-            props = rp.fetchone()
-            if props is None:
-                break
-            path = props[0]
-            idx = path.find(delimiter, pfz)
+            page = min(max(limit - count, 0) + 1, fetch)
+            rp = self.conn.execute(s.limit(page), start=start)
+            rows = rp.fetchall()
+            rp.close()
 
-            if idx < 0:
-                mappend(props)
-                count += 1
+            for props in rows:
+                path = props[0]
+                idx = path.find(delimiter, pfz)
+
+                if idx < 0:
+                    mappend(props)
+                    count += 1
+                    if count >= limit:
+                        return matches, prefixes
+                    continue
+
+                if idx + dz == len(path):
+                    mappend(props)
+                    count += 1
+                    continue  # Get one more, in case there is a path.
+                pf = path[:idx + dz]
+                pappend(pf)
                 if count >= limit:
-                    break
-                continue
-
-            if idx + dz == len(path):
-                mappend(props)
-                count += 1
-                continue  # Get one more, in case there is a path.
-            pf = path[:idx + dz]
-            pappend(pf)
-            if count >= limit:
-                break
+                    return matches, prefixes
 
-            rp = self.conn.execute(s, start=strnextling(pf))  # New start.
-        rp.close()
+                start = strnextling(pf)  # New start.
+                fetch = 16
+                break
+            else:
+                if len(rows) < page:
+                    break
+                start = rows[-1][0]  # Next page.
+                fetch *= 2
 
         return matches, prefixes
 
@@ -1394,9 +1538,23 @@ class Node(DBWorker):
         r.close()
         return l
 
-    def domain_object_list(self, domain, paths, cluster=None):
+    def domain_object_list(self, domain, paths, cluster=None, sort_key=None,
+                           sort_dir='asc', limit=None, marker=None,
+                           filterq=None, sizeq=None):
         """Return a list of (path, property list, attribute dictionary)
            for the objects in the specific domain and cluster.
+
+           The objects are restricted by filterq and sizeq, like
+           in latest_version_list, with filterq terms applying
+           to the attributes of the domain.
+
+           The objects are ordered by path, unless a sort_key is given.
+           The sort_key is either a version property or the key of
+           an attribute in the domain and the objects are ordered by it
+           in sort_dir ('asc' or 'desc') direction and then by path.
+
+           If marker is given, return the objects following the object
+           with that path. Return at most limit objects.
         """
 
         v = self.versions.alias('v')
@@ -1407,27 +1565,71 @@ class Node(DBWorker):
                  v.c.source, v.c.mtime, v.c.muser, v.c.uuid, v.c.checksum,
                  v.c.cluster, v.c.available, v.c.map_check_timestamp,
                  v.c.mapfile, v.c.is_snapshot]
-        cols = props + [a.c.key, a.c.value]
 
-        s = select(cols)
-        if cluster:
-            s = s.where(v.c.cluster == cluster)
-        s = s.where(v.c.serial == a.c.serial)
+        from_obj = n.join(v, v.c.node == n.c.node)
+        key = None
+        if sort_key is not None:
+            if hasattr(v.c, sort_key):
+                key = getattr(v.c, sort_key)
+            else:
+                sa = self.attributes.alias('sa')
+                from_obj = from_obj.outerjoin(
+                    sa, and_(sa.c.serial == v.c.serial,
+                             sa.c.domain == domain,
+                             sa.c.key == sort_key))
+                key = func.coalesce(sa.c.value, '')
+
+        s = select([a.c.serial])
+        s = s.where(a.c.serial == v.c.serial)
         s = s.where(a.c.domain == domain)
         s = s.where(a.c.node == n.c.node)
         s = s.where(a.c.is_latest == true())
+        filters = [exists(s)]
+        if cluster:
+            filters.append(v.c.cluster == cluster)
         if paths:
-            s = s.where(n.c.path.in_(paths))
+            filters.append(n.c.path.in_(paths))
+        filters.extend(self._construct_size(v, sizeq))
+        filters.extend(self._construct_filters(v, domain, filterq))
 
+        if marker is not None:
+            if key is None:
+                filters.append(n.c.path > marker)
+            else:
+                s = select([key], from_obj=[from_obj])
+                s = s.where(and_(n.c.path == marker, *filters))
+                r = self.conn.execute(s)
+                value = r.fetchone()
+                r.close()
+                if value is None:
+                    return []
+                value = value[0]
+                after = key < value if sort_dir == 'desc' else key > value
+                filters.append(or_(after, and_(key == value,
+                                               n.c.path > marker)))
+
+        s = select(props, from_obj=[from_obj]).where(and_(*filters))
+        if key is not None:
+            s = s.order_by(key.desc() if sort_dir == 'desc' else key.asc())
+        s = s.order_by(n.c.path)
+        if limit:
+            s = s.limit(limit)
         r = self.conn.execute(s)
         rows = r.fetchall()
         r.close()
+        if not rows:
+            return []
 
-        group_by = itemgetter(slice(len(props)))
-        rows.sort(key=group_by)
-        groups = groupby(rows, group_by)
-        return [(k[0], k[1:], dict([i[len(props):] for i in data])) for
-                (k, data) in groups]
+        s = select([a.c.serial, a.c.key, a.c.value])
+        s = s.where(a.c.serial.in_([row[1] for row in rows]))
+        s = s.where(a.c.domain == domain)
+        s = s.where(a.c.is_latest == true())
+        r = self.conn.execute(s)
+        attributes = defaultdict(dict)
+        for serial, k, value in r.fetchall():
+            attributes[serial][k] = value
+        r.close()
+        return [(row[0], tuple(row[1:]), attributes[row[1]]) for row in rows]
 
     def get_props(self, paths):
         inner_join = \
@@ -20,6 +20,7 @@ from xfeatures import XFeatures
 from groups import Groups
 from public import Public
 from node import Node
+from pithos.backends.lib.permissions import access_inherit_candidates
 from collections import defaultdict
 
 from dbworker import ESCAPE_CHAR
@@ -96,6 +97,27 @@ class Permissions(XFeatures, Groups, Public, Node):
             del(permissions[WRITE])
         return permissions
 
+    def access_get_bulk(self, paths):
+        """Get permissions for paths."""
+
+        if not paths:
+            return {}
+        j = self.xfeaturevals.join(
+            self.xfeatures,
+            self.xfeatures.c.feature_id == self.xfeaturevals.c.feature_id)
+        s = select([self.xfeatures.c.path,
+                    self.xfeaturevals.c.value,
+                    self.xfeaturevals.c.feature_id,
+                    self.xfeaturevals.c.key],
+                   self.xfeatures.c.path.in_(paths), from_obj=[j])
+        r = self.conn.execute(s)
+        perms = defaultdict(list)
+        for path, value, feature_id, key in r.fetchall():
+            perms[path].append((value, feature_id, key))
+        r.close()
+        return dict((path, self.access_get_for_bulk(perms[path])[0])
+                    for path in paths)
+
     def access_members(self, path):
         feature = self.xfeature_get(path)
         if not feature:
@@ -175,28 +197,45 @@ class Permissions(XFeatures, Groups, Public, Node):
 #         # Compute valid.
 #         return [x[0] for x in r if x[0] in valid]
 
-        # Only keep path components.
-        parts = path.rstrip('/').split('/')
-        valid = []
-        for i in range(1, len(parts)):
-            subp = '/'.join(parts[:i + 1])
-            valid.append(subp)
-            if subp != path:
-                valid.append(subp + '/')
-        return [x for x in valid if self.xfeature_get(x)]
+        valid = access_inherit_candidates(path)
+        if not valid:
+            return []
+        s = select([self.xfeatures.c.path],
+                   self.xfeatures.c.path.in_(valid))
+        r = self.conn.execute(s)
+        found = set(row[0] for row in r.fetchall())
+        r.close()
+        return [x for x in valid if x in found]
+
+    def access_inherit_types(self, path, cluster=0):
+        """Return (path, type) tuples for the paths influencing the access
+           for path, where type is the type of the current version
+           of the object at that path, if it belongs to the cluster,
+           or None. Everything is looked up with a single query.
+        """
+
+        valid = access_inherit_candidates(path)
+        if not valid:
+            return []
+        j = self.xfeatures.outerjoin(
+            self.nodes, self.nodes.c.path == self.xfeatures.c.path)
+        j = j.outerjoin(
+            self.versions,
+            and_(self.versions.c.serial == self.nodes.c.latest_version,
+                 self.versions.c.cluster == cluster))
+        s = select([self.xfeatures.c.path, self.versions.c.type],
+                   self.xfeatures.c.path.in_(valid), from_obj=[j])
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        return [tuple(row) for row in rows]
 
     def access_inherit_bulk(self, paths):
         """Return the paths influencing the access for path."""
 
-        # Only keep path components.
         valid = []
         for path in paths:
-            parts = path.rstrip('/').split('/')
-            for i in range(1, len(parts)):
-                subp = '/'.join(parts[:i + 1])
-                valid.append(subp)
-                if subp != path:
-                    valid.append(subp + '/')
+            valid.extend(access_inherit_candidates(path))
         valid = self.xfeature_get_bulk(valid)
         return [x[1] for x in valid]
 
@@ -14,8 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from time import time
-from operator import itemgetter
-from itertools import groupby
+from collections import defaultdict
 
 from dbworker import DBWorker
 
@@ -165,6 +164,8 @@ class Node(DBWorker):
                     on attributes(domain) """)
         execute(""" create index if not exists idx_attributes_serial_node
                     on attributes(serial, node) """)
+        execute(""" create index if not exists idx_attributes_domain_key_value
+                    on attributes(domain, key, value) """)
 
         execute(""" create table if not exists mapfile_seq
                           ( serial    integer primary key,
@@ -496,6 +497,19 @@ class Node(DBWorker):
             population = 0  # Population isn't recursive
             i += 1
 
+    def statistics_defer(self):
+        """Statistics updates are always applied immediately,
+           as there are no round-trips to save with sqlite.
+        """
+
+        pass
+
+    def statistics_flush(self):
+        pass
+
+    def statistics_discard(self):
+        pass
+
     def statistics_latest(self, node, before=inf, except_cluster=0):
         """Return population, total size and last mtime
            for all latest versions under node that
@@ -1154,37 +1168,96 @@ class Node(DBWorker):
         self.execute(q, args)
         return self.fetchone()
 
-    def domain_object_list(self, domain, paths, cluster=None):
+    def domain_object_list(self, domain, paths, cluster=None, sort_key=None,
+                           sort_dir='asc', limit=None, marker=None,
+                           filterq=None, sizeq=None):
         """Return a list of (path, property list, attribute dictionary)
            for the objects in the specific domain and cluster.
+
+           The objects are restricted by filterq and sizeq, like
+           in latest_version_list, with filterq terms applying
+           to the attributes of the domain.
+
+           The objects are ordered by path, unless a sort_key is given.
+           The sort_key is either a version property or the key of
+           an attribute in the domain and the objects are ordered by it
+           in sort_dir ('asc' or 'desc') direction and then by path.
+
+           If marker is given, return the objects following the object
+           with that path. Return at most limit objects.
         """
 
         props = ('n.path', 'v.serial', 'v.node', 'v.hash', 'v.size', 'v.type',
                  'v.source', 'v.mtime', 'v.muser', 'v.uuid', 'v.checksum',
                  'v.cluster', 'v.available', 'v.map_check_timestamp',
                  'v.mapfile', 'v.is_snapshot')
-        cols = list(props) + ['a.key', 'a.value']
-        args = [domain]
-        q = ("select %s from nodes n, versions v, attributes a "
-             "where v.serial = a.serial and "
-             "a.domain = ? and "
-             "a.node = n.node and "
-             "a.is_latest = 1 ") % ','.join(cols)
+        q = "from nodes n inner join versions v on v.node = n.node "
+        args = []
+        key = None
+        if sort_key is not None:
+            if sort_key in self._props:
+                key = 'v.%s' % sort_key
+            else:
+                q += ("left join attributes sa on sa.serial = v.serial "
+                      "and sa.domain = ? and sa.key = ? ")
+                args += [domain, sort_key]
+                key = "ifnull(sa.value, '')"
+        q += ("where exists (select a.serial from attributes a "
+              "where a.serial = v.serial and "
+              "a.domain = ? and "
+              "a.node = n.node and "
+              "a.is_latest = 1) ")
+        args += [domain]
         if paths:
-            q += ("and path in (%s) " % ','.join('?' for _ in paths))
-            map(args.append, paths)
+            q += ("and n.path in (%s) " % ','.join('?' for _ in paths))
+            args += paths
         if cluster is not None:
-            q += "and v.cluster = ?"
+            q += "and v.cluster = ? "
             args += [cluster]
+        subq, subargs = self._construct_size(sizeq)
+        if subq is not None:
+            q += subq + " "
+            args += subargs
+        subq, subargs = self._construct_filters(domain, filterq)
+        if subq is not None:
+            q += subq + " "
+            args += subargs
 
+        if marker is not None:
+            if key is None:
+                q += "and n.path > ? "
+                args += [marker]
+            else:
+                self.execute("select %s %s and n.path = ?" % (key, q),
+                             args + [marker])
+                value = self.fetchone()
+                if value is None:
+                    return []
+                q += "and (%s %s ? or (%s = ? and n.path > ?)) " % (
+                    key, '<' if sort_dir == 'desc' else '>', key)
+                args += [value[0], value[0], marker]
+
+        q = "select %s %s order by " % (','.join(props), q)
+        if key is not None:
+            q += "%s %s, " % (key, 'desc' if sort_dir == 'desc' else 'asc')
+        q += "n.path"
+        if limit:
+            q += " limit ?"
+            args += [limit]
         self.execute(q, args)
         rows = self.fetchall()
-
-        group_by = itemgetter(slice(len(props)))
-        rows.sort(key=group_by)
-        groups = groupby(rows, group_by)
-        return [(k[0], k[1:], dict([i[len(props):] for i in data])) for
-                (k, data) in groups]
+        if not rows:
+            return []
+
+        serials = [row[1] for row in rows]
+        q = ("select serial, key, value from attributes "
+             "where serial in (%s) and domain = ? and is_latest = 1" %
+             ','.join('?' for _ in serials))
+        self.execute(q, serials + [domain])
+        attributes = defaultdict(dict)
+        for serial, k, value in self.fetchall():
+            attributes[serial][k] = value
+        return [(row[0], tuple(row[1:]), attributes[row[1]]) for row in rows]
 
     def get_props(self, paths):
         q = ("select distinct n.path, v.type "
@@ -17,6 +17,7 @@ from xfeatures import XFeatures
 from groups import Groups
 from public import Public
 from node import Node
+from pithos.backends.lib.permissions import access_inherit_candidates
 from collections import defaultdict
 
 
@@ -92,6 +93,26 @@ class Permissions(XFeatures, Groups, Public, Node):
             del(permissions[WRITE])
         return permissions
 
+    def access_get_bulk(self, paths):
+        """Get permissions for paths."""
+
+        if not paths:
+            return {}
+        perms = defaultdict(list)
+        paths = list(paths)
+        # Stay below the maximum number of host parameters of SQLite.
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i + 500]
+            q = ("select x.path, xvals.value, xvals.feature_id, xvals.key "
+                 "from xfeaturevals xvals join xfeatures x "
+                 "on xvals.feature_id = x.feature_id "
+                 "where x.path in (%s)") % ','.join('?' for _ in chunk)
+            self.execute(q, chunk)
+            for path, value, feature_id, key in self.fetchall():
+                perms[path].append((value, feature_id, key))
+        return dict((path, self.access_get_for_bulk(perms[path])[0])
+                    for path in paths)
+
     def access_members(self, path):
         feature = self.xfeature_get(path)
         if not feature:
@@ -162,28 +183,39 @@ class Permissions(XFeatures, Groups, Public, Node):
 #         # Compute valid.
 #         return [x[0] for x in r if x[0] in valid]
 
-        # Only keep path components.
-        parts = path.rstrip('/').split('/')
-        valid = []
-        for i in range(1, len(parts)):
-            subp = '/'.join(parts[:i + 1])
-            valid.append(subp)
-            if subp != path:
-                valid.append(subp + '/')
-        return [x for x in valid if self.xfeature_get(x)]
+        valid = access_inherit_candidates(path)
+        if not valid:
+            return []
+        q = ("select path from xfeatures where path in (%s)" %
+             ', '.join('?' for x in valid))
+        self.execute(q, valid)
+        found = set(r[0] for r in self.fetchall())
+        return [x for x in valid if x in found]
+
+    def access_inherit_types(self, path, cluster=0):
+        """Return (path, type) tuples for the paths influencing the access
+           for path, where type is the type of the current version
+           of the object at that path, if it belongs to the cluster,
+           or None. Everything is looked up with a single query.
+        """
+
+        valid = access_inherit_candidates(path)
+        if not valid:
+            return []
+        q = ("select x.path, v.type from xfeatures x "
+             "left join nodes n on n.path = x.path "
+             "left join versions v on v.serial = n.latest_version "
+             "and v.cluster = ? "
+             "where x.path in (%s)" % ', '.join('?' for x in valid))
+        self.execute(q, [cluster] + valid)
+        return self.fetchall()
 
     def access_inherit_bulk(self, paths):
         """Return the paths influencing the access for paths."""
 
-        # Only keep path components.
         valid = []
         for path in paths:
-            parts = path.rstrip('/').split('/')
-            for i in range(1, len(parts)):
-                subp = '/'.join(parts[:i + 1])
-                valid.append(subp)
-                if subp != path:
-                    valid.append(subp + '/')
+            valid.extend(access_inherit_candidates(path))
         valid = self.xfeature_get_bulk(valid)
         return [x[1] for x in valid]
 
@@ -22,6 +22,7 @@ import binascii
 from collections import defaultdict, OrderedDict
 from functools import wraps, partial
 from traceback import format_exc
+from threading import Lock
 from time import time
 
 from pithos.workers import glue
@@ -52,34 +53,270 @@ class DisabledAstakosClient(object):
         raise AssertionError(m)
 
 
-# Stripped-down version of the HashMap class found in tools.
+# Based on the HashMap class found in tools.
 
 class HashMap(list):
+    """A list of block hashes that computes its Merkle hash.
+
+    The interior nodes of the tree are cached, bottom-up, and the leaves
+    changed through item assignment, `append`, `extend` or `assign` are
+    tracked, so that `hash` only recomputes the paths from those leaves to
+    the root. Removing or inserting hashes drops the cached tree.
+
+    The tree is equivalent to padding the leaves with zero hashes up to the
+    next power of two. Zero subtrees are never materialized: the last node
+    of a level with an odd number of nodes is paired with the hash of a
+    zero subtree of the respective height.
+    """
 
     def __init__(self, blocksize, blockhash):
         super(HashMap, self).__init__()
         self.blocksize = blocksize
         self.blockhash = blockhash
+        self._levels = None
+        self._dirty = set()
+
+    def _invalidate(self):
+        self._levels = None
+        self._dirty = set()
+
+    def __setitem__(self, index, value):
+        super(HashMap, self).__setitem__(index, value)
+        if isinstance(index, slice):
+            self._invalidate()
+        else:
+            self._dirty.add(index if index >= 0 else len(self) + index)
+
+    def append(self, value):
+        self._dirty.add(len(self))
+        super(HashMap, self).append(value)
+
+    def extend(self, values):
+        start = len(self)
+        super(HashMap, self).extend(values)
+        self._dirty.update(xrange(start, len(self)))
+
+    def __delitem__(self, index):
+        super(HashMap, self).__delitem__(index)
+        self._invalidate()
+
+    def __delslice__(self, i, j):
+        super(HashMap, self).__delslice__(i, j)
+        self._invalidate()
+
+    def __setslice__(self, i, j, values):
+        super(HashMap, self).__setslice__(i, j, values)
+        self._invalidate()
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __imul__(self, n):
+        super(HashMap, self).__imul__(n)
+        self._invalidate()
+        return self
+
+    def insert(self, index, value):
+        super(HashMap, self).insert(index, value)
+        self._invalidate()
+
+    def pop(self, *args):
+        self._invalidate()
+        return super(HashMap, self).pop(*args)
+
+    def remove(self, value):
+        super(HashMap, self).remove(value)
+        self._invalidate()
+
+    def reverse(self):
+        super(HashMap, self).reverse()
+        self._invalidate()
+
+    def sort(self, *args, **kwargs):
+        super(HashMap, self).sort(*args, **kwargs)
+        self._invalidate()
+
+    def assign(self, values):
+        """Replace the hashes, tracking only the ones that differ."""
+        values = list(values)
+        n = min(len(self), len(values))
+        for i in xrange(n):
+            if self[i] != values[i]:
+                self[i] = values[i]
+        if len(values) > n:
+            self.extend(values[n:])
+        elif len(self) > n:
+            super(HashMap, self).__delslice__(n, len(self))
+            self._dirty = set(i for i in self._dirty if i < n)
+            if n:
+                # The last leaf may have lost its sibling.
+                self._dirty.add(n - 1)
 
     def _hash_raw(self, v):
         h = hashlib.new(self.blockhash)
         h.update(v)
         return h.digest()
 
+    def _update_levels(self):
+        hash_raw = self._hash_raw
+        levels = self._levels
+        dirty = self._dirty
+        zero = '\x00' * len(self[0])
+        nodes = self
+        height = 0
+        while len(nodes) > 1:
+            size = (len(nodes) + 1) / 2
+            if height == len(levels):
+                levels.append([])
+            parents = levels[height]
+            del parents[size:]
+            parents.extend([None] * (size - len(parents)))
+            dirty = set(i / 2 for i in dirty)
+            last = len(nodes) - 1
+            for p in dirty:
+                left = 2 * p
+                right = nodes[left + 1] if left < last else zero
+                parents[p] = hash_raw(nodes[left] + right)
+            zero = hash_raw(zero + zero)
+            nodes = parents
+            height += 1
+        del levels[height:]
+
     def hash(self):
         if len(self) == 0:
             return self._hash_raw('')
         if len(self) == 1:
             return self.__getitem__(0)
 
-        h = list(self)
-        s = 2
-        while s < len(h):
-            s = s * 2
-        h += [('\x00' * len(h[0]))] * (s - len(h))
-        while len(h) > 1:
-            h = [self._hash_raw(h[x] + h[x + 1]) for x in range(0, len(h), 2)]
-        return h[0]
+        if self._levels is None:
+            self._levels = []
+            self._dirty = set(xrange(len(self)))
+        if self._dirty:
+            self._update_levels()
+            self._dirty = set()
+        return self._levels[-1][0]
+
+
+class HashMapTrees(object):
+    """Keep the Merkle trees of recently hashed maps, by top hash.
+
+    The trees of a few thousands of blocks are expensive to rebuild, while
+    new object versions usually change only a few blocks of the previous
+    one. The cache is bounded by the total number of cached leaves.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.used = 0
+        self._trees = OrderedDict()
+        self._lock = Lock()
+
+    def pop(self, blockhash, top):
+        """Remove and return the tree with the given top hash, if any."""
+        with self._lock:
+            hashmap = self._trees.pop((blockhash, top), None)
+            if hashmap is not None:
+                self.used -= len(hashmap)
+            return hashmap
+
+    def put(self, hashmap):
+        if len(hashmap) < 2 or len(hashmap) > self.size:
+            return
+        key = (hashmap.blockhash, hashmap.hash())
+        with self._lock:
+            old = self._trees.pop(key, None)
+            if old is not None:
+                self.used -= len(old)
+            self._trees[key] = hashmap
+            self.used += len(hashmap)
+            while self.used > self.size:
+                _, evicted = self._trees.popitem(last=False)
+                self.used -= len(evicted)
+
+
+class HashMapCache(object):
+    """Keep the hashmaps of recently read object versions.
+
+    Maps are stored read-only, so the hashmap of a (mapfile, size) pair
+    never changes and entries need no invalidation. The least recently
+    used ones are evicted when the cached hashes grow past `size` bytes.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self._maps = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def _sizeof(hashmap):
+        return sum(len(h) for h in hashmap)
+
+    def get(self, mapfile, size):
+        """Return a copy of the cached hashmap or None."""
+        key = (mapfile, size)
+        with self._lock:
+            hashmap = self._maps.pop(key, None)
+            if hashmap is None:
+                self.misses += 1
+                return None
+            self._maps[key] = hashmap
+            self.hits += 1
+        return list(hashmap)
+
+    def put(self, mapfile, size, hashmap):
+        hashmap = tuple(hashmap)
+        used = self._sizeof(hashmap)
+        if used > self.size:
+            return
+        key = (mapfile, size)
+        with self._lock:
+            old = self._maps.pop(key, None)
+            if old is not None:
+                self.used -= self._sizeof(old)
+            self._maps[key] = hashmap
+            self.used += used
+            while self.used > self.size:
+                _, evicted = self._maps.popitem(last=False)
+                self.used -= self._sizeof(evicted)
+
+
+_hashmap_caches = {}
+_hashmap_caches_lock = Lock()
+
+
+def get_hashmap_cache(size):
+    """Return the hashmap cache of the given size.
+
+    All the backends of a process that use the same size share a single
+    cache instance.
+    """
+    with _hashmap_caches_lock:
+        cache = _hashmap_caches.get(size)
+        if cache is None:
+            cache = _hashmap_caches[size] = HashMapCache(size)
+        return cache
+
+
+_hashmap_trees = {}
+_hashmap_trees_lock = Lock()
+
+
+def get_hashmap_trees(size):
+    """Return the Merkle tree cache of the given size.
+
+    All the backends of a process that use the same size share a single
+    cache instance.
+    """
+    with _hashmap_trees_lock:
+        trees = _hashmap_trees.get(size)
+        if trees is None:
+            trees = _hashmap_trees[size] = HashMapTrees(size)
+        return trees
+
 
 # Default modules and settings.
 DEFAULT_DB_MODULE = 'pithos.backends.lib.sqlalchemy'
@@ -119,6 +356,8 @@ DEFAULT_MAPFILE_PREFIX = 'snf_file_'
 DEFAULT_RESOURCE_MAX_METADATA = 32
 DEFAULT_ACC_MAX_GROUPS = 32
 DEFAULT_ACC_MAX_GROUP_MEMBERS = 32
+DEFAULT_HASHMAP_CACHE_SIZE = 0  # No cache.
+DEFAULT_HASHMAP_TREES_SIZE = 0  # No cache.
 
 logger = logging.getLogger(__name__)
 
@@ -248,7 +487,10 @@ class ModularBackend(object):
                  mapfile_prefix=DEFAULT_MAPFILE_PREFIX,
                  resource_max_metadata=DEFAULT_RESOURCE_MAX_METADATA,
                  acc_max_groups=DEFAULT_ACC_MAX_GROUPS,
-                 acc_max_group_members=DEFAULT_ACC_MAX_GROUP_MEMBERS):
+                 acc_max_group_members=DEFAULT_ACC_MAX_GROUP_MEMBERS,
+                 defer_statistics=False,
+                 hashmap_cache_size=DEFAULT_HASHMAP_CACHE_SIZE,
+                 hashmap_trees_size=DEFAULT_HASHMAP_TREES_SIZE):
 
         not_nullable = ('block_size', 'hash_algorithm', 'block_params',
                         'public_url_security', 'public_url_alphabet',
@@ -281,6 +523,13 @@ class ModularBackend(object):
         self.resource_max_metadata = resource_max_metadata
         self.acc_max_groups = acc_max_groups
         self.acc_max_group_members = acc_max_group_members
+        self.defer_statistics = defer_statistics
+        self.hashmap_cache = None
+        if hashmap_cache_size:
+            self.hashmap_cache = get_hashmap_cache(hashmap_cache_size)
+        self.hashmap_trees = None
+        if hashmap_trees_size:
+            self.hashmap_trees = get_hashmap_trees(hashmap_trees_size)
 
         def load_module(m):
             __import__(m)
@@ -351,10 +600,15 @@ class ModularBackend(object):
         self.wrapper.execute()
         self.serials = []
         self._reset_allowed_paths()
+        if self.defer_statistics:
+            self.node.statistics_defer()
         self.in_transaction = True
 
     def post_exec(self, success_status=True):
         if success_status:
+            if self.defer_statistics:
+                self.node.statistics_flush()
+
             # register serials
             if self.serials:
                 self.commission_serials.insert_many(
@@ -381,6 +635,8 @@ class ModularBackend(object):
                     reject_serials=self.serials)
                 self.commission_serials.delete_many(
                     r['rejected'])
+            if self.defer_statistics:
+                self.node.statistics_discard()
             self.wrapper.rollback()
         self.in_transaction = False
 
@@ -1395,7 +1651,15 @@ class ModularBackend(object):
             size = props[self.SIZE]
             if size == 0:
                 return [self.empty_string_hash]
-        return self.store.map_get(props[self.MAPFILE], props[self.SIZE])
+
+        mapfile, size = props[self.MAPFILE], props[self.SIZE]
+        if self.hashmap_cache is None:
+            return self.store.map_get(mapfile, size)
+        hashmap = self.hashmap_cache.get(mapfile, size)
+        if hashmap is None:
+            hashmap = self.store.map_get(mapfile, size)
+            self.hashmap_cache.put(mapfile, size, hashmap)
+        return hashmap
 
     @debug_method
     @backend_method
@@ -1585,6 +1849,7 @@ class ModularBackend(object):
                 "The object's size does not match "
                 "with the object's hashmap length")
 
+        map_ = None
         try:
             path, node = self._lookup_object(account, container, name,
                                              lock_container=True)
@@ -1599,11 +1864,17 @@ class ModularBackend(object):
                 if props[self.IS_SNAPSHOT]:
                     raise IllegalOperationError(
                         'Cannot update Archipelago volume hashmap.')
+                # Reuse the tree of the previous version, if available.
+                if props[self.HASH] and self.hashmap_trees is not None:
+                    map_ = self.hashmap_trees.pop(
+                        self.hash_algorithm,
+                        self._unhexlify_hash(props[self.HASH]))
         meta = meta or {}
         if size == 0:  # No such thing as an empty hashmap.
             hashmap = [self.put_block('')]
-        map_ = HashMap(self.block_size, self.hash_algorithm)
-        map_.extend([self._unhexlify_hash(x) for x in hashmap])
+        if map_ is None:
+            map_ = HashMap(self.block_size, self.hash_algorithm)
+        map_.assign([self._unhexlify_hash(x) for x in hashmap])
         missing = self.store.block_search(map_)
         if missing:
             ie = IndexError()
@@ -1611,6 +1882,8 @@ class ModularBackend(object):
             raise ie
 
         hash_ = map_.hash()
+        if self.hashmap_trees is not None:
+            self.hashmap_trees.put(map_)
         hexlified = binascii.hexlify(hash_)
         # _update_object_hash() locks destination path
         dest_version_id, _, mapfile = self._update_object_hash(
@@ -2070,6 +2343,22 @@ class ModularBackend(object):
             raise ItemNotExists("Block does not exist")
         return block
 
+    def get_blocks(self, hashes):
+        """Return the data of the given blocks, in the same order.
+
+        The blocks are requested from the storage all at once, instead of
+        waiting for each one before requesting the next.
+
+        Raises:
+            ItemNotExists: A block does not exist
+        """
+
+        logger.debug("get_blocks: %s", len(hashes))
+        blocks = self.store.block_get_archipelago_bulk(hashes)
+        if len(blocks) != len(hashes) or not all(blocks):
+            raise ItemNotExists("Block does not exist")
+        return blocks
+
     def put_block(self, data):
         """Store a block and return the hash."""
 
@@ -2514,24 +2803,25 @@ class ModularBackend(object):
 
     def _get_permissions_path(self, account, container, name):
         path = '/'.join((account, container, name))
-        permission_paths = self.permissions.access_inherit(path)
-        permission_paths.sort()
-        permission_paths.reverse()
-        for p in permission_paths:
+        if path in self.permissions_paths:
+            return self.permissions_paths[path]
+
+        permissions_path = None
+        types = dict(self.permissions.access_inherit_types(path,
+                                                           CLUSTER_NORMAL))
+        for p in sorted(types, reverse=True):
             if p == path:
-                return p
-            else:
-                if p.count('/') < 2:
-                    continue
-                node = self.node.node_lookup(p)
-                props = None
-                if node is not None:
-                    props = self.node.version_lookup(node, inf, CLUSTER_NORMAL)
-                if props is not None:
-                    if props[self.TYPE].split(';', 1)[0].strip() in (
-                            'application/directory', 'application/folder'):
-                        return p
-        return None
+                permissions_path = p
+                break
+            if p.count('/') < 2:
+                continue
+            ctype = types[p]
+            if ctype is not None and ctype.split(';', 1)[0].strip() in (
+                    'application/directory', 'application/folder'):
+                permissions_path = p
+                break
+        self.permissions_paths[path] = permissions_path
+        return permissions_path
 
     def _get_permissions_path_bulk(self, account, container, names):
         formatted_paths = []
@@ -2568,6 +2858,7 @@ class ModularBackend(object):
     def _reset_allowed_paths(self):
         self.read_allowed_paths = defaultdict(set)
         self.write_allowed_paths = defaultdict(set)
+        self.permissions_paths = {}
 
     @check_allowed_paths(action=0)
     def _can_read_account(self, user, account):
@@ -2645,13 +2936,25 @@ class ModularBackend(object):
 
     @debug_method
     @backend_method
-    def get_domain_objects(self, domain, user=None, check_permissions=True):
+    def get_domain_objects(self, domain, user=None, check_permissions=True,
+                           sort_key=None, sort_dir='asc', limit=None,
+                           marker=None, keys=None, size_range=None):
         """List objects having metadata in the specific domain
 
            If user is provided list only objects accessible to the user.
            Otherwise list all the objects for the specific domain
            ignoring permissions (check_permissions should be False)
 
+           The objects are ordered by path, unless a sort_key is given,
+           which is either a version property (e.g. 'uuid', 'size', 'mtime')
+           or the key of a metadata entry in the domain. If marker is given,
+           list the objects following the object with that path.
+           Return at most limit objects.
+
+           Like in list_objects, keys are queries on the metadata of the
+           domain and size_range is a (from, to) byte size range that the
+           listed objects must satisfy.
+
            Raises:
                NotAllowedError: if check_permissions is True and user has not
                                 access to the object
@@ -2670,10 +2973,14 @@ class ModularBackend(object):
                                      'permission check should be enforced.')
             allowed_paths = None
         obj_list = self.node.domain_object_list(
-            domain, allowed_paths, CLUSTER_NORMAL)
+            domain, allowed_paths, CLUSTER_NORMAL, sort_key=sort_key,
+            sort_dir=sort_dir, limit=limit, marker=marker, filterq=keys,
+            sizeq=size_range)
+        permissions = self.permissions.access_get_bulk(
+            [path for path, _, _ in obj_list])
         return [(path,
                  self._build_metadata(props, user_defined_meta),
-                 self.permissions.access_get(path)) for
+                 permissions[path]) for
                 path, props, user_defined_meta in obj_list]
 
     # util functions
@@ -0,0 +1,121 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from pithos.backends.lib.hashfiler.blockcache import (BlockCache,
+                                                      SharedBlockCache)
+from pithos.backends.test.util import get_random_data
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestBlocksMixin(object):
+    def test_get_blocks(self):
+        data = [get_random_data(self.block_size) for i in range(3)]
+        hashes = [self.b.put_block(d) for d in data]
+
+        self.assertEqual(self.b.get_blocks([]), [])
+        self.assertEqual(self.b.get_blocks(hashes), data)
+
+        # order and duplicates are preserved
+        hashes = [hashes[2], hashes[0], hashes[2]]
+        self.assertEqual(self.b.get_blocks(hashes),
+                         [data[2], data[0], data[2]])
+
+    def test_get_blocks_padded(self):
+        data = get_random_data(self.block_size / 2)
+        h = self.b.put_block(data)
+        empty = self.b.put_block('')
+
+        padding = '\x00' * (self.block_size - len(data))
+        self.assertEqual(self.b.get_blocks([h, empty]),
+                         [data + padding, '\x00' * self.block_size])
+        self.assertEqual(self.b.get_blocks([h])[0], self.b.get_block(h))
+
+    def test_update_object_hashmap_missing_blocks(self):
+        account = self.account
+        self.b.put_container(account, account, 'c')
+        present = self.b.put_block(get_random_data(self.block_size))
+        missing = ['%064x' % i for i in (1, 2)]
+        hashmap = [missing[0], present, missing[1], missing[0]]
+
+        try:
+            self.b.update_object_hashmap(account, account, 'c', 'o',
+                                         len(hashmap) * self.block_size,
+                                         'application/octet-stream',
+                                         hashmap, checksum='',
+                                         domain='pithos')
+        except IndexError as ie:
+            # each missing block is reported once, in hashmap order
+            self.assertEqual(ie.data, missing)
+        else:
+            self.fail('Missing blocks were not reported')
+
+
+class BlockCacheTest(unittest.TestCase):
+    def get_cache(self, size):
+        return BlockCache(size)
+
+    def test_get_put(self):
+        cache = self.get_cache(100)
+        self.assertEqual(cache.get('a'), None)
+        cache.put('a', 'x' * 10)
+        self.assertEqual(cache.get('a'), 'x' * 10)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_lru_eviction(self):
+        cache = self.get_cache(30)
+        for key in 'abc':
+            cache.put(key, key * 10)
+        cache.get('a')  # b is now the least recently used
+        cache.put('d', 'd' * 10)
+        self.assertEqual(cache.get('b'), None)
+        for key in 'acd':
+            self.assertEqual(cache.get(key), key * 10)
+
+    def test_oversized_block(self):
+        cache = self.get_cache(5)
+        cache.put('a', 'a' * 10)
+        self.assertEqual(cache.get('a'), None)
+
+
+class SharedBlockCacheTest(BlockCacheTest):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get_cache(self, size):
+        cache = SharedBlockCache(size, self.path)
+        cache._sweep_threshold = 1
+        return cache
+
+    def test_lru_eviction(self):
+        cache = self.get_cache(30)
+        for i, key in enumerate('abc'):
+            cache.put(key, key * 10)
+            os.utime(os.path.join(self.path, key), (i, i))
+        cache.get('a')  # b is now the least recently used
+        cache.put('d', 'd' * 10)
+        self.assertEqual(cache.get('b'), None)
+        for key in 'acd':
+            self.assertEqual(cache.get(key), key * 10)
+
+    def test_shared(self):
+        self.get_cache(100).put('a', 'x' * 10)
+        self.assertEqual(self.get_cache(100).get('a'), 'x' * 10)
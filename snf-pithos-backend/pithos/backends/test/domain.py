@@ -0,0 +1,88 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class TestDomainObjectsMixin(object):
+    domain = 'plankton'
+
+    def _create_domain_objects(self):
+        account = self.account
+        self.b.put_container(account, account, 'images')
+        names = {'img1': 'c', 'img2': 'a', 'img3': 'b', 'img4': 'a'}
+        for obj, name in sorted(names.items()):
+            self.upload_object(account, account, 'images', obj,
+                               length=int(obj[-1]) * 10)
+            self.b.update_object_meta(account, account, 'images', obj,
+                                      self.domain, {'plankton:name': name})
+        self.upload_object(account, account, 'images', 'other')
+        self.b.update_object_permissions(account, account, 'images', 'img2',
+                                         {'read': ['*']})
+        return names
+
+    def _list(self, **kwargs):
+        return [path.rsplit('/', 1)[-1] for path, _, _ in
+                self.b.get_domain_objects(self.domain, self.account,
+                                          **kwargs)]
+
+    def test_get_domain_objects(self):
+        self._create_domain_objects()
+        objects = self.b.get_domain_objects(self.domain, self.account)
+        self.assertEqual([o[0].rsplit('/', 1)[-1] for o in objects],
+                         ['img1', 'img2', 'img3', 'img4'])
+        for path, meta, permissions in objects:
+            if path.endswith('img2'):
+                self.assertEqual(permissions['read'], ['*'])
+            else:
+                self.assertEqual(permissions, {})
+            self.assertTrue('plankton:name' in meta)
+
+    def test_get_domain_objects_sorted(self):
+        self._create_domain_objects()
+        self.assertEqual(self._list(sort_key='plankton:name'),
+                         ['img2', 'img4', 'img3', 'img1'])
+        self.assertEqual(self._list(sort_key='plankton:name',
+                                    sort_dir='desc'),
+                         ['img1', 'img3', 'img2', 'img4'])
+        self.assertEqual(self._list(sort_key='uuid'), sorted(
+            self._list(), key=lambda o: self.b.get_object_meta(
+                self.account, self.account, 'images', o)['uuid']))
+
+    def test_get_domain_objects_paginated(self):
+        self._create_domain_objects()
+        prefix = '/'.join((self.account, 'images', ''))
+        for kwargs in ({}, {'sort_key': 'plankton:name'},
+                       {'sort_key': 'size', 'sort_dir': 'desc'}):
+            expected = self._list(**kwargs)
+            objects = []
+            marker = None
+            while True:
+                page = self._list(limit=3, marker=marker, **kwargs)
+                objects.extend(page)
+                if len(page) < 3:
+                    break
+                marker = prefix + page[-1]
+            self.assertEqual(objects, expected)
+
+    def test_get_domain_objects_filtered(self):
+        names = self._create_domain_objects()
+        self.assertEqual(self._list(keys=['plankton:name=a']),
+                         ['img2', 'img4'])
+        self.assertEqual(self._list(keys=['plankton:name!=a'],
+                                    sort_key='plankton:name'),
+                         ['img3', 'img1'])
+        self.assertEqual(self._list(size_range=(None, 25)), ['img1', 'img2'])
+        self.assertEqual(self._list(size_range=(25, None)), ['img3', 'img4'])
+        self.assertEqual(self._list(keys=['!plankton:name']), [])
+        self.assertEqual(len(self._list(keys=['plankton:name'])), len(names))
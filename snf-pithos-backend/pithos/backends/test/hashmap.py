@@ -0,0 +1,190 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests and benchmark for the Merkle hash computation of HashMap.
+
+Run this module to benchmark full against incremental hashing of maps of
+1k, 10k and 100k blocks.
+"""
+
+from pithos.backends.modular import HashMap, HashMapTrees, HashMapCache
+
+import hashlib
+import os
+import time
+import unittest
+
+HASH_ALGORITHM = 'sha256'
+
+
+def merkle(hashes):
+    """Compute the top hash by padding the leaves to a power of two."""
+    if len(hashes) == 0:
+        return hashlib.new(HASH_ALGORITHM, '').digest()
+    if len(hashes) == 1:
+        return hashes[0]
+
+    h = list(hashes)
+    s = 2
+    while s < len(h):
+        s = s * 2
+    h += [('\x00' * len(h[0]))] * (s - len(h))
+    while len(h) > 1:
+        h = [hashlib.new(HASH_ALGORITHM, h[x] + h[x + 1]).digest()
+             for x in range(0, len(h), 2)]
+    return h[0]
+
+
+def random_hashes(n):
+    return [hashlib.new(HASH_ALGORITHM, os.urandom(8)).digest()
+            for i in xrange(n)]
+
+
+def new_hashmap(hashes):
+    hashmap = HashMap(4 * 1024 * 1024, HASH_ALGORITHM)
+    hashmap.extend(hashes)
+    return hashmap
+
+
+class HashMapTest(unittest.TestCase):
+    def test_hash(self):
+        for n in range(0, 34):
+            hashes = random_hashes(n)
+            self.assertEqual(new_hashmap(hashes).hash(), merkle(hashes))
+
+    def test_incremental(self):
+        hashes = random_hashes(21)
+        hashmap = new_hashmap(hashes)
+        hashmap.hash()
+
+        hashes[3] = hashmap[3] = random_hashes(1)[0]
+        hashes[-1] = hashmap[-1] = random_hashes(1)[0]
+        self.assertEqual(hashmap.hash(), merkle(hashes))
+
+        more = random_hashes(12)
+        hashes.extend(more)
+        hashmap.extend(more)
+        self.assertEqual(hashmap.hash(), merkle(hashes))
+
+        hashmap.append(hashes[0])
+        hashes.append(hashes[0])
+        self.assertEqual(hashmap.hash(), merkle(hashes))
+
+    def test_assign(self):
+        hashes = random_hashes(40)
+        hashmap = new_hashmap(hashes)
+        hashmap.hash()
+
+        for n in (40, 33, 17, 2, 1, 9, 64):
+            hashes = hashes[:n] + random_hashes(max(0, n - len(hashes)))
+            hashes[n / 2] = random_hashes(1)[0]
+            hashmap.assign(hashes)
+            self.assertEqual(list(hashmap), hashes)
+            self.assertEqual(hashmap.hash(), merkle(hashes))
+
+    def test_invalidate(self):
+        hashes = random_hashes(10)
+        hashmap = new_hashmap(hashes)
+        hashmap.hash()
+
+        del hashes[4]
+        del hashmap[4]
+        self.assertEqual(hashmap.hash(), merkle(hashes))
+
+        hashes.insert(0, hashes.pop())
+        hashmap.insert(0, hashmap.pop())
+        self.assertEqual(hashmap.hash(), merkle(hashes))
+
+        more = random_hashes(3)
+        hashes += more
+        hashmap += more
+        self.assertEqual(hashmap.hash(), merkle(hashes))
+
+    def test_trees(self):
+        trees = HashMapTrees(10)
+        hashmap = new_hashmap(random_hashes(6))
+        trees.put(hashmap)
+        top = hashmap.hash()
+        self.assertTrue(trees.pop(HASH_ALGORITHM, top) is hashmap)
+        self.assertEqual(trees.pop(HASH_ALGORITHM, top), None)
+
+        # the trees are bounded by their total number of leaves
+        trees.put(hashmap)
+        other = new_hashmap(random_hashes(6))
+        trees.put(other)
+        self.assertEqual(trees.used, 6)
+        self.assertEqual(trees.pop(HASH_ALGORITHM, top), None)
+        self.assertTrue(trees.pop(HASH_ALGORITHM, other.hash()) is other)
+
+
+class HashMapCacheTest(unittest.TestCase):
+    def test_get_put(self):
+        cache = HashMapCache(4 * 64)
+        hashmap = [h.encode('hex') for h in random_hashes(2)]
+        self.assertEqual(cache.get('map1', 10), None)
+        cache.put('map1', 10, hashmap)
+        self.assertEqual(cache.get('map1', 10), hashmap)
+        self.assertEqual(cache.get('map1', 20), None)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertEqual(cache.used, 2 * 64)
+
+        # callers may modify the returned hashmaps
+        cache.get('map1', 10).append('')
+        self.assertEqual(cache.get('map1', 10), hashmap)
+
+    def test_evict(self):
+        cache = HashMapCache(4 * 64)
+        hashmaps = [[h.encode('hex') for h in random_hashes(2)]
+                    for i in range(3)]
+        cache.put('map0', 1, hashmaps[0])
+        cache.put('map1', 1, hashmaps[1])
+        cache.get('map0', 1)
+        cache.put('map2', 1, hashmaps[2])
+        self.assertEqual(cache.used, 4 * 64)
+        self.assertEqual(cache.get('map0', 1), hashmaps[0])
+        self.assertEqual(cache.get('map1', 1), None)
+        self.assertEqual(cache.get('map2', 1), hashmaps[2])
+
+        # hashmaps larger than the cache are not kept
+        cache.put('map3', 1, hashmaps[0] + hashmaps[1] + hashmaps[2])
+        self.assertEqual(cache.get('map3', 1), None)
+        self.assertEqual(cache.used, 4 * 64)
+
+
+def benchmark(sizes=(1000, 10000, 100000), changes=4, repeat=3):
+    for n in sizes:
+        hashes = random_hashes(n)
+        hashmap = new_hashmap(hashes)
+
+        start = time.time()
+        for i in xrange(repeat):
+            new_hashmap(hashes).hash()
+        full = (time.time() - start) / repeat
+
+        hashmap.hash()
+        start = time.time()
+        for i in xrange(repeat):
+            for j in xrange(changes):
+                hashes[(i * changes + j) * 7919 % n] = random_hashes(1)[0]
+            hashmap.assign(hashes)
+            hashmap.hash()
+        incremental = (time.time() - start) / repeat
+
+        print '%7d blocks: full %9.3f ms, %d changed blocks %9.3f ms' % (
+            n, full * 1000, changes, incremental * 1000)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,78 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class TestStatisticsMixin(object):
+    def _test_container_statistics(self):
+        account = self.account
+        self.b.put_container(account, account, 'c')
+
+        self.b.pre_exec()
+        try:
+            sizes = [len(self.upload_object(account, account, 'c', o))
+                     for o in ('o1', 'o2', 'o3')]
+            self.b.delete_object(account, account, 'c', 'o2')
+            meta = self.b.get_container_meta(account, account, 'c')
+            self.assertEqual(meta['count'], 2)
+            self.assertEqual(meta['bytes'], sizes[0] + sizes[2])
+        finally:
+            self.b.post_exec()
+
+        sizes.append(len(self.upload_object(account, account, 'c', 'o1')))
+        meta = self.b.get_container_meta(account, account, 'c')
+        self.assertEqual(meta['count'], 2)
+        self.assertEqual(meta['bytes'], sizes[2] + sizes[3])
+
+    def test_container_statistics(self):
+        self._test_container_statistics()
+
+    def test_container_statistics_deferred(self):
+        self.b.defer_statistics = True
+        self._test_container_statistics()
+
+    def test_delete_container_deferred(self):
+        account = self.account
+        self.b.defer_statistics = True
+        self.b.put_container(account, account, 'c1')
+        self.b.put_container(account, account, 'c2')
+        size = len(self.upload_object(account, account, 'c2', 'o1'))
+
+        self.b.pre_exec()
+        try:
+            self.upload_object(account, account, 'c1', 'o1')
+            self.b.delete_object(account, account, 'c1', 'o1')
+            self.b.delete_container(account, account, 'c1')
+        finally:
+            self.b.post_exec()
+
+        self.assertEqual(self.b.list_containers(account, account), ['c2'])
+        meta = self.b.get_container_meta(account, account, 'c2')
+        self.assertEqual(meta['count'], 1)
+        self.assertEqual(meta['bytes'], size)
+
+    def test_container_statistics_rollback(self):
+        account = self.account
+        self.b.defer_statistics = True
+        self.b.put_container(account, account, 'c')
+        self.upload_object(account, account, 'c', 'o1')
+
+        self.b.pre_exec()
+        try:
+            self.upload_object(account, account, 'c', 'o2')
+        finally:
+            self.b.post_exec(False)
+
+        meta = self.b.get_container_meta(account, account, 'c')
+        self.assertEqual(meta['count'], 1)